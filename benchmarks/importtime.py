@@ -0,0 +1,178 @@
+"""
+Import-time benchmark of the plugin modules, based on `python -X importtime`.
+
+Scenarios:
+
+    modules  - imports the plugin modules on top of the FlexGet core; reports the time of every module
+               and the heavy third-party modules imported on their behalf
+    help     - `flexget --help` with the plugins installed into a temporary config directory
+    execute  - `flexget execute` of a trivial task, with the same setup
+
+`--against <git revision>` runs the same scenarios over the plugins of another revision, to show the savings.
+
+Usage:
+
+    python -m benchmarks.importtime
+    python -m benchmarks.importtime --runs 5 --against HEAD~1
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Text, Tuple
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PLUGIN_MODULES = ('alexfilm', 'baibako', 'kinozal', 'lostfilm', 'newstudio')
+HEAVY_MODULES = ('bs4', 'bencodepy', 'html5lib', 'soupsieve')
+
+CONFIG = """tasks:
+  noop:
+    mock: []
+    accept_all: yes
+"""
+
+# module -> (self time, cumulative time), in microseconds
+ImportTimes = Dict[Text, Tuple[int, int]]
+
+
+def parse_importtime(output: Text) -> Tuple[ImportTimes, ImportTimes]:
+    """Returns the times of all imported modules and of the top-level imports only."""
+
+    modules = dict()
+    top_level = dict()
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|', 2)
+        if not self_time.strip().isdigit():
+            continue  # the header
+        times = (int(self_time), int(cumulative_time))
+        modules[name.strip()] = times
+        if not name.startswith('  '):
+            top_level[name.strip()] = times
+    return modules, top_level
+
+
+def run_python(code: Text, cwd: Text) -> Tuple[float, Text]:
+    """Runs the code with `-X importtime`; returns the wall time and the importtime report."""
+
+    started = time.monotonic()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.monotonic() - started
+    if process.returncode != 0:
+        errors = [line for line in process.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError('`{0}` failed:\n{1}'.format(code, '\n'.join(errors[-20:])))
+    return elapsed, process.stderr
+
+
+def flexget_code(config_path: Text, *args: Text) -> Text:
+    argv = ['flexget', '-c', config_path] + list(args)
+    return 'import sys; from flexget import main; sys.argv = {0!r}; main()'.format(argv)
+
+
+class Scenario(object):
+    def __init__(self, name: Text, code: Text, cwd: Text) -> None:
+        self.name = name
+        self.code = code
+        self.cwd = cwd
+
+    def run(self, runs: int) -> Tuple[float, ImportTimes, ImportTimes]:
+        """Returns the median wall time and the importtime report of the fastest run."""
+
+        run_python(self.code, self.cwd)  # warm up: compiles the plugins and the rest of the bytecode cache
+        results = [run_python(self.code, self.cwd) for _ in range(runs)]
+        fastest = min(results, key=lambda result: result[0])
+        modules, top_level = parse_importtime(fastest[1])
+        return statistics.median(result[0] for result in results), modules, top_level
+
+
+def setup_plugins(plugins_dir: Text, work_dir: Text) -> List[Scenario]:
+    """Prepares a package root and a FlexGet config directory with the plugins; returns the scenarios over them."""
+
+    package_root = os.path.join(work_dir, 'package')
+    shutil.copytree(plugins_dir, os.path.join(package_root, 'plugins'),
+                    ignore=shutil.ignore_patterns('__pycache__'))
+
+    config_dir = os.path.join(work_dir, 'config')
+    shutil.copytree(plugins_dir, os.path.join(config_dir, 'plugins'),
+                    ignore=shutil.ignore_patterns('__pycache__', '__init__.py'))
+    config_path = os.path.join(config_dir, 'config.yml')
+    with open(config_path, 'w') as f:
+        f.write(CONFIG)
+
+    modules_code = 'import flexget.manager, flexget.plugin; import {0}'.format(
+        ', '.join('plugins.' + name for name in PLUGIN_MODULES))
+    return [
+        Scenario('modules', modules_code, package_root),
+        Scenario('help', flexget_code(config_path, '--help'), config_dir),
+        Scenario('execute', flexget_code(config_path, 'execute', '--tasks', 'noop'), config_dir),
+    ]
+
+
+def export_plugins(revision: Text, target_dir: Text) -> Text:
+    """Extracts the plugins of the git revision; returns their directory."""
+
+    archive = subprocess.run(['git', 'archive', revision, 'plugins'], cwd=ROOT_DIR, stdout=subprocess.PIPE, check=True)
+    subprocess.run(['tar', '-x', '-C', target_dir], input=archive.stdout, check=True)
+    return os.path.join(target_dir, 'plugins')
+
+
+def report_modules(modules: ImportTimes, top_level: ImportTimes) -> List[Text]:
+    lines = list()
+    plugins_total = sum(times[1] for name, times in top_level.items() if name.split('.')[0] == 'plugins')
+    lines.append('    plugins total: {0:.1f} ms'.format(plugins_total / 1000.0))
+    for name in sorted(modules):
+        if name.split('.')[0] == 'plugins':
+            lines.append('      {0:<24} self {1:7.1f} ms, cumulative {2:7.1f} ms'.format(
+                name, modules[name][0] / 1000.0, modules[name][1] / 1000.0))
+    heavy = [name for name in HEAVY_MODULES if name in modules]
+    lines.append('    heavy modules imported: {0}'.format(', '.join(heavy) if heavy else 'none'))
+    return lines
+
+
+def main(argv: List[Text] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.importtime', description='Import-time benchmark')
+    parser.add_argument('--runs', type=int, default=3, help='runs of every scenario (the median wall time is shown)')
+    parser.add_argument('--against', metavar='REVISION', help='compare with the plugins of the git revision')
+    parser.add_argument('-k', dest='scenario', choices=('modules', 'help', 'execute'), help='run only the scenario')
+    options = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='importtime-')
+    try:
+        variants = [('working tree', os.path.join(ROOT_DIR, 'plugins'))]
+        if options.against:
+            os.makedirs(os.path.join(work_dir, 'against'))
+            variants.append((options.against, export_plugins(options.against, os.path.join(work_dir, 'against'))))
+
+        walls = dict()  # type: Dict[Text, Dict[Text, float]]
+        for index, (label, plugins_dir) in enumerate(variants):
+            print('{0}:'.format(label))
+            for scenario in setup_plugins(plugins_dir, os.path.join(work_dir, str(index))):
+                if options.scenario and scenario.name != options.scenario:
+                    continue
+                wall, modules, top_level = scenario.run(options.runs)
+                walls.setdefault(scenario.name, dict())[label] = wall
+                print('  {0}: {1:.3f}s (median of {2})'.format(scenario.name, wall, options.runs))
+                if scenario.name == 'modules':
+                    print('\n'.join(report_modules(modules, top_level)))
+
+        if options.against:
+            print('saved against {0}:'.format(options.against))
+            for name, wall_by_label in walls.items():
+                saved = wall_by_label[options.against] - wall_by_label['working tree']
+                print('  {0}: {1:.3f}s'.format(name, saved))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
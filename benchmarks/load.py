@@ -0,0 +1,190 @@
+"""
+Offline load test of a tracker plugin against the in-process stub tracker (see `stub_tracker`).
+
+Runs a number of searches (and the follow-up url rewrite or filter phase) of one plugin over a synthetic catalog
+and reports the wall time, the served requests and the reached concurrency.
+
+Usage:
+
+    python -m benchmarks.load kinozal --searches 20 --pages 10 --latency 0.05 --no-throttle
+    python -m benchmarks.load lostfilm --shows 10000 --error-rate 0.01 --no-throttle
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Text
+
+import requests
+from flexget.entry import Entry
+from flexget.manager import Base, Session
+from sqlalchemy import create_engine
+
+from plugins import alexfilm, baibako, kinozal, lostfilm, newstudio, stats
+from plugins.utils import RateLimiter
+from .stub_tracker import Catalog, StubTracker
+
+
+class LoadTask(object):
+    """The part of a FlexGet task the plugins use."""
+
+    def __init__(self, name: Text, session: requests.Session, config: Dict = None) -> None:
+        self.name = name
+        self.requests = session
+        self.config = config or dict()
+        self.entries = list()
+        self.failures = list()
+
+    @property
+    def accepted(self) -> List[Entry]:
+        return [entry for entry in self.entries if entry.accepted]
+
+
+def setup_database(directory: Text) -> None:
+    """
+    Binds the FlexGet session to a database with the plugin tables in the directory.
+    A file with a connection per thread, as FlexGet has it: the workers of `map_concurrently` must not share one.
+    """
+
+    path = os.path.join(directory, 'db-load.sqlite')
+    engine = create_engine('sqlite:///{0}'.format(path), connect_args={'check_same_thread': False, 'timeout': 10})
+    Session.configure(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        table.create(engine, checkfirst=True)
+
+
+def disable_throttling() -> None:
+    """Drops the politeness pauses of the plugins, so that only the stub latency is measured."""
+
+    for module in (alexfilm, baibako, kinozal, lostfilm, newstudio):
+        module.sleep = lambda seconds: None
+        for name in ('URL_REWRITE_LIMITER', 'SEARCH_LIMITER'):
+            if hasattr(module, name):
+                setattr(module, name, RateLimiter(0))
+
+
+def search_entry(catalog: Catalog, rng: random.Random) -> Entry:
+    index = rng.randrange(catalog.shows)
+    season = rng.randint(1, catalog.seasons)
+    episode = rng.randint(1, catalog.episodes)
+    search_string = '{0} s{1:02d}e{2:02d}'.format(catalog.show_title(index), season, episode)
+    return Entry(title=search_string, url='', search_strings=[search_string])
+
+
+def search(plugin, task: LoadTask, catalog: Catalog, rng: random.Random, searches: int, config) -> List[Entry]:
+    entries = list()
+    for _ in range(searches):
+        entry = search_entry(catalog, rng)
+        try:
+            entries.extend(plugin.search(task, entry, config))
+        except Exception as e:
+            task.failures.append('search `{0}`: {1}'.format(entry['title'], e))
+    return entries
+
+
+def rewrite(plugin, task: LoadTask, entries: List[Entry]) -> None:
+    for entry in entries:
+        entry.accept()
+    task.entries = entries
+    plugin.on_task_urlrewrite(task, task.config)
+    for entry in task.accepted:
+        if plugin.url_rewritable(task, entry):
+            plugin.url_rewrite(task, entry)
+
+
+def run_lostfilm(task: LoadTask, catalog: Catalog, rng: random.Random, searches: int) -> List[Entry]:
+    plugin = lostfilm.LostFilmPlugin()
+    plugin.on_task_start(task, dict())
+    entries = search(plugin, task, catalog, rng, searches, dict())
+    rewrite(plugin, task, entries)
+    return entries
+
+
+def run_newstudio(task: LoadTask, catalog: Catalog, rng: random.Random, searches: int) -> List[Entry]:
+    return search(newstudio.NewStudioPlugin(), task, catalog, rng, searches, True)
+
+
+def run_baibako(task: LoadTask, catalog: Catalog, rng: random.Random, searches: int) -> List[Entry]:
+    plugin = baibako.BaibakoPlugin()
+    entries = search(plugin, task, catalog, rng, searches, {'serial_tab': 'hd1080'})
+
+    # The filter compares the hashes of the topics with the known ones; every second one is up to date
+    task.entries = list()
+    for number, entry in enumerate(entries):
+        topic_id = int(entry['url'].rsplit('=', 1)[1])
+        known_hash = catalog.torrent_info_hash('baibako-{0}'.format(topic_id)) if number % 2 else '0' * 40
+        task.entries.append(Entry(title=entry['title'], url=baibako.Baibako.get_topic_url(topic_id),
+                                  torrent_info_hash=known_hash))
+    plugin.on_task_filter(task, True)
+    return task.entries
+
+
+def run_alexfilm(task: LoadTask, catalog: Catalog, rng: random.Random, searches: int) -> List[Entry]:
+    plugin = alexfilm.AlexFilmPlugin()
+    entries = search(plugin, task, catalog, rng, searches, True)
+    rewrite(plugin, task, entries)
+    return entries
+
+
+def run_kinozal(task: LoadTask, catalog: Catalog, rng: random.Random, searches: int) -> List[Entry]:
+    config = {'max_pages': catalog.pages, 'fetch_info_hash': 10, 'cache_lifetime': 0}
+    return search(kinozal.KinozalPlugin(), task, catalog, rng, searches, config)
+
+
+SCENARIOS = {
+    'lostfilm': run_lostfilm,
+    'newstudio': run_newstudio,
+    'baibako': run_baibako,
+    'alexfilm': run_alexfilm,
+    'kinozal': run_kinozal,
+}  # type: Dict[Text, Callable[[LoadTask, Catalog, random.Random, int], List[Entry]]]
+
+
+def main(argv: List[Text] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description='Load test of a tracker plugin')
+    parser.add_argument('tracker', choices=sorted(SCENARIOS))
+    parser.add_argument('--shows', type=int, default=100, help='shows (forums) in the catalog')
+    parser.add_argument('--seasons', type=int, default=3, help='seasons per show')
+    parser.add_argument('--episodes', type=int, default=10, help='episodes per season')
+    parser.add_argument('--pages', type=int, default=1, help='pages per forum (search result)')
+    parser.add_argument('--searches', type=int, default=10, help='number of searches to run')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency of every response, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of the requests failed with 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-throttle', action='store_true', help='drop the politeness pauses of the plugins')
+    options = parser.parse_args(argv)
+
+    catalog = Catalog(shows=options.shows, seasons=options.seasons, episodes=options.episodes, pages=options.pages)
+    if options.no_throttle:
+        disable_throttling()
+
+    with tempfile.TemporaryDirectory(prefix='load-') as directory:
+        setup_database(directory)
+        with StubTracker(catalog, latency=options.latency, error_rate=options.error_rate, seed=options.seed) as stub:
+            with requests.Session() as session:
+                stub.mount(session)
+                stats.track_requests(session)
+                task = LoadTask('load_' + options.tracker, session, {options.tracker: True})
+
+                started = time.monotonic()
+                entries = SCENARIOS[options.tracker](task, catalog, random.Random(options.seed), options.searches)
+                elapsed = time.monotonic() - started
+
+            print('{0}: {1} search(es), {2} entries, {3} rejected, {4} failure(s) in {5:.2f}s'.format(
+                options.tracker, options.searches, len(entries), len([entry for entry in entries if entry.rejected]),
+                len(task.failures), elapsed))
+            for failure in task.failures:
+                print('  ' + failure)
+            print(stub.stats.summary())
+            phases = globals()[options.tracker].STATS.snapshot()
+            for phase in sorted(phases):
+                print('  {0}: {1}'.format(phase, stats.format_counters(phases[phase])))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,554 @@
+"""
+In-process stub of the trackers for offline end-to-end and load tests.
+
+`StubTracker` serves synthetic catalogs of a configurable size for LostFilm, NewStudio, BaibaKo, AlexFilm
+and Kinozal from one local HTTP server, with injectable latency and error rate. `StubTracker.mount(session)`
+routes the requests of a `requests.Session` aimed at the real `BASE_URL` of every plugin to the server,
+keeping the original urls visible to the plugins (so host-bound patterns keep matching).
+
+Usage:
+
+    with StubTracker(Catalog(shows=10000, pages=200), latency=0.05, error_rate=0.01) as stub:
+        session = requests.Session()
+        stub.mount(session)
+        ...
+        print(stub.stats.summary())
+"""
+
+import hashlib
+import json
+import random
+import threading
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import Callable, Dict, List, Optional, Text, Tuple
+from urllib.parse import parse_qs, quote, urlsplit, urlunsplit
+
+import bencodepy
+from requests import PreparedRequest, Response, Session as RequestsSession
+from requests.adapters import HTTPAdapter
+
+from plugins import alexfilm, baibako, kinozal, lostfilm, newstudio
+
+HTML_CONTENT_TYPE = 'text/html; charset=utf-8'
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+TORRENT_CONTENT_TYPE = 'application/x-bittorrent'
+
+QUALITIES = ['WEB-DL 1080p', 'WEB-DL 720p', 'WEBRip', 'HDTVRip 720p', 'HDTVRip']
+BAIBAKO_TAB_QUALITIES = {
+    'all': ['WEB-DL 1080p', 'WEB-DL 720p', 'WEBRip'],
+    'hd1080': ['WEB-DL 1080p'],
+    'hd720': ['WEB-DL 720p'],
+    'x264': ['WEBRip'],
+    'xvid': ['WEBRip'],
+}
+LOSTFILM_SHOWS_STEP = 10
+
+
+class Catalog(object):
+    """Deterministic synthetic catalog shared by all the trackers."""
+
+    def __init__(self, shows: int = 100, seasons: int = 3, episodes: int = 10,
+                 pages: int = 1, page_size: int = 50) -> None:
+        self.shows = shows
+        self.seasons = seasons
+        self.episodes = episodes
+        self.pages = pages
+        self.page_size = page_size
+
+    @staticmethod
+    def show_id(index: int) -> int:
+        return 1000 + index
+
+    @staticmethod
+    def show_index(show_id: int) -> int:
+        return show_id - 1000
+
+    @staticmethod
+    def show_slug(index: int) -> Text:
+        return 'Show_{0}'.format(index)
+
+    @staticmethod
+    def show_title(index: int) -> Text:
+        return 'Show {0}'.format(index)
+
+    @staticmethod
+    def show_title_ru(index: int) -> Text:
+        return 'Сериал {0}'.format(index)
+
+    def has_show(self, index: int) -> bool:
+        return 0 <= index < self.shows
+
+    def has_episode(self, season: int, episode: int) -> bool:
+        return 1 <= season <= self.seasons and 1 <= episode <= self.episodes
+
+    def topic_episode(self, number: int) -> Tuple[int, int]:
+        """Season and episode of the `number`-th topic of a show (topics go round the seasons)."""
+        return 1 + (number // self.episodes) % self.seasons, 1 + number % self.episodes
+
+    @staticmethod
+    def info_hash(key: Text) -> Text:
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def torrent(key: Text) -> bytes:
+        info = {
+            b'name': key.encode('utf-8'),
+            b'length': 1024,
+            b'piece length': 16384,
+            b'pieces': hashlib.sha1(key.encode('utf-8')).digest(),
+        }
+        return bencodepy.encode({b'announce': b'http://bt.example/announce', b'info': info})
+
+    @staticmethod
+    def torrent_info_hash(key: Text) -> Text:
+        info = bencodepy.decode(Catalog.torrent(key))[b'info']
+        return hashlib.sha1(bencodepy.encode(info)).hexdigest()
+
+
+class Stats(object):
+    """Thread-safe counters of the served requests."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def begin(self, route: Text) -> None:
+        with self._lock:
+            self.requests[route] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self, failed: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.errors += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.requests.values())
+
+    def summary(self, top: int = 10) -> Text:
+        lines = ['requests: {0}, injected errors: {1}, max concurrency: {2}'.format(
+            self.total, self.errors, self.max_in_flight)]
+        for route, count in self.requests.most_common(top):
+            lines.append('  {0:>8}  {1}'.format(count, route))
+        return '\n'.join(lines)
+
+
+def _page(title: Text, body: Text) -> Text:
+    return ('<!DOCTYPE html>\n<html>\n<head>\n<meta http-equiv="Content-Type" content="text/html; charset=utf-8">\n'
+            '<title>{0}</title>\n</head>\n<body>\n{1}\n</body>\n</html>\n').format(title, body)
+
+
+# (status, content type, body, extra headers)
+Reply = Tuple[int, Text, bytes, Dict[Text, Text]]
+
+
+def _html(text: Text) -> Reply:
+    return 200, HTML_CONTENT_TYPE, text.encode('utf-8'), {}
+
+
+def _not_found() -> Reply:
+    return 404, HTML_CONTENT_TYPE, _page('Not found', 'Not found').encode('utf-8'), {}
+
+
+def _arg(query: Dict[Text, List[Text]], name: Text, default: Text = '') -> Text:
+    return query.get(name, [default])[0]
+
+
+def _int_arg(query: Dict[Text, List[Text]], name: Text, default: int = 0) -> int:
+    try:
+        return int(_arg(query, name, str(default)))
+    except ValueError:
+        return default
+
+
+class LostFilmSite(object):
+    def __init__(self, catalog: Catalog) -> None:
+        self.catalog = catalog
+
+    def handle(self, method: Text, path: Text, query: Dict, form: Dict) -> Reply:
+        parts = [part for part in path.split('/') if part]
+        if method == 'POST' and path == '/ajaxik.php':
+            return self.shows(_int_arg(form, 'o'))
+        if path == '/new/':
+            return self.new()
+        if path == '/v_search.php':
+            return _html('<html><body><script>location.replace("/V/?a={0}");</script></body></html>'.format(
+                quote(_arg(query, 'a'))))
+        if path == '/V/':
+            return self.torrents(_arg(query, 'a'))
+        if len(parts) >= 3 and parts[0] == 'series':
+            index = self._show_index(parts[1])
+            if index is None:
+                return _not_found()
+            if parts[2] == 'seasons':
+                return self.seasons(index, range(self.catalog.seasons, 0, -1))
+            if parts[2].startswith('season_'):
+                season = int(parts[2][len('season_'):])
+                if len(parts) >= 4 and parts[3].startswith('episode_'):
+                    return self.episode(index, season, int(parts[3][len('episode_'):]))
+                return self.seasons(index, [season])
+        return _not_found()
+
+    def _show_index(self, slug: Text) -> Optional[int]:
+        try:
+            index = int(slug.rsplit('_', 1)[1])
+        except (IndexError, ValueError):
+            return None
+        return index if self.catalog.has_show(index) else None
+
+    def _code(self, index: int, season: int, episode: int) -> Text:
+        return '{0}{1:03d}{2:03d}'.format(self.catalog.show_id(index), season, episode)
+
+    def shows(self, offset: int) -> Reply:
+        data = [{
+            'id': str(self.catalog.show_id(index)),
+            'alias': self.catalog.show_slug(index),
+            'title': self.catalog.show_title_ru(index),
+            'title_orig': self.catalog.show_title(index),
+        } for index in range(offset, min(offset + LOSTFILM_SHOWS_STEP, self.catalog.shows))]
+        body = json.dumps({'result': 'ok', 'data': data}, ensure_ascii=False).encode('utf-8')
+        return 200, JSON_CONTENT_TYPE, body, {}
+
+    def seasons(self, index: int, seasons) -> Reply:
+        tables = list()
+        for season in seasons:
+            if not self.catalog.has_episode(season, 1):
+                continue
+            rows = list()
+            for episode in range(self.catalog.episodes, 0, -1):
+                rows.append(
+                    '<tr><td class="beta">{0} сезон {1} серия</td>'
+                    '<td class="gamma"><div>Эпизод {1}<br><span>Episode {1}</span></div></td>'
+                    '<td class="zeta"><div class="external-btn" onclick="PlayEpisode(\'{2}\')"></div></td></tr>'.format(
+                        season, episode, self._code(index, season, episode)))
+            tables.append('<table class="movie-parts-list">\n{0}\n</table>'.format('\n'.join(rows)))
+        return _html(_page(self.catalog.show_title_ru(index),
+                           '<div class="series-block">\n{0}\n</div>'.format('\n'.join(tables))))
+
+    def episode(self, index: int, season: int, episode: int) -> Reply:
+        if not self.catalog.has_episode(season, episode):
+            return _not_found()
+        return _html(_page(self.catalog.show_title_ru(index), (
+            '<h1 class="seria-header"><div>Эпизод {0}</div><div>Episode {0}</div></h1>\n'
+            '<div class="overlay-pane"><div class="external-btn" onclick="PlayEpisode(\'{1}\')"></div></div>'
+        ).format(episode, self._code(index, season, episode))))
+
+    def torrents(self, code: Text) -> Reply:
+        items = list()
+        for label in ('SD', '1080', 'MP4'):
+            items.append(
+                '<div class="inner-box--item"><div class="inner-box--label">{0}</div>'
+                '<div class="inner-box--link main"><a href="http://tracktor.example/td.php?s={1}-{0}">'
+                'Episode {1} {0}</a></div></div>'.format(label, code))
+        return _html(_page('Torrents', '<div class="inner-box--list">\n{0}\n</div>'.format('\n'.join(items))))
+
+    def new(self) -> Reply:
+        items = list()
+        for number in range(min(50, self.catalog.shows)):
+            season, episode = self.catalog.topic_episode(number)
+            items.append(
+                '<a href="/series/{0}/season_{1}/episode_{2}/"><div class="name-ru">{3}</div>'
+                '<div class="name-en">{4}</div></a>'.format(
+                    self.catalog.show_slug(number), season, episode,
+                    self.catalog.show_title_ru(number), self.catalog.show_title(number)))
+        return _html(_page('New', '<div class="content">\n{0}\n</div>'.format('\n'.join(items))))
+
+
+class NewStudioSite(object):
+    def __init__(self, catalog: Catalog) -> None:
+        self.catalog = catalog
+        self._forums = None
+
+    def handle(self, method: Text, path: Text, query: Dict, form: Dict) -> Reply:
+        if path in ('', '/'):
+            return self.forums()
+        if path == '/viewforum.php':
+            index = self.catalog.show_index(_int_arg(query, 'f'))
+            if not self.catalog.has_show(index):
+                return _not_found()
+            return self.forum(index, _int_arg(query, 'start'))
+        if path == '/download.php':
+            return 200, TORRENT_CONTENT_TYPE, self.catalog.torrent('newstudio-' + _arg(query, 'id')), {}
+        return _not_found()
+
+    def forums(self) -> Reply:
+        if self._forums is None:
+            links = ['<a href="./viewforum.php?f={0}">{1}</a><br>'.format(
+                self.catalog.show_id(index), self.catalog.show_title(index)) for index in range(self.catalog.shows)]
+            self._forums = _page('NewStudio', (
+                '<div class="accordion" id="serialist"><div class="accordion-group"><div class="accordion-inner">\n'
+                '{0}\n</div></div></div>').format('\n'.join(links)))
+        return _html(self._forums)
+
+    def forum(self, index: int, start: int) -> Reply:
+        forum_id = self.catalog.show_id(index)
+        rows = list()
+        total = self.catalog.pages * self.catalog.page_size
+        for number in range(start, min(start + self.catalog.page_size, total)):
+            season, episode = self.catalog.topic_episode(number)
+            topic_id = forum_id * 100000 + number
+            rows.append(
+                '<div class="row-fluid"><a href="./viewtopic.php?t={0}">{1} (Сезон {2}, Серия {3}) / {4} '
+                '(Season {2}, Episode {3}) (2024) {5} | NewStudio</a>'
+                '<a href="./download.php?id={0}">Скачать</a></div>'.format(
+                    topic_id, self.catalog.show_title_ru(index), season, episode, self.catalog.show_title(index),
+                    QUALITIES[number % len(QUALITIES)]))
+        pages = ''.join('<li><a href="#">{0}</a></li>'.format(page) for page in range(1, self.catalog.pages + 1))
+        return _html(_page(self.catalog.show_title(index), (
+            '<div id="sideLeft"><div class="accordion-inner">\n{0}\n</div>\n'
+            '<div class="pagination"><ul>{1}</ul></div></div>').format('\n'.join(rows), pages)))
+
+
+class BaibakoSite(object):
+    def __init__(self, catalog: Catalog) -> None:
+        self.catalog = catalog
+        self._serials = None
+
+    def handle(self, method: Text, path: Text, query: Dict, form: Dict) -> Reply:
+        if path == '/serials.php':
+            return self.serials()
+        if path == '/serial.php':
+            index = self.catalog.show_index(_int_arg(query, 'id'))
+            if not self.catalog.has_show(index):
+                return _not_found()
+            return self.serial(index, _arg(query, 'tab', 'all'))
+        if path == '/download.php':
+            return 200, TORRENT_CONTENT_TYPE, self.catalog.torrent('baibako-' + _arg(query, 'id')), {}
+        return _not_found()
+
+    def serials(self) -> Reply:
+        if self._serials is None:
+            links = ['<a href="serial.php?id={0}">{1}</a>'.format(
+                self.catalog.show_id(index), self.catalog.show_title(index)) for index in range(self.catalog.shows)]
+            self._serials = _page('BaibaKo', '<div class="row serialsearch">\n{0}\n</div>'.format('\n'.join(links)))
+        return _html(self._serials)
+
+    def serial(self, index: int, tab: Text) -> Reply:
+        forum_id = self.catalog.show_id(index)
+        rows = list()
+        for quality_index, quality in enumerate(BAIBAKO_TAB_QUALITIES.get(tab, BAIBAKO_TAB_QUALITIES['all'])):
+            for season in range(1, self.catalog.seasons + 1):
+                for episode in range(1, self.catalog.episodes + 1):
+                    topic_id = (forum_id * 10 + quality_index) * 10000 + season * 100 + episode
+                    rows.append('<tr><td><a href="details.php?id={0}">{1} / {2} / s{3:02d}e{4:02d} / {5} / BaibaKo'
+                                '</a></td></tr>'.format(topic_id, self.catalog.show_title_ru(index),
+                                                        self.catalog.show_title(index), season, episode, quality))
+        return _html(_page(self.catalog.show_title(index),
+                           '<table class="table">\n{0}\n</table>'.format('\n'.join(rows))))
+
+
+class AlexFilmSite(object):
+    def __init__(self, catalog: Catalog) -> None:
+        self.catalog = catalog
+        self._serials = None
+
+    def handle(self, method: Text, path: Text, query: Dict, form: Dict) -> Reply:
+        if path in ('', '/'):
+            return self.serials()
+        if path == '/viewforum.php':
+            index = self.catalog.show_index(_int_arg(query, 'f'))
+            if not self.catalog.has_show(index):
+                return _not_found()
+            return self.show(index)
+        if path == '/viewtopic.php':
+            return self.topic(_int_arg(query, 't'))
+        if path == '/dl.php':
+            return 200, TORRENT_CONTENT_TYPE, self.catalog.torrent('alexfilm-' + _arg(query, 'id')), {}
+        return _not_found()
+
+    def serials(self) -> Reply:
+        if self._serials is None:
+            links = ['<li><a href="viewforum.php?f={0}">{1} / {2}</a></li>'.format(
+                self.catalog.show_id(index), self.catalog.show_title_ru(index), self.catalog.show_title(index))
+                for index in range(self.catalog.shows)]
+            self._serials = _page('AlexFilm', '<ul id="serials">\n{0}\n</ul>'.format('\n'.join(links)))
+        return _html(self._serials)
+
+    def show(self, index: int) -> Reply:
+        forum_id = self.catalog.show_id(index)
+        panels = list()
+        for season in range(1, self.catalog.seasons + 1):
+            for first_episode in range(1, self.catalog.episodes + 1, 2):
+                last_episode = min(first_episode + 1, self.catalog.episodes)
+                topic_id = forum_id * 10000 + season * 100 + first_episode
+                panels.append(
+                    '<div class="panel"><a href="viewtopic.php?t={0}">{1} / {2} / Сезон {3} / Серии {4}-{5} из {6} '
+                    '[2024, {7}]</a></div>'.format(topic_id, self.catalog.show_title_ru(index),
+                                                   self.catalog.show_title(index), season, first_episode,
+                                                   last_episode, self.catalog.episodes,
+                                                   QUALITIES[first_episode % len(QUALITIES)]))
+        return _html(_page(self.catalog.show_title(index), '<section>\n{0}\n</section>'.format('\n'.join(panels))))
+
+    def topic(self, topic_id: int) -> Reply:
+        return _html(_page('Topic {0}'.format(topic_id), (
+            '<a href="dl.php?id={0}">Скачать</a>'
+            '<a id="magnet" href="magnet:?xt=urn:btih:{1}&amp;tr=http%3A%2F%2Fbt.example%2Fannounce">magnet</a>'
+        ).format(topic_id, self.catalog.info_hash('alexfilm-{0}'.format(topic_id)))))
+
+
+class KinozalSite(object):
+    def __init__(self, catalog: Catalog) -> None:
+        self.catalog = catalog
+
+    def handle(self, method: Text, path: Text, query: Dict, form: Dict) -> Reply:
+        if path == '/browse.php':
+            return self.browse(_arg(query, 's'), _int_arg(query, 'page'))
+        if path == '/get_srv_details.php':
+            topic_id = _arg(query, 'id')
+            return _html('<ul><li>Инфо хеш: {0}</li><li>Размер: 1.37 ГБ</li></ul>'.format(
+                self.catalog.info_hash('kinozal-' + topic_id).upper()))
+        if path == '/download.php':
+            return 200, TORRENT_CONTENT_TYPE, self.catalog.torrent('kinozal-' + _arg(query, 'id')), {}
+        return _not_found()
+
+    def browse(self, search_string: Text, page: int) -> Reply:
+        rows = list()
+        if page < self.catalog.pages:
+            base_id = (zlib.crc32(search_string.encode('utf-8')) % 100000) * 100000
+            for number in range(self.catalog.page_size):
+                topic_id = base_id + page * self.catalog.page_size + number
+                rows.append(
+                    '<tr class="bg"><td class="bt"></td>'
+                    '<td class="nam"><a href="/details.php?id={0}">{1} / {2} / 2024 / WEB-DL (1080p)</a></td>'
+                    '<td class="s">{3}</td><td class="s">1.{3} ГБ</td><td class="sl_s">{4}</td>'
+                    '<td class="sl_p">{5}</td><td class="s">сегодня в 11:11</td><td class="sl">uploader</td>'
+                    '</tr>'.format(topic_id, search_string, number, number % 10, 100 - number, number))
+        return _html(_page('Kinozal', '<table class="t_peer w100p">\n{0}\n</table>'.format('\n'.join(rows))))
+
+
+class StubTracker(object):
+    def __init__(self, catalog: Catalog = None, latency: float = 0.0, error_rate: float = 0.0,
+                 seed: int = 0) -> None:
+        self.catalog = catalog or Catalog()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = Stats()
+
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._sites = {
+            urlsplit(lostfilm.BASE_URL).netloc: LostFilmSite(self.catalog),
+            urlsplit(newstudio.BASE_URL).netloc: NewStudioSite(self.catalog),
+            urlsplit(baibako.BASE_URL).netloc: BaibakoSite(self.catalog),
+            urlsplit(alexfilm.BASE_URL).netloc: AlexFilmSite(self.catalog),
+            urlsplit(kinozal.BASE_URL).netloc: KinozalSite(self.catalog),
+        }
+        self._server = None
+        self._thread = None
+
+    @property
+    def netloc(self) -> Text:
+        host, port = self._server.server_address[:2]
+        return '{0}:{1}'.format(host, port)
+
+    def start(self) -> 'StubTracker':
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-tracker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'StubTracker':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def mount(self, session: RequestsSession) -> RequestsSession:
+        adapter = StubAdapter(self)
+        for module in (lostfilm, newstudio, baibako, alexfilm, kinozal):
+            session.mount(module.BASE_URL, adapter)
+        return session
+
+    def _fail(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def respond(self, method: Text, host: Text, target: Text, body: bytes) -> Reply:
+        parts = urlsplit(target)
+        route = '{0} {1}{2}'.format(method, host, parts.path)
+        self.stats.begin(route)
+        failed = False
+        try:
+            if self.latency > 0:
+                sleep(self.latency)
+
+            failed = self._fail()
+            if failed:
+                return 503, HTML_CONTENT_TYPE, b'Service Unavailable', {}
+
+            site = self._sites.get(host)
+            if not site:
+                return _not_found()
+
+            form = parse_qs(body.decode('utf-8')) if body else dict()
+            return site.handle(method, parts.path, parse_qs(parts.query), form)
+        finally:
+            self.stats.end(failed)
+
+    def _handler_class(self) -> Callable:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, method: Text) -> None:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, content_type, content, headers = stub.respond(
+                    method, self.headers.get('Host', ''), self.path, body)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self) -> None:
+                self._reply('GET')
+
+            def do_POST(self) -> None:
+                self._reply('POST')
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        return Handler
+
+
+class StubAdapter(HTTPAdapter):
+    """Sends the requests to the stub server, keeping the original url and host."""
+
+    def __init__(self, stub: StubTracker) -> None:
+        super().__init__(pool_connections=4, pool_maxsize=32)
+        self._stub = stub
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        original_url = request.url
+        parts = urlsplit(original_url)
+        request.url = urlunsplit(('http', self._stub.netloc, parts.path or '/', parts.query, ''))
+        request.headers['Host'] = parts.netloc
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            request.url = original_url
+        response.url = original_url
+        return response
@@ -0,0 +1,277 @@
+"""
+Offline benchmarks of the tracker page parsers over recorded (anonymized) pages from `fixtures`.
+
+Every case is timed (operations per second, best of several runs) and its peak memory is measured.
+The results are compared with `baseline.json`; the run fails when a case gets slower or hungrier
+than the baseline allows.
+
+Usage:
+
+    python -m benchmarks [-k <substring>] [--tolerance 0.5] [--update-baseline]
+"""
+
+import argparse
+import inspect
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Text
+
+from bs4 import BeautifulSoup
+
+from plugins import alexfilm, baibako, kinozal, lostfilm, newstudio
+from plugins.utils import parse_search_string
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+DEFAULT_TOLERANCE = 0.5
+REPEAT = 5
+
+
+def fixture(name: Text, binary: bool = False) -> Any:
+    path = os.path.join(FIXTURES_DIR, name)
+    if binary:
+        with open(path, 'rb') as f:
+            return f.read()
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+class Case(object):
+    def __init__(self, name: Text, func: Callable[[], Any], check: Callable[[Any], bool] = bool) -> None:
+        self.name = name
+        self.func = func
+        self.check = check
+
+
+def get_cases() -> List[Case]:
+    lostfilm_shows = fixture('lostfilm_shows.json')
+    lostfilm_seasons = fixture('lostfilm_seasons.html')
+    lostfilm_episode = fixture('lostfilm_episode.html')
+    lostfilm_new = fixture('lostfilm_new.html')
+    lostfilm_torrents = fixture('lostfilm_torrents.html')
+
+    newstudio_forums = fixture('newstudio_forums.html')
+    newstudio_forum = fixture('newstudio_forum.html')
+    newstudio_title = 'Сериал 1 (Сезон 2, Серия 3-4) / Show 1 (Season 2, Episode 3-4) (2024) WEB-DL 1080p | NewStudio'
+
+    baibako_serials = fixture('baibako_serials.html')
+    baibako_serial = fixture('baibako_serial.html')
+    baibako_title = 'Сериал 1 / Show 1 / s02e03-04 / WEB-DL 1080p / BaibaKo'
+
+    alexfilm_serials = fixture('alexfilm_serials.html')
+    alexfilm_show = fixture('alexfilm_show.html')
+    alexfilm_topic = fixture('alexfilm_topic.html')
+    alexfilm_magnet = alexfilm.AlexFilmParser.parse_magnet(alexfilm_topic)
+
+    kinozal_browse = fixture('kinozal_browse.html')
+    kinozal_details = fixture('kinozal_details.html', binary=True)
+    kinozal_row = BeautifulSoup(kinozal_browse, 'html.parser').find('tr', class_='bg')
+
+    search_strings = ['Show {0} S{1:02d}E{2:02d}'.format(index, index % 10 + 1, index % 24 + 1) for index in range(100)]
+
+    return [
+        Case('lostfilm.parse_shows_json',
+             lambda: lostfilm.LostFilmParser.parse_shows_json(lostfilm_shows),
+             lambda result: len(result) == 50),
+        Case('lostfilm.parse_seasons_page',
+             lambda: lostfilm.LostFilmParser.parse_seasons_page(lostfilm_seasons),
+             lambda result: len(result) == 30 and all(episode.title for episode in result)),
+        Case('lostfilm.parse_episode_page',
+             lambda: lostfilm.LostFilmParser.parse_episode_page(lostfilm_episode),
+             lambda result: (result.season, result.episode) == (3, 5)),
+        Case('lostfilm.parse_new_page',
+             lambda: lostfilm.LostFilmParser.parse_new_page(lostfilm_new),
+             lambda result: len(result) == 50),
+        Case('lostfilm.parse_torrents_page',
+             lambda: lostfilm.LostFilmParser.parse_torrents_page(lostfilm_torrents),
+             lambda result: len(result) == 3),
+
+        Case('newstudio.parse_forums',
+             lambda: newstudio.NewStudioParser.parse_forums(newstudio_forums),
+             lambda result: len(result) == 200),
+        Case('newstudio.parse_forum_pages_count',
+             lambda: newstudio.NewStudioParser.parse_forum_pages_count(newstudio_forum),
+             lambda result: result == 3),
+        Case('newstudio.parse_topics',
+             lambda: newstudio.NewStudioParser.parse_topics(newstudio_forum),
+             lambda result: len(result) == 50),
+        Case('newstudio.parse_topic_title',
+             lambda: newstudio.NewStudioParser.parse_topic_title(newstudio_title),
+             lambda result: (result.season, result.begin_episode, result.end_episode) == (2, 3, 4)),
+
+        Case('baibako.parse_forums',
+             lambda: baibako.BaibakoParser.parse_forums(baibako_serials),
+             lambda result: len(result) == 200),
+        Case('baibako.parse_topics',
+             lambda: baibako.BaibakoParser.parse_topics(baibako_serial),
+             lambda result: len(result) == 50),
+        Case('baibako.parse_topic_title',
+             lambda: baibako.BaibakoParser.parse_topic_title(baibako_title),
+             lambda result: (result.season, result.begin_episode, result.end_episode) == (2, 3, 4)),
+        Case('baibako.parse_topic_id',
+             lambda: baibako.BaibakoParser.parse_topic_id('http://baibako.tv/details.php?id=50001'),
+             lambda result: result == 50001),
+
+        Case('alexfilm.parse_shows_page',
+             lambda: alexfilm.AlexFilmParser.parse_shows_page(alexfilm_serials),
+             lambda result: len(result) == 150),
+        Case('alexfilm.parse_show_topics',
+             lambda: alexfilm.AlexFilmParser.parse_show_topics(
+                 alexfilm_show, 'http://alexfilm.org/viewforum.php?f=401'),
+             lambda result: len(result) == 30),
+        Case('alexfilm.parse_topic_links',
+             lambda: alexfilm.AlexFilmParser.parse_topic_links(alexfilm_topic),
+             lambda result: result[0] == 70001 and result[1]),
+        Case('alexfilm.parse_download_url',
+             lambda: alexfilm.AlexFilmParser.parse_download_url(alexfilm_topic)),
+        Case('alexfilm.parse_download_id',
+             lambda: alexfilm.AlexFilmParser.parse_download_id(alexfilm_topic),
+             lambda result: result == 70001),
+        Case('alexfilm.parse_magnet',
+             lambda: alexfilm.AlexFilmParser.parse_magnet(alexfilm_topic)),
+        Case('alexfilm.parse_magnet_info_hash',
+             lambda: alexfilm.AlexFilmParser.parse_magnet_info_hash(alexfilm_magnet),
+             lambda result: result == '0123456789abcdef0123456789abcdef01234567'),
+
+        Case('kinozal.parse_search_result',
+             lambda: kinozal.KinozalParser.parse_search_result(kinozal_browse, 'http://kinozal.tv/browse.php'),
+             lambda result: len(result) == 50 and all(entry.size for entry in result)),
+        Case('kinozal.parse_search_row',
+             lambda: kinozal.KinozalParser.parse_search_row(kinozal_row, 'http://kinozal.tv/browse.php'),
+             lambda result: result.id == 1000000 and result.seeds),
+        Case('kinozal.parse_info_hash_bytes',
+             lambda: kinozal.KinozalParser.parse_info_hash_bytes(kinozal_details),
+             lambda result: result == '0123456789abcdef0123456789abcdef01234567'),
+        Case('kinozal.parse_info_hash',
+             lambda: kinozal.KinozalParser.parse_info_hash(kinozal_details.decode('utf-8')),
+             lambda result: result == '0123456789abcdef0123456789abcdef01234567'),
+        Case('kinozal.parse_filesize',
+             lambda: kinozal.KinozalParser.parse_filesize('1,37 ГБ'),
+             lambda result: result > 1400),
+        Case('kinozal.parse_topic_id',
+             lambda: kinozal.KinozalParser.parse_topic_id('http://kinozal.tv/details.php?id=1000000'),
+             lambda result: result == 1000000),
+
+        Case('utils.parse_search_string',
+             lambda: [parse_search_string(search_string) for search_string in search_strings],
+             lambda result: all(search.episode for search in result)),
+        Case('utils.parse_search_string_uncached',
+             lambda: [parse_search_string.__wrapped__(search_string) for search_string in search_strings],
+             lambda result: all(search.episode for search in result)),
+        Case('utils.parse_search_string_formats',
+             lambda: [parse_search_string.__wrapped__(search_string) for search_string in (
+                 'Show 1 S02E03', 'Show 1 2x03', 'Show 1 S02', 'Show 1 Season 2', 'Show 1 #123')],
+             lambda result: [search.get_episode_id() for search in result] == [
+                 's02e03', 's02e03', 's02', 's02', '#123']),
+    ]
+
+
+def uncovered_methods(cases: List[Case]) -> List[Text]:
+    """Public methods of the `*Parser` classes which have no benchmark case."""
+
+    names = set(case.name for case in cases)
+    result = list()
+    for module in (alexfilm, baibako, kinozal, lostfilm, newstudio):
+        module_name = module.__name__.rsplit('.', 1)[-1]
+        for class_name, cls in inspect.getmembers(module, inspect.isclass):
+            if not class_name.endswith('Parser') or cls.__module__ != module.__name__:
+                continue
+            for method_name in vars(cls):
+                if method_name.startswith('_'):
+                    continue
+                name = '{0}.{1}'.format(module_name, method_name)
+                if name not in names:
+                    result.append(name)
+    return result
+
+
+def measure(case: Case) -> Dict[Text, float]:
+    result = case.func()
+    if not case.check(result):
+        raise AssertionError('unexpected result of {0}: {1!r}'.format(case.name, result))
+
+    tracemalloc.start()
+    try:
+        case.func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timer = timeit.Timer(case.func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=REPEAT, number=number)) / number
+
+    return {'ops_per_sec': 1.0 / best, 'peak_kb': peak / 1024.0}
+
+
+def compare(name: Text, stats: Dict[Text, float], baseline: Optional[Dict[Text, float]],
+            tolerance: float) -> List[Text]:
+    if not baseline:
+        return list()
+
+    regressions = list()
+    if stats['ops_per_sec'] < baseline['ops_per_sec'] * (1.0 - tolerance):
+        regressions.append('{0}: {1:.1f} ops/sec, baseline {2:.1f}'.format(
+            name, stats['ops_per_sec'], baseline['ops_per_sec']))
+    if stats['peak_kb'] > baseline['peak_kb'] * (1.0 + tolerance):
+        regressions.append('{0}: {1:.1f} KiB peak, baseline {2:.1f}'.format(
+            name, stats['peak_kb'], baseline['peak_kb']))
+    return regressions
+
+
+def main(argv: List[Text] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks of the tracker parsers')
+    parser.add_argument('-k', dest='keyword', help='run only the cases whose name contains the substring')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed relative regression (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    options = parser.parse_args(argv)
+
+    baselines = dict()
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'r') as f:
+            baselines = json.load(f)
+
+    cases = get_cases()
+    for name in uncovered_methods(cases):
+        print('warning: {0} has no benchmark case'.format(name))
+
+    if options.keyword:
+        cases = [case for case in cases if options.keyword in case.name]
+
+    results = dict()
+    regressions = list()
+    print('{0:<36} {1:>12} {2:>12} {3:>10}'.format('case', 'ops/sec', 'baseline', 'peak KiB'))
+    for case in cases:
+        stats = measure(case)
+        results[case.name] = stats
+        baseline = baselines.get(case.name)
+        print('{0:<36} {1:>12.1f} {2:>12} {3:>10.1f}'.format(
+            case.name, stats['ops_per_sec'],
+            '{0:.1f}'.format(baseline['ops_per_sec']) if baseline else '-', stats['peak_kb']))
+        regressions.extend(compare(case.name, stats, baseline, options.tolerance))
+
+    if options.update_baseline:
+        baselines.update({name: {key: round(value, 1) for key, value in stats.items()}
+                          for name, stats in results.items()})
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline has been updated: {0}'.format(BASELINE_PATH))
+        return 0
+
+    if regressions:
+        print('Regressions:')
+        for regression in regressions:
+            print('  ' + regression)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
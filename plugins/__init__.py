@@ -1 +1 @@
-from .utils import ContentType
+from .utils import ContentType, download_torrent, parse_header
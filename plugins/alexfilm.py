@@ -1,18 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from base64 import b32decode
 import re
 from datetime import datetime, timedelta
-from time import sleep
-from typing import Text, Dict, Optional, List, Set
+from typing import Any, Text, Dict, Optional, List, Set, Tuple, Union
 from urllib.parse import urljoin
+from weakref import WeakKeyDictionary
 
-from bs4 import BeautifulSoup
+from flexget import options
 from flexget import plugin
 from flexget.db_schema import versioned_base
 from flexget.entry import Entry
 from flexget.event import event
-from flexget.manager import Session
+from flexget.manager import Session, Manager
 from flexget.plugin import PluginError
 from flexget.task import Task
 from requests import Session as RequestsSession, PreparedRequest, RequestException
@@ -20,22 +21,27 @@ from requests.auth import AuthBase
 from sqlalchemy import Column, Unicode, Integer, DateTime, UniqueConstraint, ForeignKey, func
 from sqlalchemy.orm import Session as OrmSession
 
-from .utils import JSONEncodedDict
+from .utils import JSONEncodedDict, AuthPool, RateLimiter, account_configs, cookie_header, map_concurrently, match_host
+from .utils import TaskCache, lazy_compile, lazy_import, parse_search_string, preload
+from .stats import TrackerStats, AUTH, SEARCH, URL_REWRITE, CACHE_REFRESH, print_stats, sleep, timed, track_requests
+
+bs4 = lazy_import('bs4')
 
 PLUGIN_NAME = 'alexfilm'
 SCHEMA_VER = 0
 
 log = logging.getLogger(PLUGIN_NAME)
 Base = versioned_base(PLUGIN_NAME, SCHEMA_VER)
+STATS = TrackerStats(PLUGIN_NAME)
 
 BASE_URL = 'http://alexfilm.org'
 COOKIES_DOMAIN = '.alexfilm.org'
 
-HOST_REGEXP = re.compile(r'^https?://(?:www\.)?(?:.+\.)?alexfilm\.org', flags=re.IGNORECASE)
+HOST_REGEXP = lazy_compile(r'^https?://(?:www\.)?(?:.+\.)?alexfilm\.org', flags=re.IGNORECASE)
 
 
 def validate_host(url: Text) -> bool:
-    return HOST_REGEXP.match(url) is not None
+    return match_host(HOST_REGEXP, url)
 
 
 # region AlexFilmAuthPlugin
@@ -59,18 +65,22 @@ class AlexFilmAuth(AuthBase):
     and cookies will be just set.
     """
 
+    @STATS.phase(AUTH)
     def try_authenticate(self, payload: Dict) -> Dict:
         for _ in range(5):
             with RequestsSession() as session:
+                track_requests(session)
                 response = session.post('{0}/login.php'.format(BASE_URL), data=payload)
                 response.raise_for_status()
 
                 cookies = session.cookies.get_dict(domain=COOKIES_DOMAIN)
                 if cookies and len(cookies) > 0:
+                    STATS.login(True)
                     return cookies
 
             sleep(3)
 
+        STATS.login(False)
         raise PluginError('Unable to obtain cookies from AlexFilm. Looks like invalid username or password.')
 
     def __init__(self, username: Text, password: Text, cookies: Dict = None, session: OrmSession = None) -> None:
@@ -84,7 +94,7 @@ class AlexFilmAuth(AuthBase):
                 'autologin': 1
             }
 
-            self.__cookies = self.try_authenticate(payload_)
+            self.__set_cookies(self.try_authenticate(payload_))
             if session:
                 session.add(
                     AlexFilmAccount(
@@ -97,12 +107,16 @@ class AlexFilmAuth(AuthBase):
             #         'session can not be None if cookies is None')
         else:
             log.debug('Using previously saved cookie.')
-            self.__cookies = cookies
+            self.__set_cookies(cookies)
+
+    def __set_cookies(self, cookies: Dict) -> None:
+        self.__cookies = cookies
+        self.__cookie_header = cookie_header(cookies)
 
     def __call__(self, request: PreparedRequest) -> PreparedRequest:
         # request.prepare_cookies(self.__cookies)
         if validate_host(request.url):
-            request.headers['Cookie'] = '; '.join('{0}={1}'.format(key, val) for key, val in self.__cookies.items())
+            request.headers['Cookie'] = self.__cookie_header
         return request
 
 
@@ -112,9 +126,17 @@ class AlexFilmAuthPlugin(object):
     alexfilm_auth:
       username: 'username_here'
       password: 'password_here'
+
+    Several accounts can be used to spread requests over them:
+
+    alexfilm_auth:
+      - username: 'username_1'
+        password: 'password_1'
+      - username: 'username_2'
+        password: 'password_2'
     """
 
-    schema = {
+    account_schema = {
         'type': 'object',
         'properties': {
             'username': {'type': 'string'},
@@ -123,7 +145,15 @@ class AlexFilmAuthPlugin(object):
         'additionalProperties': False
     }
 
+    schema = {
+        'oneOf': [
+            account_schema,
+            {'type': 'array', 'items': account_schema, 'minItems': 1}
+        ]
+    }
+
     auth_cache = {}
+    pool_cache = {}
 
     def try_find_cookie(self, session: OrmSession, username: Text) -> Optional[Dict]:
         account = session.query(AlexFilmAccount).filter(AlexFilmAccount.username == username).first()
@@ -136,7 +166,7 @@ class AlexFilmAuthPlugin(object):
         else:
             return None
 
-    def get_auth_handler(self, config: Dict) -> Dict:
+    def get_account_auth_handler(self, config: Dict) -> AuthBase:
         username = config.get('username')
         if not username or len(username) <= 0:
             raise PluginError('Username are not configured.')
@@ -154,6 +184,18 @@ class AlexFilmAuthPlugin(object):
 
             return auth_handler
 
+    def get_auth_handler(self, config: Union[Dict, List[Dict]]) -> AuthBase:
+        accounts = account_configs(config)
+        if len(accounts) == 1:
+            return self.get_account_auth_handler(accounts[0])
+
+        usernames = tuple(account.get('username') for account in accounts)
+        if usernames not in self.pool_cache:
+            handlers = [self.get_account_auth_handler(account) for account in accounts]
+            self.pool_cache[usernames] = AuthPool(handlers, validate_host)
+
+        return self.pool_cache[usernames]
+
     @plugin.priority(plugin.PRIORITY_DEFAULT)
     def on_task_start(self, task: Task, config: Dict) -> None:
         task.requests.auth = self.get_auth_handler(config)
@@ -171,8 +213,7 @@ class AlexFilmAuthPlugin(object):
                 log.debug('entry %s has invalid host, skipping', entry)
                 continue
 
-            username = config.get('username')
-            log.debug('setting auth with username %s', username)
+            log.debug('setting auth for %s', entry)
             entry['download_auth'] = self.get_auth_handler(config)
 
 
@@ -213,6 +254,22 @@ class AlexFilmShow(object):
         self.url = url
 
 
+class AlexFilmTopic(object):
+    def __init__(self, id_: int, title: Text, alternative_title: Text, season: int,
+                 first_episode: int, last_episode: int, quality: Text, url: Text) -> None:
+        self.id = id_
+        self.title = title
+        self.alternative_title = alternative_title
+        self.season = season
+        self.first_episode = first_episode
+        self.last_episode = last_episode
+        self.quality = quality
+        self.url = url
+
+    def get_episode_id(self) -> Text:
+        return "s{0:02d}e{1:02d}-{2:02d}".format(self.season, self.first_episode, self.last_episode)
+
+
 class ParsingError(Exception):
     def __init__(self, message: Text) -> None:
         self.message = message
@@ -226,8 +283,9 @@ class ParsingError(Exception):
 
 class AlexFilmParser(object):
     @staticmethod
+    @timed('parse_time')
     def parse_download_url(html: Text) -> Text:
-        bs = BeautifulSoup(html, 'html.parser')
+        bs = bs4.BeautifulSoup(html, 'html.parser')
         download_node = bs.find('a', href=DOWNLOAD_URL_REGEXP)
         if not download_node:
             raise ParsingError('download node is not found')
@@ -235,6 +293,7 @@ class AlexFilmParser(object):
         return download_node.get('href')
 
     @staticmethod
+    @timed('parse_time')
     def parse_download_id(html: Text) -> int:
         url = AlexFilmParser.parse_download_url(html)
         match = DOWNLOAD_URL_REGEXP.search(url)
@@ -244,8 +303,9 @@ class AlexFilmParser(object):
         return int(match.group(1))
 
     @staticmethod
+    @timed('parse_time')
     def parse_magnet(html: Text) -> Text:
-        bs = BeautifulSoup(html, 'html.parser')
+        bs = bs4.BeautifulSoup(html, 'html.parser')
         magnet_node = bs.find('a', id='magnet')
         if not magnet_node:
             raise ParsingError('magnet node is not found')
@@ -253,8 +313,42 @@ class AlexFilmParser(object):
         return magnet_node.get('href')
 
     @staticmethod
+    @timed('parse_time')
+    def parse_topic_links(html: Text) -> Tuple[Optional[int], Optional[Text]]:
+        """Parses the download id and the magnet of a topic page at once."""
+
+        bs = bs4.BeautifulSoup(html, 'html.parser')
+
+        download_id = None
+        download_node = bs.find('a', href=DOWNLOAD_URL_REGEXP)
+        if download_node:
+            download_id = int(DOWNLOAD_URL_REGEXP.search(download_node.get('href')).group(1))
+
+        magnet = None
+        magnet_node = bs.find('a', id='magnet')
+        if magnet_node:
+            magnet = magnet_node.get('href') or None
+
+        if not download_id and not magnet:
+            raise ParsingError('neither download nor magnet node is found')
+
+        return download_id, magnet
+
+    @staticmethod
+    def parse_magnet_info_hash(magnet: Text) -> Optional[Text]:
+        match = MAGNET_INFO_HASH_REGEXP.search(magnet)
+        if not match:
+            return None
+
+        info_hash = match.group(1)
+        if len(info_hash) == 32:
+            info_hash = b32decode(info_hash.upper()).hex()
+        return info_hash.lower()
+
+    @staticmethod
+    @timed('parse_time')
     def parse_shows_page(html: Text) -> Optional[Set[AlexFilmShow]]:
-        serials_tree = BeautifulSoup(html, 'html.parser')
+        serials_tree = bs4.BeautifulSoup(html, 'html.parser')
         serials_node = serials_tree.find('ul', id='serials')
         if not serials_node:
             log.error('Error while parsing serials page: node <ul id=`serials`> are not found')
@@ -262,11 +356,10 @@ class AlexFilmParser(object):
 
         shows = set()
 
-        url_regexp = re.compile(r'f=(\d+)', flags=re.IGNORECASE)
-        url_nodes = serials_node.find_all('a', href=url_regexp)
+        url_nodes = serials_node.find_all('a', href=SHOW_URL_REGEXP)
         for url_node in url_nodes:
             href = url_node.get('href')
-            url_match = url_regexp.search(href)
+            url_match = SHOW_URL_REGEXP.search(href)
             if not url_match:
                 continue
 
@@ -278,6 +371,101 @@ class AlexFilmParser(object):
 
         return shows
 
+    @staticmethod
+    @timed('parse_time')
+    def parse_show_topics(html: Text, base_url: Text) -> Set[AlexFilmTopic]:
+        serial_tree = bs4.BeautifulSoup(html, 'html.parser')
+        serial_table_node = serial_tree.find('section')
+        if not serial_table_node:
+            raise ParsingError('node <section> is not found')
+
+        topics = set()
+        topic_ids = set()
+
+        panel_nodes = serial_table_node.find_all('div', class_=PANEL_CLASS_REGEXP)
+        for panel_node in panel_nodes:
+            url_node = panel_node.find('a', href=TOPIC_HREF_REGEXP)
+            if not url_node:
+                continue
+
+            name_match = TOPIC_NAME_REGEXP.match(url_node.text)
+            if not name_match:
+                continue
+
+            url = url_node.get('href')
+            topic_id = int(TOPIC_HREF_REGEXP.search(url).group(1))
+            if topic_id in topic_ids:
+                continue
+            topic_ids.add(topic_id)
+
+            topic = AlexFilmTopic(id_=topic_id,
+                                  title=name_match.group(2),
+                                  alternative_title=name_match.group(1),
+                                  season=int(name_match.group(3)),
+                                  first_episode=int(name_match.group(4)),
+                                  last_episode=int(name_match.group(5)),
+                                  quality=name_match.group(6),
+                                  url=urljoin(base_url, url))
+            topics.add(topic)
+
+        return topics
+
+
+class DbAlexFilmTopic(Base):
+    __tablename__ = 'alexfilm_topics'
+    id = Column(Integer, primary_key=True, nullable=False)
+    show_id = Column(Integer, ForeignKey('alexfilm_shows.id'), index=True, nullable=False)
+    title = Column(Unicode, nullable=False)
+    alternative_title = Column(Unicode, nullable=False)
+    season = Column(Integer, nullable=False)
+    first_episode = Column(Integer, nullable=False)
+    last_episode = Column(Integer, nullable=False)
+    quality = Column(Unicode, nullable=False)
+    url = Column(Unicode, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __init__(self, topic: AlexFilmTopic, show_id: int, updated_at: datetime) -> None:
+        self.id = topic.id
+        self.show_id = show_id
+        self.title = topic.title
+        self.alternative_title = topic.alternative_title
+        self.season = topic.season
+        self.first_episode = topic.first_episode
+        self.last_episode = topic.last_episode
+        self.quality = topic.quality
+        self.url = topic.url
+        self.updated_at = updated_at
+
+    def to_topic(self) -> AlexFilmTopic:
+        return AlexFilmTopic(id_=self.id, title=self.title, alternative_title=self.alternative_title,
+                             season=self.season, first_episode=self.first_episode, last_episode=self.last_episode,
+                             quality=self.quality, url=self.url)
+
+
+class DbAlexFilmDownload(Base):
+    __tablename__ = 'alexfilm_downloads'
+    topic_id = Column(Integer, primary_key=True, nullable=False)
+    download_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __init__(self, topic_id: int, download_id: int, updated_at: datetime) -> None:
+        self.topic_id = topic_id
+        self.download_id = download_id
+        self.updated_at = updated_at
+
+
+class DbAlexFilmMagnet(Base):
+    __tablename__ = 'alexfilm_magnets'
+    topic_id = Column(Integer, primary_key=True, nullable=False)
+    # Empty for a topic which has no magnet, so that its page is not parsed again
+    magnet = Column(Unicode, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __init__(self, topic_id: int, magnet: str, updated_at: datetime) -> None:
+        self.topic_id = topic_id
+        self.magnet = magnet
+        self.updated_at = updated_at
+
 
 class AlexFilmDatabase(object):
     @staticmethod
@@ -363,13 +551,109 @@ class AlexFilmDatabase(object):
 
         return None
 
+    @staticmethod
+    def show_topics_timestamp(show_id: int, session: OrmSession) -> Optional[datetime]:
+        return session.query(func.min(DbAlexFilmTopic.updated_at)).filter(
+            DbAlexFilmTopic.show_id == show_id).scalar() or None
+
+    @staticmethod
+    def clear_show_topics(show_id: int, session: OrmSession) -> None:
+        session.query(DbAlexFilmTopic).filter(DbAlexFilmTopic.show_id == show_id).delete()
+        session.commit()
+
+    @staticmethod
+    def update_show_topics(show_id: int, topics: Set[AlexFilmTopic], session: OrmSession) -> None:
+        # A new release in the same topic comes with a new torrent, so forget its download id
+        def release(item) -> tuple:
+            return item.season, item.first_episode, item.last_episode, item.quality
+
+        db_topics = session.query(DbAlexFilmTopic).filter(DbAlexFilmTopic.show_id == show_id).all()
+        releases = {db_topic.id: release(db_topic) for db_topic in db_topics}
+        for topic in topics or ():
+            if topic.id in releases and releases[topic.id] != release(topic):
+                AlexFilmDatabase.clear_topic_links(topic.id, session)
+
+        # Clear database
+        AlexFilmDatabase.clear_show_topics(show_id, session)
+
+        # Insert new rows
+        if topics and len(topics) > 0:
+            now = datetime.now()
+            for topic in topics:
+                # A topic may move to another show page
+                session.query(DbAlexFilmTopic).filter(DbAlexFilmTopic.id == topic.id).delete()
+                session.add(DbAlexFilmTopic(topic=topic, show_id=show_id, updated_at=now))
+
+            session.commit()
+
+    @staticmethod
+    def get_show_topics(show_id: int, session: OrmSession) -> List[AlexFilmTopic]:
+        db_topics = session.query(DbAlexFilmTopic).filter(
+            DbAlexFilmTopic.show_id == show_id).order_by(DbAlexFilmTopic.id).all()
+        return [db_topic.to_topic() for db_topic in db_topics]
+
+    @staticmethod
+    def get_download_id(topic_id: int, lifetime: timedelta, session: OrmSession) -> Optional[int]:
+        db_download = session.query(DbAlexFilmDownload).filter(DbAlexFilmDownload.topic_id == topic_id).first()
+        if db_download and datetime.now() - db_download.updated_at < lifetime:
+            return db_download.download_id
+
+        return None
+
+    @staticmethod
+    def clear_topic_links(topic_id: int, session: OrmSession) -> None:
+        session.query(DbAlexFilmDownload).filter(DbAlexFilmDownload.topic_id == topic_id).delete()
+        session.query(DbAlexFilmMagnet).filter(DbAlexFilmMagnet.topic_id == topic_id).delete()
+        session.commit()
 
-TOPIC_URL_REGEXP = re.compile(r'^https?://(?:www\.)?alexfilm\.org/viewtopic\.php\?t=(\d+).*$', flags=re.IGNORECASE)
-DOWNLOAD_URL_REGEXP = re.compile(r'dl\.php\?id=(\d+)', flags=re.IGNORECASE)
-SEARCH_STRING_REGEXPS = [
-    re.compile(r'^(.*?)\s*(\d+?)x(\d+?)$', flags=re.IGNORECASE),
-    re.compile(r'^(.*?)\s*s(\d+?)e(\d+?)$', flags=re.IGNORECASE)
-]
+    @staticmethod
+    def update_download_id(topic_id: int, download_id: int, session: OrmSession) -> None:
+        db_download = session.query(DbAlexFilmDownload).filter(DbAlexFilmDownload.topic_id == topic_id).first()
+        if db_download:
+            db_download.download_id = download_id
+            db_download.updated_at = datetime.now()
+        else:
+            session.add(DbAlexFilmDownload(topic_id=topic_id, download_id=download_id, updated_at=datetime.now()))
+        session.commit()
+
+    @staticmethod
+    def get_magnet(topic_id: int, lifetime: timedelta, session: OrmSession) -> Optional[Text]:
+        """Returns the cached magnet of the topic, an empty string if it is known to have none or None."""
+
+        db_magnet = session.query(DbAlexFilmMagnet).filter(DbAlexFilmMagnet.topic_id == topic_id).first()
+        if db_magnet and datetime.now() - db_magnet.updated_at < lifetime:
+            return db_magnet.magnet
+
+        return None
+
+    @staticmethod
+    def update_magnet(topic_id: int, magnet: Text, session: OrmSession) -> None:
+        db_magnet = session.query(DbAlexFilmMagnet).filter(DbAlexFilmMagnet.topic_id == topic_id).first()
+        if db_magnet:
+            db_magnet.magnet = magnet
+            db_magnet.updated_at = datetime.now()
+        else:
+            session.add(DbAlexFilmMagnet(topic_id=topic_id, magnet=magnet, updated_at=datetime.now()))
+        session.commit()
+
+
+TOPIC_URL_REGEXP = lazy_compile(r'^https?://(?:www\.)?alexfilm\.org/viewtopic\.php\?t=(\d+).*$', flags=re.IGNORECASE)
+TOPIC_HREF_REGEXP = lazy_compile(r'viewtopic\.php\?t=(\d+)', flags=re.IGNORECASE)
+DOWNLOAD_URL_REGEXP = lazy_compile(r'dl\.php\?id=(\d+)', flags=re.IGNORECASE)
+MAGNET_INFO_HASH_REGEXP = lazy_compile(r'xt=urn:btih:([0-9a-f]{40}|[a-z2-7]{32})(?![0-9a-z])', flags=re.IGNORECASE)
+SHOW_URL_REGEXP = lazy_compile(r'f=(\d+)', flags=re.IGNORECASE)
+PANEL_CLASS_REGEXP = lazy_compile(r'panel.*', flags=re.IGNORECASE)
+# format: '\2 / \1 / s\3e\4-e\5 / \6'
+TOPIC_NAME_REGEXP = lazy_compile(
+    r"^([^/]*?)\s*/\s*([^/]*?)\s/\s*[Сс]езон\s*(\d+)\s*/\s*[Сс]ерии\s*(\d+)-(\d+).*,\s*(.*)\s*\].*$",
+    flags=re.IGNORECASE)
+
+SHOWS_CACHE_DAYS_LIFETIME = 3
+SHOW_TOPICS_CACHE_DAYS_LIFETIME = 1
+DOWNLOADS_CACHE_DAYS_LIFETIME = 30
+
+URL_REWRITE_WORKERS = 4
+URL_REWRITE_LIMITER = RateLimiter(3)
 
 
 class AlexFilm(object):
@@ -384,10 +668,14 @@ class AlexFilm(object):
         topic_response.raise_for_status()
         return AlexFilmParser.parse_download_id(topic_response.text)
 
+    @staticmethod
+    def get_download_url_by_id(download_id: int) -> Text:
+        return '{0}/dl.php?id={1}'.format(BASE_URL, download_id)
+
     @staticmethod
     def get_download_url(requests: RequestsSession, topic_id: int) -> str:
         download_id = AlexFilm.get_download_id(requests, topic_id)
-        return '{0}/dl.php?id={1}'.format(BASE_URL, download_id)
+        return AlexFilm.get_download_url_by_id(download_id)
 
     @staticmethod
     def get_magnet(requests: RequestsSession, topic_id: int) -> Text:
@@ -396,9 +684,46 @@ class AlexFilm(object):
         topic_response.raise_for_status()
         return AlexFilmParser.parse_magnet(topic_response.text)
 
+    @staticmethod
+    def get_show_topics(requests: RequestsSession, show_url: Text) -> Set[AlexFilmTopic]:
+        response = requests.get(show_url)
+        response.raise_for_status()
+        return AlexFilmParser.parse_show_topics(response.text, response.url)
+
 
 class AlexFilmPlugin(object):
-    """AlexFilm urlrewrite/search plugin."""
+    """
+    AlexFilm urlrewrite/search plugin.
+
+    Usage:
+
+        alexfilm: yes
+
+    or, to get magnets instead of .torrent files:
+
+        alexfilm:
+          prefer_magnet: yes
+    """
+
+    schema = {
+        'oneOf': [
+            {'type': 'boolean'},
+            {
+                'type': 'object',
+                'properties': {
+                    'prefer_magnet': {'type': 'boolean', 'default': False},
+                },
+                'additionalProperties': False
+            }
+        ]
+    }
+
+    def __init__(self):
+        # Urls resolved ahead by `on_task_urlrewrite`, by task: a task must not pick up the ones of another task
+        self._download_urls = WeakKeyDictionary()
+        # Shows by title and topic indexes by show, kept for the lifetime of each task
+        self._shows = TaskCache()
+        self._topic_indexes = TaskCache()
 
     def url_rewritable(self, task: Task, entry: Entry) -> bool:
         url = entry['url']
@@ -408,34 +733,130 @@ class AlexFilmPlugin(object):
 
         return False
 
-    def url_rewrite(self, task: Task, entry: Entry) -> bool:
-        topic_url = entry['url']
+    @staticmethod
+    def _prefer_magnet(config: Union[bool, Dict, None]) -> bool:
+        return isinstance(config, dict) and config.get('prefer_magnet', False)
 
+    def _get_topic_links(self, task: Task, topic_url: Text) -> Tuple[Optional[int], Optional[Text]]:
+        URL_REWRITE_LIMITER.wait()
         try:
             topic_response = task.requests.get(topic_url)
             topic_response.raise_for_status()
         except RequestException as e:
-            reject_reason = "Error while fetching page: {0}".format(e)
-            log.error(reject_reason)
-            entry.reject(reject_reason)
-            sleep(3)
-            return False
+            raise PluginError("Error while fetching page: {0}".format(e))
         topic_html = topic_response.content
-        sleep(3)
 
         try:
-            download_url = AlexFilmParser.parse_download_url(topic_html)
+            return AlexFilmParser.parse_topic_links(topic_html)
         except ParsingError as e:
-            reject_reason = "Error while parsing topic page: {0}".format(e)
+            raise PluginError("Error while parsing topic page: {0}".format(e))
+
+    def _get_download_urls(self, task: Task, topic_urls: Set[Text],
+                           prefer_magnet: bool = False) -> Dict[Text, Union[Text, Exception]]:
+        """
+        Resolves download urls (or magnets, if preferred and available) of the topics.
+        Known topics are taken from the database, the rest are resolved concurrently from the topic pages
+        and stored. Returns the results keyed by topic url; a failure is returned in place of the url.
+        """
+
+        lifetime = timedelta(days=DOWNLOADS_CACHE_DAYS_LIFETIME)
+
+        def download_url(download_id: Optional[int], magnet: Optional[Text]) -> Union[Text, Exception]:
+            if prefer_magnet and magnet:
+                return magnet
+            if download_id:
+                return AlexFilm.get_download_url_by_id(download_id)
+            return PluginError("Error while parsing topic page: download node is not found")
+
+        download_urls = dict()
+        with Session() as session:
+            topic_ids = dict()
+            for topic_url in topic_urls:
+                topic_id = int(TOPIC_URL_REGEXP.match(topic_url).group(1))
+                download_id = AlexFilmDatabase.get_download_id(topic_id, lifetime, session)
+                if prefer_magnet:
+                    magnet = AlexFilmDatabase.get_magnet(topic_id, lifetime, session)
+                    STATS.cache_lookup('alexfilm_magnets', magnet is not None)
+                    if magnet:
+                        log.debug('Magnet of topic {0} has been found in the cache'.format(topic_id))
+                        download_urls[topic_url] = magnet
+                        continue
+                    if magnet is not None and download_id:
+                        log.debug('Topic {0} has no magnet, its cached download id is used'.format(topic_id))
+                        download_urls[topic_url] = AlexFilm.get_download_url_by_id(download_id)
+                        continue
+                else:
+                    STATS.cache_lookup('alexfilm_downloads', download_id is not None)
+                    if download_id:
+                        log.debug('Download id of topic {0} has been found in the cache'.format(topic_id))
+                        download_urls[topic_url] = AlexFilm.get_download_url_by_id(download_id)
+                        continue
+
+                topic_ids[topic_url] = topic_id
+
+            if topic_ids:
+                log.debug('Resolving {0} download url(s)...'.format(len(topic_ids)))
+                preload(bs4)
+                topic_links = map_concurrently(
+                    lambda url: self._get_topic_links(task, url), topic_ids, URL_REWRITE_WORKERS)
+                for topic_url, links in topic_links.items():
+                    if isinstance(links, Exception):
+                        download_urls[topic_url] = links
+                        continue
+
+                    download_id, magnet = links
+                    if download_id:
+                        AlexFilmDatabase.update_download_id(topic_ids[topic_url], download_id, session)
+                        # Remember a missing magnet too, to fall back to the download id without the page
+                        AlexFilmDatabase.update_magnet(topic_ids[topic_url], magnet or '', session)
+                    elif magnet:
+                        AlexFilmDatabase.update_magnet(topic_ids[topic_url], magnet, session)
+                    download_urls[topic_url] = download_url(download_id, magnet)
+
+        return download_urls
+
+    @staticmethod
+    def _set_download_url(entry: Entry, download_url: Text) -> None:
+        entry['url'] = download_url
+        if download_url.startswith('magnet:'):
+            info_hash = AlexFilmParser.parse_magnet_info_hash(download_url)
+            if info_hash:
+                entry['torrent_info_hash'] = info_hash
+
+    # Resolve all accepted entries at once, so `url_rewrite` just picks up the results
+    @plugin.priority(plugin.PRIORITY_FIRST)
+    @STATS.phase(URL_REWRITE)
+    def on_task_urlrewrite(self, task: Task, config: Dict = None) -> None:
+        self._download_urls.pop(task, None)
+        urls = set(entry['url'] for entry in task.accepted if self.url_rewritable(task, entry))
+        if not urls:
+            return
+
+        self._download_urls[task] = self._get_download_urls(task, urls, self._prefer_magnet(config))
+
+    @STATS.phase(URL_REWRITE)
+    def url_rewrite(self, task: Task, entry: Entry) -> bool:
+        topic_url = entry['url']
+
+        try:
+            resolved_urls = self._download_urls.get(task, dict())
+            if topic_url in resolved_urls:
+                download_url = resolved_urls.pop(topic_url)
+            else:
+                prefer_magnet = self._prefer_magnet(task.config.get(PLUGIN_NAME))
+                download_url = self._get_download_urls(task, {topic_url}, prefer_magnet)[topic_url]
+            if isinstance(download_url, Exception):
+                raise download_url
+        except PluginError as e:
+            reject_reason = str(e)
             log.error(reject_reason)
             entry.reject(reject_reason)
             return False
 
-        download_url = urljoin(topic_response.url, download_url)
-
-        entry['url'] = download_url
+        self._set_download_url(entry, download_url)
         return True
 
+    @STATS.phase(CACHE_REFRESH)
     def get_shows(self, task: Task) -> Optional[Set[AlexFilmShow]]:
         try:
             serials_response = task.requests.get(BASE_URL)
@@ -459,7 +880,8 @@ class AlexFilmPlugin(object):
         db_timestamp = AlexFilmDatabase.shows_timestamp(session)
         if db_timestamp:
             difference = datetime.now() - db_timestamp
-            update_required = difference.days > 3
+            update_required = difference.days > SHOWS_CACHE_DAYS_LIFETIME
+        STATS.cache_lookup('alexfilm_shows', not update_required)
         if update_required:
             log.debug('Update shows...')
             shows = self.get_shows(task)
@@ -470,98 +892,101 @@ class AlexFilmPlugin(object):
         show = AlexFilmDatabase.find_show_by_title(title, session)
         return show
 
-    def search(self, task: Task, entry: Entry, config: Dict = None) -> Set[Entry]:
-        with Session() as session:
-            topic_name_regexp = re.compile(
-                r"^([^/]*?)\s*/\s*([^/]*?)\s/\s*[Сс]езон\s*(\d+)\s*/\s*[Сс]ерии\s*(\d+)-(\d+).*,\s*(.*)\s*\].*$",
-                flags=re.IGNORECASE)
-            panel_class_regexp = re.compile(r'panel.*', flags=re.IGNORECASE)
-            url_regexp = re.compile(r'viewtopic\.php\?t=(\d+)', flags=re.IGNORECASE)
+    def search_show_topics(self, task: Task, show: AlexFilmShow, session: OrmSession) -> Dict[int, List[AlexFilmTopic]]:
+        """Topics of the show by season; loaded (and refreshed if needed) once per task."""
 
-            # regexp: '^([^/]*?)\s*/\s*([^/]*?)\s/\s*[Сс]езон\s*(\d+)\s*/\s*[Сс]ерии\s*(\d+)-(\d+).*,\s*(.*)\s*\].*$'
-            # format: '\2 / \1 / s\3e\4-e\5 / \6'
+        return self._topic_indexes.get(task, show.show_id, lambda: self._load_show_topics(task, show, session))
 
+    def _load_show_topics(self, task: Task, show: AlexFilmShow, session: OrmSession) -> Dict[int, List[AlexFilmTopic]]:
+        update_required = True
+        db_timestamp = AlexFilmDatabase.show_topics_timestamp(show.show_id, session)
+        if db_timestamp:
+            difference = datetime.now() - db_timestamp
+            update_required = difference.days > SHOW_TOPICS_CACHE_DAYS_LIFETIME
+        STATS.cache_lookup('alexfilm_topics', not update_required)
+        if update_required:
+            log.debug('Update topics for show `{0}`...'.format(show.titles[0]))
+            try:
+                topics = AlexFilm.get_show_topics(task.requests, show.url)
+            except (RequestException, ParsingError) as e:
+                log.error("Error while fetching show topics: {0}".format(e))
+            else:
+                log.debug('{0} topic(s) received for show `{1}`'.format(len(topics), show.titles[0]))
+                AlexFilmDatabase.update_show_topics(show.show_id, topics, session)
+            sleep(3)
+
+        index = dict()
+        for topic in AlexFilmDatabase.get_show_topics(show.show_id, session):
+            index.setdefault(topic.season, list()).append(topic)
+        return index
+
+    @STATS.phase(SEARCH)
+    def search(self, task: Task, entry: Entry, config: Dict = None) -> Set[Entry]:
+        with Session() as session:
             entries = set()
             for search_string in entry.get('search_strings', [entry['title']]):
-                search_match = None
-                for search_string_regexp in SEARCH_STRING_REGEXPS:
-                    search_match = search_string_regexp.search(search_string)
-                    if search_match:
-                        break
-
-                if not search_match:
+                search = parse_search_string(search_string)
+                if not search:
                     log.warning("Invalid search string: {0}".format(search_string))
                     continue
+                if search.season is None:
+                    log.debug("Absolute episode numbers are not supported: {0}".format(search_string))
+                    continue
 
-                search_title = search_match.group(1)
-                search_season = int(search_match.group(2))
-                search_episode = int(search_match.group(3))
-
-                log.debug("{0} s{1:02d}e{2:02d}".format(search_title, search_season, search_episode))
+                search_title = search.title
+                log.debug("{0} {1}".format(search_title, search.get_episode_id()))
 
-                show = self.search_show(task, search_title, session)
+                show = self._shows.get(task, search_title, lambda: self.search_show(task, search_title, session))
                 if not show:
                     log.warning("Unknown show: {0}".format(search_title))
                     continue
 
-                try:
-                    serial_response = task.requests.get(show.url)
-                    serial_response.raise_for_status()
-                except RequestException as e:
-                    log.error("Error while fetching page: {0}".format(e))
-                    sleep(3)
-                    continue
-                serial_html = serial_response.text
-                sleep(3)
-
-                serial_tree = BeautifulSoup(serial_html, 'html.parser')
-                serial_table_node = serial_tree.find('section')
-                if not serial_table_node:
-                    log.error('Error while parsing serial page: node <table class=`table.*`> are not found')
-                    continue
-
-                panel_nodes = serial_table_node.find_all('div', class_=panel_class_regexp)
-                for panel_node in panel_nodes:
-                    url_node = panel_node.find('a', href=url_regexp)
-                    if not url_node:
-                        continue
-
-                    topic_name = url_node.text
-                    name_match = topic_name_regexp.match(topic_name)
-                    if not name_match:
-                        continue
-
-                    title = name_match.group(2)
-                    alternative_title = name_match.group(1)
-                    season = int(name_match.group(3))
-                    first_episode = int(name_match.group(4))
-                    last_episode = int(name_match.group(5))
-                    quality = name_match.group(6)
-
-                    if search_season != season or (search_episode < first_episode or search_episode > last_episode):
+                topics = self.search_show_topics(task, show, session).get(search.season, ())
+                for topic in topics:
+                    if not search.matches(topic.season, topic.first_episode, topic.last_episode):
                         continue
 
-                    episode_id = "s{0:02d}e{1:02d}-{2:02d}".format(season, first_episode, last_episode)
-                    name = "{0} / {1} / {2} / {3}".format(title, alternative_title, episode_id, quality)
-                    topic_url = url_node.get('href')
-                    topic_url = urljoin(serial_response.url, topic_url)
+                    episode_id = topic.get_episode_id()
+                    name = "{0} / {1} / {2} / {3}".format(topic.title, topic.alternative_title, episode_id,
+                                                          topic.quality)
 
-                    log.debug("{0} - {1}".format(name, topic_url))
+                    log.debug("{0} - {1}".format(name, topic.url))
 
                     entry = Entry()
                     entry['title'] = name
-                    entry['url'] = topic_url
+                    entry['url'] = topic.url
                     entry['series_id'] = episode_id
 
                     entries.add(entry)
 
+            if self._prefer_magnet(config):
+                # Entries which failed to resolve keep the topic url to be rewritten later
+                download_urls = self._get_download_urls(task, set(entry['url'] for entry in entries), True)
+                for entry in entries:
+                    download_url = download_urls.get(entry['url'])
+                    if isinstance(download_url, Exception):
+                        log.warning(download_url)
+                    elif download_url and download_url.startswith('magnet:'):
+                        self._set_download_url(entry, download_url)
+
             return entries
 
 
 # endregion
 
 
+def do_cli(manager: Manager, options_: Any) -> None:
+    with manager.acquire_lock():
+        if options_.lf_action == 'stats':
+            print_stats(PLUGIN_NAME)
+
+
 @event('plugin.register')
 def register_plugin() -> None:
+    # Register CLI commands
+    parser = options.register_command(PLUGIN_NAME, do_cli, help='Utilities to manage the AlexFilm plugin')
+    subparsers = parser.add_subparsers(title='Actions', metavar='<action>', dest='lf_action')
+    subparsers.add_parser('stats', help='Show the request, parse, database and sleep statistics')
+
     plugin.register(AlexFilmAuthPlugin, PLUGIN_NAME + '_auth', api_ver=2)
-    plugin.register(AlexFilmPlugin, PLUGIN_NAME, interfaces=['urlrewriter', 'search'], api_ver=2)
+    plugin.register(AlexFilmPlugin, PLUGIN_NAME, interfaces=['urlrewriter', 'search', 'task'], api_ver=2)
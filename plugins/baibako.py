@@ -4,13 +4,11 @@ import hashlib
 import logging
 import re
 from datetime import datetime, timedelta
-from time import sleep
-from typing import Dict, Text, Optional, Set, List, Any
+from typing import Dict, Text, Optional, Set, List, Tuple, Any, Union
 
-import bencodepy
-from bs4 import BeautifulSoup
 from flexget import options
 from flexget import plugin
+from flexget import db_schema
 from flexget.db_schema import versioned_base
 from flexget.entry import Entry
 from flexget.event import event
@@ -18,29 +16,50 @@ from flexget.manager import Session, Manager
 from flexget.plugin import PluginError
 from flexget.task import Task
 from flexget.terminal import console
+from flexget.utils.sqlalchemy_utils import table_exists, table_schema
 from requests import Session as RequestsSession, PreparedRequest
 from requests.auth import AuthBase
-from sqlalchemy import Column, Unicode, Integer, DateTime, func
+from sqlalchemy import Column, Unicode, Integer, DateTime, UniqueConstraint, func
 from sqlalchemy.orm import Session as OrmSession
 
-from .utils import ContentType, JSONEncodedDict
+from .utils import JSONEncodedDict, AuthPool, account_configs, cookie_header, download_torrent, match_host
+from .utils import TaskCache, lazy_compile, lazy_import, parse_search_string
+from .stats import TrackerStats, AUTH, SEARCH, URL_REWRITE, FILTER, CACHE_REFRESH
+from .stats import measure, print_stats, sleep, timed, track_requests
+
+bs4 = lazy_import('bs4')
+bencodepy = lazy_import('bencodepy')
 
 PLUGIN_NAME = 'baibako'
-SCHEMA_VER = 0
+SCHEMA_VER = 1
 
 log = logging.getLogger(PLUGIN_NAME)
 Base = versioned_base(PLUGIN_NAME, SCHEMA_VER)
+STATS = TrackerStats(PLUGIN_NAME)
+
+
+@db_schema.upgrade(PLUGIN_NAME)
+def upgrade(ver: Optional[int], session: OrmSession) -> int:
+    if ver is None:
+        ver = 0
+    if ver == 0:
+        # The topics cache was keyed by forum only. It is rebuilt on demand, so just drop it.
+        if table_exists('baibako_topics', session):
+            table_schema('baibako_topics', session).drop(session.bind)
+        ver = 1
+    return ver
+
 
 BASE_URL = 'http://baibako.tv'
 COOKIES_DOMAIN = 'baibako.tv'
 
-HOST_REGEXP = re.compile(r'^https?://(?:www\.)?(?:.+\.)?baibako\.tv', flags=re.IGNORECASE)
+HOST_REGEXP = lazy_compile(r'^https?://(?:www\.)?(?:.+\.)?baibako\.tv', flags=re.IGNORECASE)
 
 USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/45.0.2454.85 Safari/537.36'
 
 
 def validate_host(url: Text) -> bool:
-    return HOST_REGEXP.match(url) is not None
+    return match_host(HOST_REGEXP, url)
 
 
 # region BaibakoAuthPlugin
@@ -64,9 +83,11 @@ class BaibakoAuth(AuthBase):
     and cookies will be just set
     """
 
+    @STATS.phase(AUTH)
     def try_authenticate(self, payload: Dict) -> Dict:
         for _ in range(5):
             with RequestsSession() as session:
+                track_requests(session)
                 session.headers.update({'User-Agent': USER_AGENT})
 
                 response = session.post('{0}/takelogin.php'.format(BASE_URL), data=payload)
@@ -74,17 +95,19 @@ class BaibakoAuth(AuthBase):
 
                 cookies = session.cookies.get_dict(domain=COOKIES_DOMAIN)
                 if cookies and len(cookies) > 0 and 'uid' in cookies:
+                    STATS.login(True)
                     return cookies
 
             sleep(3)
 
+        STATS.login(False)
         raise PluginError('Unable to obtain cookies from Baibako. Looks like invalid username or password.')
 
     def __init__(self, username: Text, password: Text, cookies: Dict = None, session: OrmSession = None) -> None:
         if cookies is None:
             log.debug('Baibako cookie not found. Requesting new one.')
             payload_ = {'username': username, 'password': password}
-            self.__cookies = self.try_authenticate(payload_)
+            self.__set_cookies(self.try_authenticate(payload_))
             if session:
                 session.add(
                     BaibakoAccount(
@@ -97,15 +120,19 @@ class BaibakoAuth(AuthBase):
             #         'session can not be None if cookies is None')
         else:
             log.debug('Using previously saved cookie.')
-            self.__cookies = cookies
+            self.__set_cookies(cookies)
+
+    def __set_cookies(self, cookies: Dict) -> None:
+        self.__cookies = cookies
+        self.__headers = {
+            'User-Agent': USER_AGENT,
+            'Cookie': cookie_header(cookies)
+        }
 
     def __call__(self, request: PreparedRequest) -> PreparedRequest:
         # request.prepare_cookies(self.__cookies)
         if validate_host(request.url):
-            request.headers.update({
-                'User-Agent': USER_AGENT,
-                'Cookie': '; '.join('{0}={1}'.format(key, val) for key, val in self.__cookies.items())
-            })
+            request.headers.update(self.__headers)
         return request
 
 
@@ -115,9 +142,17 @@ class BaibakoAuthPlugin(object):
     baibako_auth:
       username: 'username_here'
       password: 'password_here'
+
+    Several accounts can be used to spread requests over them:
+
+    baibako_auth:
+      - username: 'username_1'
+        password: 'password_1'
+      - username: 'username_2'
+        password: 'password_2'
     """
 
-    schema = {
+    account_schema = {
         'type': 'object',
         'properties': {
             'username': {'type': 'string'},
@@ -126,7 +161,15 @@ class BaibakoAuthPlugin(object):
         'additionalProperties': False
     }
 
+    schema = {
+        'oneOf': [
+            account_schema,
+            {'type': 'array', 'items': account_schema, 'minItems': 1}
+        ]
+    }
+
     auth_cache = {}
+    pool_cache = {}
 
     def try_find_cookie(self, session: OrmSession, username: Text) -> Optional[Dict]:
         account = session.query(BaibakoAccount).filter(BaibakoAccount.username == username).first()
@@ -139,7 +182,7 @@ class BaibakoAuthPlugin(object):
         else:
             return None
 
-    def get_auth_handler(self, config: Dict) -> BaibakoAuth:
+    def get_account_auth_handler(self, config: Dict) -> AuthBase:
         username = config.get('username')
         if not username or len(username) <= 0:
             raise PluginError('Username are not configured.')
@@ -157,6 +200,18 @@ class BaibakoAuthPlugin(object):
 
             return auth_handler
 
+    def get_auth_handler(self, config: Union[Dict, List[Dict]]) -> AuthBase:
+        accounts = account_configs(config)
+        if len(accounts) == 1:
+            return self.get_account_auth_handler(accounts[0])
+
+        usernames = tuple(account.get('username') for account in accounts)
+        if usernames not in self.pool_cache:
+            handlers = [self.get_account_auth_handler(account) for account in accounts]
+            self.pool_cache[usernames] = AuthPool(handlers, validate_host)
+
+        return self.pool_cache[usernames]
+
     @plugin.priority(plugin.PRIORITY_DEFAULT)
     def on_task_start(self, task: Task, config: Dict) -> None:
         task.requests.auth = self.get_auth_handler(config)
@@ -174,8 +229,7 @@ class BaibakoAuthPlugin(object):
                 log.debug('entry %s has invalid host, skipping', entry)
                 continue
 
-            username = config.get('username')
-            log.debug('setting auth with username %s', username)
+            log.debug('setting auth for %s', entry)
             entry['download_auth'] = self.get_auth_handler(config)
 
 
@@ -183,12 +237,12 @@ class BaibakoAuthPlugin(object):
 
 
 # region BaibakoPlugin
-TABLE_CLASS_REGEXP = re.compile(r'table.*', flags=re.IGNORECASE)
+TABLE_CLASS_REGEXP = lazy_compile(r'table.*', flags=re.IGNORECASE)
 
-FORUM_ID_REGEXP = re.compile(r'serial\.php\?id=(\d+)', flags=re.IGNORECASE)
-TOPIC_ID_REGEXP = re.compile(r'details\.php\?id=(\d+)', flags=re.IGNORECASE)
+FORUM_ID_REGEXP = lazy_compile(r'serial\.php\?id=(\d+)', flags=re.IGNORECASE)
+TOPIC_ID_REGEXP = lazy_compile(r'details\.php\?id=(\d+)', flags=re.IGNORECASE)
 
-TOPIC_TITLE_REGEXP = re.compile(
+TOPIC_TITLE_REGEXP = lazy_compile(
     r'^(?P<title>[^/]*?)\s*/\s*(?P<title_orig>[^/]*?)\s*/\s*s(?P<season>\d+)(?:e(?P<episode_begin>\d+)(?:-(?P<episode_end>\d+))?)?\s*/\s*(?P<quality>[^/]*?)\s*(?:(?:/.*)|$)',
     flags=re.IGNORECASE)
 
@@ -246,8 +300,9 @@ class BaibakoParser(object):
         return int(match.group(1))
 
     @staticmethod
+    @timed('parse_time')
     def parse_forums(html: Text) -> Set[BaibakoForum]:
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = bs4.BeautifulSoup(html, 'html.parser')
         table_node = soup.find('div', class_="row serialsearch")
         if not table_node:
             raise ParsingError('Node <div class=`row serialsearch`> are not found')
@@ -269,8 +324,9 @@ class BaibakoParser(object):
         return forums
 
     @staticmethod
+    @timed('parse_time')
     def parse_topics(html: Text) -> Set[BaibakoTopic]:
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = bs4.BeautifulSoup(html, 'html.parser')
         table_node = soup.find('table', class_=TABLE_CLASS_REGEXP)
         if not table_node:
             raise ParsingError('Node <table class=`table.*`> are not found')
@@ -332,15 +388,22 @@ class DbBaibakoForum(Base):
 
 class DbBaibakoTopic(Base):
     __tablename__ = 'baibako_topics'
-    id = Column(Integer, primary_key=True, nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    topic_id = Column(Integer, nullable=False)
     forum_id = Column(Integer, nullable=False)
+    tab = Column(Unicode, nullable=False)
     title = Column(Unicode, nullable=False)
+    quality = Column(Unicode, nullable=True)
     updated_at = Column(DateTime, nullable=False)
+    __table_args__ = (UniqueConstraint('forum_id', 'tab', 'topic_id', name='_uc_forum_tab_topic'),)
 
-    def __init__(self, id_: int, forum_id: int, title: str, updated_at: datetime) -> None:
-        self.id = id_
+    def __init__(self, topic_id: int, forum_id: int, tab: str, title: str, quality: Optional[str],
+                 updated_at: datetime) -> None:
+        self.topic_id = topic_id
         self.forum_id = forum_id
+        self.tab = tab
         self.title = title
+        self.quality = quality
         self.updated_at = updated_at
 
 
@@ -399,40 +462,58 @@ class BaibakoDatabase(object):
         return None
 
     @staticmethod
-    def forum_topics_timestamp(forum_id: int, session: OrmSession) -> datetime:
+    def forum_topics_timestamp(forum_id: int, tab: Text, session: OrmSession) -> datetime:
         return session.query(func.min(DbBaibakoTopic.updated_at)).filter(
-            DbBaibakoTopic.forum_id == forum_id).scalar() or None
+            DbBaibakoTopic.forum_id == forum_id, DbBaibakoTopic.tab == tab).scalar() or None
 
     @staticmethod
-    def forum_topics_count(forum_id: int, session: OrmSession) -> int:
-        return session.query(DbBaibakoTopic).filter(DbBaibakoTopic.forum_id == forum_id).count()
+    def forum_topics_count(forum_id: int, tab: Text, session: OrmSession) -> int:
+        return session.query(DbBaibakoTopic).filter(
+            DbBaibakoTopic.forum_id == forum_id, DbBaibakoTopic.tab == tab).count()
 
     @staticmethod
-    def clear_forum_topics(forum_id: int, session: OrmSession) -> None:
-        session.query(DbBaibakoTopic).filter(DbBaibakoTopic.forum_id == forum_id).delete()
+    def clear_forum_topics(forum_id: int, tab: Text, session: OrmSession) -> None:
+        session.query(DbBaibakoTopic).filter(
+            DbBaibakoTopic.forum_id == forum_id, DbBaibakoTopic.tab == tab).delete()
         session.commit()
 
     @staticmethod
-    def update_forum_topics(forum_id: int, topics: Set[BaibakoTopic], session: OrmSession) -> None:
+    def update_forum_topics(forum_id: int, tab: Text, topics: Set[BaibakoTopic], session: OrmSession) -> None:
         # Clear database
-        BaibakoDatabase.clear_forum_topics(forum_id, session)
+        BaibakoDatabase.clear_forum_topics(forum_id, tab, session)
 
         # Insert new rows
         if topics and len(topics) > 0:
             now = datetime.now()
+            topic_ids = set()
             for topic in topics:
-                db_topic = DbBaibakoTopic(id_=topic.id, forum_id=forum_id, title=topic.title, updated_at=now)
+                if topic.id in topic_ids:
+                    continue
+                topic_ids.add(topic.id)
+
+                try:
+                    quality = BaibakoParser.parse_topic_title(topic.title).quality
+                except ParsingError:
+                    quality = None
+
+                db_topic = DbBaibakoTopic(topic_id=topic.id, forum_id=forum_id, tab=tab, title=topic.title,
+                                          quality=quality, updated_at=now)
                 session.add(db_topic)
 
             session.commit()
 
     @staticmethod
-    def get_forum_topics(forum_id: int, session: OrmSession) -> Set[BaibakoTopic]:
+    def get_forum_topics(forum_id: int, tab: Text, session: OrmSession, quality: Text = None) -> Set[BaibakoTopic]:
+        """Gets cached topics of the forum tab. `quality` keeps only topics whose quality contains it."""
+
         topics = set()
 
-        db_topics = session.query(DbBaibakoTopic).filter(DbBaibakoTopic.forum_id == forum_id)
+        db_topics = session.query(DbBaibakoTopic).filter(
+            DbBaibakoTopic.forum_id == forum_id, DbBaibakoTopic.tab == tab)
+        if quality:
+            db_topics = db_topics.filter(DbBaibakoTopic.quality.ilike('%{0}%'.format(quality)))
         for db_topic in db_topics:
-            topic = BaibakoTopic(db_topic.id, db_topic.title)
+            topic = BaibakoTopic(db_topic.topic_id, db_topic.title)
             topics.add(topic)
 
         return topics
@@ -452,6 +533,7 @@ class Baibako(object):
         return '{0}/download.php?id={1}'.format(BASE_URL, topic_id)
 
     @staticmethod
+    @STATS.phase(CACHE_REFRESH)
     def get_forums(requests: RequestsSession) -> Set[BaibakoForum]:
         url = '{0}/serials.php'.format(BASE_URL)
         response = requests.get(url)
@@ -476,20 +558,20 @@ class Baibako(object):
     @staticmethod
     def get_info_hash(requests: RequestsSession, topic_id: int) -> Text:
         download_url = Baibako.get_download_url(topic_id)
-        response = requests.get(download_url)
-        response.raise_for_status()
-        ContentType.raise_not_torrent(response)
+        content = download_torrent(requests, download_url)
 
-        info = bencodepy.decode(response.content)
-        return hashlib.sha1(bencodepy.encode(info[b'info'])).hexdigest().lower()
+        with measure('parse_time', 'parse_torrent'):
+            info = bencodepy.decode(content)
+            return hashlib.sha1(bencodepy.encode(info[b'info'])).hexdigest().lower()
 
 
 FORUMS_CACHE_DAYS_LIFETIME = 3
 FORUM_TOPICS_CACHE_DAYS_LIFETIME = 1
-SEARCH_STRING_REGEXPS = [
-    re.compile(r'^(.*?)\s*(\d+?)x(\d+?)$', flags=re.IGNORECASE),
-    re.compile(r'^(.*?)\s*s(\d+?)e(\d+?)$', flags=re.IGNORECASE)
-]
+# Narrower tabs which can be answered from the `all` tab by the quality of a topic
+SERIAL_TAB_QUALITIES = {
+    'hd720': '720p',
+    'hd1080': '1080p',
+}
 
 
 class BaibakoPlugin(object):
@@ -515,9 +597,15 @@ class BaibakoPlugin(object):
         ]
     }
 
+    def __init__(self):
+        # Forums by title and topic indexes by forum and tab, kept for the lifetime of each task
+        self._forums = TaskCache()
+        self._topic_indexes = TaskCache()
+
     def url_rewritable(self, task: Task, entry: Entry) -> bool:
         return BaibakoParser.parse_topic_id(entry['url']) is not None
 
+    @STATS.phase(URL_REWRITE)
     def url_rewrite(self, task: Task, entry: Entry) -> bool:
         url = entry['url']
         url_match = TOPIC_ID_REGEXP.search(url)
@@ -532,6 +620,7 @@ class BaibakoPlugin(object):
         return True
 
     @plugin.priority(plugin.PRIORITY_LAST)
+    @STATS.phase(FILTER)
     def on_task_filter(self, task, config):
         if not config:
             log.debug('Filter disabled, skipping')
@@ -561,6 +650,7 @@ class BaibakoPlugin(object):
         if db_timestamp:
             difference = datetime.now() - db_timestamp
             update_required = difference.days > FORUMS_CACHE_DAYS_LIFETIME
+        STATS.cache_lookup('baibako_forums', not update_required)
         if update_required:
             log.debug('Update forums...')
             try:
@@ -574,75 +664,97 @@ class BaibakoPlugin(object):
 
         return BaibakoDatabase.find_forum_by_title(title, session)
 
-    def _search_forum_topics(self, task: Task, forum_id: int, tab: Text, session: OrmSession) -> Set[BaibakoTopic]:
-        update_required = True
-        db_timestamp = BaibakoDatabase.forum_topics_timestamp(forum_id, session)
-        if db_timestamp:
-            difference = datetime.now() - db_timestamp
-            update_required = difference.days > FORUM_TOPICS_CACHE_DAYS_LIFETIME
-        if update_required:
-            log.debug('Update topics for forum `{0}`...'.format(forum_id))
-            try:
-                topics = Baibako.get_forum_topics(forum_id, tab, task.requests)
-            except Exception as e:
-                log.warning(e)
-            else:
-                if topics:
-                    log.debug('{0} topic(s) received for forum `{1}`'.format(len(topics), forum_id))
-                    BaibakoDatabase.update_forum_topics(forum_id, topics, session)
-                    return topics
-
-        return BaibakoDatabase.get_forum_topics(forum_id, session)
+    @staticmethod
+    def _forum_topics_fresh(forum_id: int, tab: Text, session: OrmSession) -> bool:
+        db_timestamp = BaibakoDatabase.forum_topics_timestamp(forum_id, tab, session)
+        if not db_timestamp:
+            return False
+        difference = datetime.now() - db_timestamp
+        return difference.days <= FORUM_TOPICS_CACHE_DAYS_LIFETIME
 
+    def _search_forum_topics(self, task: Task, forum_id: int, tab: Text, session: OrmSession) -> Set[BaibakoTopic]:
+        if self._forum_topics_fresh(forum_id, tab, session):
+            STATS.cache_lookup('baibako_topics', True)
+            return BaibakoDatabase.get_forum_topics(forum_id, tab, session)
+
+        quality = SERIAL_TAB_QUALITIES.get(tab)
+        if quality and self._forum_topics_fresh(forum_id, 'all', session):
+            log.debug('Topics for forum `{0}` (tab `{1}`) are taken from the `all` tab'.format(forum_id, tab))
+            STATS.cache_lookup('baibako_topics', True)
+            return BaibakoDatabase.get_forum_topics(forum_id, 'all', session, quality=quality)
+
+        STATS.cache_lookup('baibako_topics', False)
+        log.debug('Update topics for forum `{0}` (tab `{1}`)...'.format(forum_id, tab))
+        try:
+            topics = Baibako.get_forum_topics(forum_id, tab, task.requests)
+        except Exception as e:
+            log.warning(e)
+        else:
+            if topics:
+                log.debug('{0} topic(s) received for forum `{1}`'.format(len(topics), forum_id))
+                BaibakoDatabase.update_forum_topics(forum_id, tab, topics, session)
+                return topics
+
+        return BaibakoDatabase.get_forum_topics(forum_id, tab, session)
+
+    def _get_topic_index(self, task: Task, forum_id: int, tab: Text,
+                         session: OrmSession) -> Dict[int, List[Tuple[BaibakoTopic, BaibakoTopicInfo]]]:
+        """Parsed topics of the forum tab by season; loaded (and refreshed if needed) once per task."""
+
+        def load_index() -> Dict[int, List[Tuple[BaibakoTopic, BaibakoTopicInfo]]]:
+            index = dict()
+            for topic in self._search_forum_topics(task, forum_id, tab, session):
+                try:
+                    topic_info = BaibakoParser.parse_topic_title(topic.title)
+                except ParsingError as e:
+                    log.warning(e)
+                else:
+                    index.setdefault(topic_info.season, list()).append((topic, topic_info))
+            return index
+
+        return self._topic_indexes.get(task, (forum_id, tab), load_index)
+
+    @STATS.phase(SEARCH)
     def search(self, task: Task, entry: Entry, config: Dict = None) -> Set[Entry]:
         with Session() as session:
             serial_tab = config.get('serial_tab', 'all')
 
             entries = set()
             for search_string in entry.get('search_strings', [entry['title']]):
-                search_match = None
-                for search_string_regexp in SEARCH_STRING_REGEXPS:
-                    search_match = search_string_regexp.search(search_string)
-                    if search_match:
-                        break
-
-                if not search_match:
+                search = parse_search_string(search_string)
+                if not search:
                     log.warning("Invalid search string: {0}".format(search_string))
                     continue
+                if search.season is None:
+                    log.debug("Absolute episode numbers are not supported: {0}".format(search_string))
+                    continue
 
-                search_title = search_match.group(1)
-                search_season = int(search_match.group(2))
-                search_episode = int(search_match.group(3))
-
-                log.debug("{0} s{1:02d}e{2:02d}".format(search_title, search_season, search_episode))
+                search_title = search.title
+                log.debug("{0} {1}".format(search_title, search.get_episode_id()))
 
-                forum = self._search_forum(task, search_title, session)
+                forum = self._forums.get(
+                    task, search_title, lambda: self._search_forum(task, search_title, session))
                 if not forum:
-                    log.debug("Unknown forum: {0} s{1:02d}e{2:02d}".format(search_title, search_season, search_episode))
+                    log.debug("Unknown forum: {0} {1}".format(search_title, search.get_episode_id()))
                     continue
 
-                topics = self._search_forum_topics(task, forum.id, serial_tab, session)
-                for topic in topics:
-                    try:
-                        topic_info = BaibakoParser.parse_topic_title(topic.title)
-                    except ParsingError as e:
-                        log.warning(e)
-                    else:
-                        if topic_info.season != search_season or not topic_info.contains_episode(search_episode):
-                            continue
-
-                        episode_id = topic_info.get_episode_id()
-
-                        entry = Entry()
-                        entry['title'] = "{0} / {1} / {2}".format(search_title, episode_id, topic_info.quality)
-                        entry['url'] = Baibako.get_download_url(topic.id)
-                        # entry['series_season'] = topic_info.season
-                        # entry['series_episode'] = topic_info.begin_episode
-                        entry['series_id'] = episode_id
-                        # entry['series_name'] = topic_info.title
-                        # entry['quality'] = topic_info.quality
-
-                        entries.add(entry)
+                topic_index = self._get_topic_index(task, forum.id, serial_tab, session)
+                for topic, topic_info in topic_index.get(search.season, ()):
+                    if not search.matches(topic_info.season, topic_info.begin_episode, topic_info.end_episode):
+                        continue
+
+                    episode_id = topic_info.get_episode_id()
+
+                    entry = Entry()
+                    entry['title'] = "{0} / {1} / {2}".format(search_title, episode_id, topic_info.quality)
+                    entry['url'] = Baibako.get_download_url(topic.id)
+                    # entry['series_season'] = topic_info.season
+                    # entry['series_episode'] = topic_info.begin_episode
+                    entry['series_id'] = episode_id
+                    # entry['series_name'] = topic_info.title
+                    # entry['quality'] = topic_info.quality
+
+                    entries.add(entry)
 
             return entries
 
@@ -664,6 +776,8 @@ def do_cli(manager: Manager, options_: Any) -> None:
     with manager.acquire_lock():
         if options_.lf_action == 'reset_cache':
             reset_cache(manager)
+        elif options_.lf_action == 'stats':
+            print_stats(PLUGIN_NAME)
 
 
 @event('plugin.register')
@@ -672,6 +786,7 @@ def register_plugin() -> None:
     parser = options.register_command(PLUGIN_NAME, do_cli, help='Utilities to manage the BaibaKo plugin')
     subparsers = parser.add_subparsers(title='Actions', metavar='<action>', dest='lf_action')
     subparsers.add_parser('reset_cache', help='Reset the BaibaKo cache')
+    subparsers.add_parser('stats', help='Show the request, parse, database and sleep statistics')
 
     plugin.register(BaibakoAuthPlugin, PLUGIN_NAME + '_auth', api_ver=2)
     plugin.register(BaibakoPlugin, PLUGIN_NAME, interfaces=['urlrewriter', 'search', 'task'], api_ver=2)
@@ -3,39 +3,48 @@
 import logging
 import re
 from datetime import datetime, timedelta
-from time import sleep
-from typing import Optional, Set, Text, Dict
+from functools import lru_cache
+from typing import Any, Callable, Optional, Set, Text, Dict, List, Union
 from urllib.parse import urljoin
+from weakref import WeakKeyDictionary
 
-from bs4 import BeautifulSoup
+from flexget import options
 from flexget import plugin
 from flexget.components.sites import utils
 from flexget.db_schema import versioned_base
 from flexget.entry import Entry
 from flexget.event import event
-from flexget.manager import Session
+from flexget.manager import Session, Manager
 from flexget.plugin import PluginError
 from requests import Session as RequestsSession, PreparedRequest, RequestException
 from requests.auth import AuthBase
-from sqlalchemy import Column, Unicode, Integer, DateTime
+from sqlalchemy import Column, Unicode, Integer, DateTime, UniqueConstraint
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session as OrmSession
 
-from .utils import JSONEncodedDict
+from .utils import JSONEncodedDict, AuthPool, RateLimiter, account_configs, cookie_header, map_concurrently, match_host
+from .utils import lazy_compile, lazy_import, preload
+# FILTER is taken by the filter options of the search
+from .stats import TrackerStats, AUTH, SEARCH, URL_REWRITE, FILTER as FILTER_PHASE
+from .stats import print_stats, sleep, timed, track_requests
+
+bs4 = lazy_import('bs4')
 
 PLUGIN_NAME = 'kinozal'
 SCHEMA_VER = 0
 
 log = logging.getLogger(PLUGIN_NAME)
 Base = versioned_base(PLUGIN_NAME, SCHEMA_VER)
+STATS = TrackerStats(PLUGIN_NAME)
 
 BASE_URL = 'http://kinozal.tv'
 COOKIES_DOMAIN = '.kinozal.tv'
 
-HOST_REGEXP = re.compile(r'^https?://(?:www\.)?(?:.+\.)?kinozal\.tv', flags=re.IGNORECASE)
+HOST_REGEXP = lazy_compile(r'^https?://(?:www\.)?(?:.+\.)?kinozal\.tv', flags=re.IGNORECASE)
 
 
 def validate_host(url: Text) -> bool:
-    return HOST_REGEXP.match(url) is not None
+    return match_host(HOST_REGEXP, url)
 
 
 # region KinozalAuthPlugin
@@ -53,25 +62,29 @@ class KinozalAccount(Base):
 
 
 class KinozalAuth(AuthBase):
+    @STATS.phase(AUTH)
     def try_authenticate(self, payload):
         for _ in range(5):
             with RequestsSession() as session:
+                track_requests(session)
                 response = session.post('{0}/takelogin.php'.format(BASE_URL), data=payload)
                 response.raise_for_status()
 
                 cookies = session.cookies.get_dict(domain=COOKIES_DOMAIN)
                 if cookies and len(cookies) > 0:
+                    STATS.login(True)
                     return cookies
 
             sleep(3)
 
+        STATS.login(False)
         raise PluginError('Unable to obtain cookies from Kinozal. Looks like invalid username or password.')
 
     def __init__(self, username: Text, password: Text, cookies: Dict = None, session: OrmSession = None) -> None:
         if cookies is None:
             log.debug('Kinozal cookie not found. Requesting new one.')
             payload_ = {'username': username, 'password': password}
-            self.__cookies = self.try_authenticate(payload_)
+            self.__set_cookies(self.try_authenticate(payload_))
             if session:
                 session.add(
                     KinozalAccount(
@@ -84,12 +97,16 @@ class KinozalAuth(AuthBase):
                 #         'session can not be None if cookies is None')
         else:
             log.debug('Using previously saved cookie.')
-            self.__cookies = cookies
+            self.__set_cookies(cookies)
+
+    def __set_cookies(self, cookies: Dict) -> None:
+        self.__cookies = cookies
+        self.__cookie_header = cookie_header(cookies)
 
     def __call__(self, request: PreparedRequest) -> PreparedRequest:
         # request.prepare_cookies(self.__cookies)
         if validate_host(request.url):
-            request.headers['Cookie'] = '; '.join('{0}={1}'.format(key, val) for key, val in self.__cookies.items())
+            request.headers['Cookie'] = self.__cookie_header
         return request
 
 
@@ -99,9 +116,17 @@ class KinozalAuthPlugin(object):
     kinozal_auth:
       username: 'username_here'
       password: 'password_here'
+
+    Several accounts can be used to spread requests over them:
+
+    kinozal_auth:
+      - username: 'username_1'
+        password: 'password_1'
+      - username: 'username_2'
+        password: 'password_2'
     """
 
-    schema = {
+    account_schema = {
         'type': 'object',
         'properties': {
             'username': {'type': 'string'},
@@ -110,7 +135,15 @@ class KinozalAuthPlugin(object):
         "additionalProperties": False
     }
 
+    schema = {
+        'oneOf': [
+            account_schema,
+            {'type': 'array', 'items': account_schema, 'minItems': 1}
+        ]
+    }
+
     auth_cache = {}
+    pool_cache = {}
 
     def try_find_cookie(self, session: OrmSession, username: Text) -> Optional[Dict]:
         account = session.query(KinozalAccount).filter(KinozalAccount.username == username).first()
@@ -123,7 +156,7 @@ class KinozalAuthPlugin(object):
         else:
             return None
 
-    def get_auth_handler(self, config: Dict) -> Dict:
+    def get_account_auth_handler(self, config: Dict) -> AuthBase:
         username = config.get('username')
         if not username or len(username) <= 0:
             raise PluginError('Username are not configured.')
@@ -141,6 +174,18 @@ class KinozalAuthPlugin(object):
 
         return auth_handler
 
+    def get_auth_handler(self, config: Union[Dict, List[Dict]]) -> AuthBase:
+        accounts = account_configs(config)
+        if len(accounts) == 1:
+            return self.get_account_auth_handler(accounts[0])
+
+        usernames = tuple(account.get('username') for account in accounts)
+        if usernames not in self.pool_cache:
+            handlers = [self.get_account_auth_handler(account) for account in accounts]
+            self.pool_cache[usernames] = AuthPool(handlers, validate_host)
+
+        return self.pool_cache[usernames]
+
     @plugin.priority(plugin.PRIORITY_DEFAULT)
     def on_task_start(self, task, config):
         task.requests.auth = self.get_auth_handler(config)
@@ -158,8 +203,7 @@ class KinozalAuthPlugin(object):
                 log.debug('entry %s has invalid host, skipping', entry)
                 continue
 
-            username = config.get('username')
-            log.debug('setting auth with username %s for %s', username, entry)
+            log.debug('setting auth for %s', entry)
             entry['download_auth'] = self.get_auth_handler(config)
 
 
@@ -222,8 +266,31 @@ SORT_ORDER = {
     'asc': 1
 }
 
-DETAILS_URL_REGEXP = re.compile(r'^https?://(?:www\.)?kinozal\.tv/details\.php\?id=(\d+).*$', flags=re.IGNORECASE)
-INFO_HASH_REGEXP = re.compile(r'^.*\s+(\w+)$', flags=re.IGNORECASE)
+DETAILS_URL_REGEXP = lazy_compile(r'^https?://(?:www\.)?kinozal\.tv/details\.php\?id=(\d+).*$', flags=re.IGNORECASE)
+INFO_HASH_REGEXP = lazy_compile(r'^.*\s+(\w+)$', flags=re.IGNORECASE)
+INFO_HASH_BYTES_REGEXP = lazy_compile(rb'<li>[^<]*?\b([0-9a-f]{40})\s*</li>', flags=re.IGNORECASE)
+
+SEARCH_TABLE_CLASS_REGEXP = lazy_compile(r'^t_peer.*$', flags=re.IGNORECASE)
+SEARCH_ROW_CLASS_REGEXP = lazy_compile(r'^.*bg$', flags=re.IGNORECASE)
+
+FILESIZE_REGEXP = lazy_compile(r'(\d+(?:[.,\s]\d+)*)(?:\s*)((?:[птгмк])?б)', flags=re.UNICODE)
+FILESIZE_PREFIX_ORDER = {'': 0, 'к': 1, 'м': 2, 'г': 3, 'т': 4, 'п': 5}
+
+
+@lru_cache(maxsize=None)
+def search_table_strainer() -> 'bs4.SoupStrainer':
+    # Built on first use, so that importing the plugin does not import bs4
+    return bs4.SoupStrainer('table', class_=SEARCH_TABLE_CLASS_REGEXP)
+
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_WORKERS = 3
+# Paces the fetches of browse.php, which run by batches of SEARCH_WORKERS pages
+SEARCH_LIMITER = RateLimiter(1)
+INFO_HASH_WORKERS = 4
+
+SEARCH_CACHE_MINUTES_LIFETIME = 30
+SEARCH_CACHE_MAX_SIZE = 1000
 
 
 class KinozalSearchEntry(object):
@@ -237,15 +304,13 @@ class KinozalSearchEntry(object):
         self.leeches = 0
         self.date = None
         self.release = None
+        self.position = 0
 
 
 class KinozalParser(object):
     @staticmethod
     def parse_filesize(text_size: Text) -> int:
-        prefix_order = {'': 0, 'к': 1, 'м': 2, 'г': 3, 'т': 4, 'п': 5}
-        parsed_size = re.match(
-            r'(\d+(?:[.,\s]\d+)*)(?:\s*)((?:[птгмк])?б)', text_size.strip().lower(), flags=re.UNICODE
-        )
+        parsed_size = FILESIZE_REGEXP.match(text_size.strip().lower())
         if not parsed_size:
             raise ValueError('%s does not look like a file size' % text_size)
         amount = parsed_size.group(1)
@@ -253,10 +318,10 @@ class KinozalParser(object):
         if not unit.endswith('б'):
             raise ValueError('%s does not look like a file size' % text_size)
         unit = unit.rstrip('б')
-        if unit not in prefix_order:
+        if unit not in FILESIZE_PREFIX_ORDER:
             raise ValueError('%s does not look like a file size' % text_size)
-        order = prefix_order[unit]
-        amount = float(amount.replace(',', '').replace(' ', ''))
+        order = FILESIZE_PREFIX_ORDER[unit]
+        amount = float(amount.replace(',', '.').replace(' ', ''))
         return (amount * (1024 ** order)) / 1024 ** 2
 
     @staticmethod
@@ -267,8 +332,18 @@ class KinozalParser(object):
         return int(url_match.group(1))
 
     @staticmethod
+    def parse_info_hash_bytes(content: bytes, encoding: Text = None) -> Optional[Text]:
+        match = INFO_HASH_BYTES_REGEXP.search(content)
+        if match:
+            return match.group(1).decode('ascii').lower()
+
+        log.debug('Info hash is not found by the pattern, falling back to the html parser')
+        return KinozalParser.parse_info_hash(content.decode(encoding or 'utf-8', errors='replace'))
+
+    @staticmethod
+    @timed('parse_time')
     def parse_info_hash(html: Text) -> Optional[Text]:
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = bs4.BeautifulSoup(html, 'html.parser')
         hash_node = soup.find('li')
         if not hash_node:
             return None
@@ -280,51 +355,191 @@ class KinozalParser(object):
         return info_hash.lower()
 
     @staticmethod
+    def _parse_int(text: Text) -> int:
+        try:
+            return int(text.strip())
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def parse_search_row(row_node: 'bs4.Tag', base_url: Text) -> Optional[KinozalSearchEntry]:
+        # Columns: category, name, comments, size, seeds, leeches, date, release
+        column_nodes = row_node.find_all('td', recursive=False)
+        for index, column_node in enumerate(column_nodes):
+            if 'nam' in column_node.get('class', ()):
+                break
+        else:
+            return None
+
+        link_node = column_node.find('a')
+        if not link_node:
+            return None
+
+        url = urljoin(base_url, link_node.get('href'))
+        url_match = DETAILS_URL_REGEXP.search(url)
+        if not url_match:
+            return None
+
+        entry = KinozalSearchEntry(int(url_match.group(1)), link_node.text, url)
+
+        column_nodes = column_nodes[index + 1:]
+        if len(column_nodes) >= 6:
+            entry.comments = KinozalParser._parse_int(column_nodes[0].text)
+            try:
+                entry.size = KinozalParser.parse_filesize(column_nodes[1].text)
+            except ValueError as e:
+                log.debug(e)
+            entry.seeds = KinozalParser._parse_int(column_nodes[2].text)
+            entry.leeches = KinozalParser._parse_int(column_nodes[3].text)
+            entry.date = column_nodes[4].text.strip()
+            entry.release = column_nodes[5].text.strip()
+
+        return entry
+
+    @staticmethod
+    @timed('parse_time')
     def parse_search_result(html: Text, base_url: Text) -> Optional[Set[KinozalSearchEntry]]:
         entries = set()
 
-        table_class_regexp = re.compile(r'^t_peer.*$', flags=re.IGNORECASE)
-        row_class_regexp = re.compile(r'^.*bg$', flags=re.IGNORECASE)
-
-        soup = BeautifulSoup(html, 'html.parser')
-        table_node = soup.find('table', class_=table_class_regexp)
+        # Only the result table is parsed into the tree
+        soup = bs4.BeautifulSoup(html, 'html.parser', parse_only=search_table_strainer())
+        table_node = soup.find('table', class_=SEARCH_TABLE_CLASS_REGEXP)
         if table_node:
-            row_nodes = table_node.find_all('tr', class_=row_class_regexp)
+            row_nodes = table_node.find_all('tr', class_=SEARCH_ROW_CLASS_REGEXP)
             for row_node in row_nodes:
-                column_node = row_node.find('td', class_='nam')
-                if column_node:
-                    link_node = column_node.find('a')
-                    if link_node:
-                        title = link_node.text
-                        url = link_node.get('href')
-                        url = urljoin(base_url, url)
-                        url_match = DETAILS_URL_REGEXP.search(url)
-                        if not url_match:
-                            continue
-
-                        topic_id = int(url_match.group(1))
-
-                        entry = KinozalSearchEntry(topic_id, title, url)
-                        column_nodes = column_node.find_all('td')
-                        if len(column_nodes) >= 6:
-                            entry.comments = int(column_nodes[0].text)
-                            entry.size = KinozalParser.parse_filesize(column_nodes[1].text)
-                            entry.seeds = int(column_nodes[2].text)
-                            entry.leeches = int(column_nodes[3].text)
-                            entry.date = column_nodes[4].text
-                            entry.release = column_nodes[5].text
-
-                        entries.add(entry)
+                entry = KinozalParser.parse_search_row(row_node, base_url)
+                if entry:
+                    entry.position = len(entries)
+                    entries.add(entry)
 
         return entries
 
 
+class DbKinozalSearchResult(Base):
+    __tablename__ = 'kinozal_search_results'
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    search_string = Column(Unicode, nullable=False)
+    category = Column(Integer, nullable=False)
+    quality = Column(Integer, nullable=False)
+    filter = Column(Integer, nullable=False)
+    sort_by = Column(Integer, nullable=False)
+    sort_order = Column(Integer, nullable=False)
+    page = Column(Integer, nullable=False)
+    entries = Column(JSONEncodedDict)
+    updated_at = Column(DateTime, nullable=False)
+    accessed_at = Column(DateTime, index=True, nullable=False)
+    __table_args__ = (UniqueConstraint('search_string', 'category', 'quality', 'filter', 'sort_by', 'sort_order',
+                                       'page', name='_uc_search_query'),)
+
+    def __init__(self, search_string: str, category: int, quality: int, filter_: int, sort_by: int, sort_order: int,
+                 page: int, entries: list, updated_at: datetime) -> None:
+        self.search_string = search_string
+        self.category = category
+        self.quality = quality
+        self.filter = filter_
+        self.sort_by = sort_by
+        self.sort_order = sort_order
+        self.page = page
+        self.entries = entries
+        self.updated_at = updated_at
+        self.accessed_at = updated_at
+
+
+class KinozalDatabase(object):
+    @staticmethod
+    def normalize_search_string(search_string: Text) -> Text:
+        return ' '.join(search_string.lower().split())
+
+    @staticmethod
+    def _search_entry_to_dict(entry: KinozalSearchEntry) -> Dict:
+        return {
+            'id': entry.id,
+            'title': entry.title,
+            'url': entry.url,
+            'comments': entry.comments,
+            'size': entry.size,
+            'seeds': entry.seeds,
+            'leeches': entry.leeches,
+            'date': entry.date,
+            'release': entry.release,
+            'position': entry.position
+        }
+
+    @staticmethod
+    def _search_entry_from_dict(data: Dict) -> KinozalSearchEntry:
+        entry = KinozalSearchEntry(data['id'], data['title'], data['url'])
+        entry.comments = data['comments']
+        entry.size = data['size']
+        entry.seeds = data['seeds']
+        entry.leeches = data['leeches']
+        entry.date = data['date']
+        entry.release = data['release']
+        entry.position = data['position']
+        return entry
+
+    @staticmethod
+    def _search_result_query(session: OrmSession, search_string: Text, page: int, category: int, quality: int,
+                             filter_: int, sort_by: int, sort_order: int):
+        return session.query(DbKinozalSearchResult).filter(
+            DbKinozalSearchResult.search_string == KinozalDatabase.normalize_search_string(search_string),
+            DbKinozalSearchResult.category == category,
+            DbKinozalSearchResult.quality == quality,
+            DbKinozalSearchResult.filter == filter_,
+            DbKinozalSearchResult.sort_by == sort_by,
+            DbKinozalSearchResult.sort_order == sort_order,
+            DbKinozalSearchResult.page == page)
+
+    @staticmethod
+    def get_search_result(session: OrmSession, lifetime: timedelta, search_string: Text, page: int,
+                          category: int, quality: int, filter_: int, sort_by: int,
+                          sort_order: int) -> Optional[Set[KinozalSearchEntry]]:
+        db_result = KinozalDatabase._search_result_query(
+            session, search_string, page, category, quality, filter_, sort_by, sort_order).first()
+        if not db_result:
+            return None
+
+        now = datetime.now()
+        if now - db_result.updated_at > lifetime:
+            return None
+
+        db_result.accessed_at = now
+        session.commit()
+
+        return set(KinozalDatabase._search_entry_from_dict(data) for data in db_result.entries)
+
+    @staticmethod
+    def update_search_result(session: OrmSession, entries: Set[KinozalSearchEntry], search_string: Text, page: int,
+                             category: int, quality: int, filter_: int, sort_by: int, sort_order: int) -> None:
+        KinozalDatabase._search_result_query(
+            session, search_string, page, category, quality, filter_, sort_by, sort_order).delete()
+
+        session.add(DbKinozalSearchResult(
+            search_string=KinozalDatabase.normalize_search_string(search_string),
+            category=category,
+            quality=quality,
+            filter_=filter_,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            page=page,
+            entries=[KinozalDatabase._search_entry_to_dict(entry) for entry in entries],
+            updated_at=datetime.now()))
+        session.commit()
+
+        # Evict the least recently used results
+        db_ids = session.query(DbKinozalSearchResult.id).order_by(
+            DbKinozalSearchResult.accessed_at.desc()).offset(SEARCH_CACHE_MAX_SIZE).all()
+        if db_ids:
+            session.query(DbKinozalSearchResult).filter(
+                DbKinozalSearchResult.id.in_([db_id for db_id, in db_ids])).delete(synchronize_session=False)
+            session.commit()
+
+
 class Kinozal(object):
     @staticmethod
     def get_info_hash(requests: RequestsSession, topic_id: int) -> Optional[Text]:
         response = requests.get('{0}/get_srv_details.php?id={1}&action=2'.format(BASE_URL, topic_id))
         response.raise_for_status()
-        return KinozalParser.parse_info_hash(response.text)
+        return KinozalParser.parse_info_hash_bytes(response.content, response.encoding)
 
     @staticmethod
     def search(requests: RequestsSession, search_string, page=0,
@@ -343,11 +558,64 @@ class Kinozal(object):
             'f': sort_order
         }
 
+        SEARCH_LIMITER.wait()
         response = requests.get('{0}/browse.php'.format(BASE_URL), params=payload)
         response.raise_for_status()
 
         return KinozalParser.parse_search_result(response.text, response.url)
 
+    @staticmethod
+    def search_pages(requests: RequestsSession, search_string, max_pages=1, max_results=0,
+                     search: Callable = None, **kwargs) -> List[KinozalSearchEntry]:
+        """
+        Fetches up to `max_pages` pages of the search result. The first page is fetched alone,
+        the rest - by batches through a small pool. Stops as soon as `max_results` entries are collected
+        or the last page is reached. Entries are merged by topic id.
+
+        `search` replaces `Kinozal.search` to get a single page (e.g. to serve it from the cache).
+        """
+
+        search = search or Kinozal.search
+
+        result = dict()
+
+        def merge(entries: Set[KinozalSearchEntry]) -> None:
+            for entry in sorted(entries, key=lambda item: item.position):
+                result.setdefault(entry.id, entry)
+
+        def enough() -> bool:
+            return 0 < max_results <= len(result)
+
+        first_page = search(requests, search_string, page=0, **kwargs)
+        merge(first_page)
+
+        page = 1
+        last_page_reached = len(first_page) < SEARCH_PAGE_SIZE
+        while not last_page_reached and not enough() and page < max_pages:
+            pages = list(range(page, min(page + SEARCH_WORKERS, max_pages)))
+            preload(bs4)  # the workers parse the pages
+            pages_result = map_concurrently(
+                lambda page_: search(requests, search_string, page=page_, **kwargs), pages, SEARCH_WORKERS)
+            for page_ in pages:
+                page_result = pages_result[page_]
+                if isinstance(page_result, Exception):
+                    log.warning("Error while fetching search page {0}: {1}".format(page_, page_result))
+                    last_page_reached = True
+                    break
+
+                merge(page_result)
+                if len(page_result) < SEARCH_PAGE_SIZE:
+                    last_page_reached = True
+                    break
+
+            page += len(pages)
+
+        entries = list(result.values())
+        if max_results > 0:
+            entries = entries[:max_results]
+
+        return entries
+
 
 class KinozalPlugin(object):
     """Kinozal urlrewriter/search plugin."""
@@ -388,15 +656,58 @@ class KinozalPlugin(object):
                             {'type': 'integer'}
                         ]
                     },
+                    'max_pages': {'type': 'integer', 'minimum': 1, 'default': 1},
+                    'max_results': {'type': 'integer', 'minimum': 0, 'default': 0},
+                    'cache_lifetime': {
+                        'type': 'integer', 'minimum': 0, 'default': SEARCH_CACHE_MINUTES_LIFETIME
+                    },
+                    'fetch_info_hash': {'type': 'integer', 'minimum': 0, 'default': 0},
                 },
                 'additionalProperties': False
             }
         ]
     }
 
+    def __init__(self):
+        # Info hashes by topic id, kept for the lifetime of each task
+        self._info_hashes = WeakKeyDictionary()
+        # Info hashes set on the search results of each task: they are already up to date, not known ones
+        self._search_info_hashes = WeakKeyDictionary()
+
+    def _get_info_hash(self, task, topic_id: int) -> Optional[Text]:
+        info_hashes = self._info_hashes.setdefault(task, dict())
+        STATS.cache_lookup('info_hashes', topic_id in info_hashes)
+        if topic_id in info_hashes:
+            log.debug('Info hash of topic {0} has been found in the cache'.format(topic_id))
+            return info_hashes[topic_id]
+
+        info_hash = Kinozal.get_info_hash(task.requests, topic_id)
+        info_hashes[topic_id] = info_hash
+        return info_hash
+
+    def _get_info_hashes(self, task, topic_ids: List[int]) -> Dict[int, Text]:
+        """Gets info hashes of the topics through a small pool. Failed topics are left out."""
+
+        if not topic_ids:
+            return dict()
+
+        # Create the task cache and load bs4 before the pool starts sharing them
+        self._info_hashes.setdefault(task, dict())
+        preload(bs4)
+
+        info_hashes = map_concurrently(
+            lambda topic_id: self._get_info_hash(task, topic_id), topic_ids, INFO_HASH_WORKERS)
+        for topic_id, info_hash in list(info_hashes.items()):
+            if isinstance(info_hash, Exception):
+                log.warning('Error while fetching info hash of topic {0}: {1}'.format(topic_id, info_hash))
+                del info_hashes[topic_id]
+
+        return info_hashes
+
     def url_rewritable(self, task, entry):
         return KinozalParser.parse_topic_id(entry['url']) is not None
 
+    @STATS.phase(URL_REWRITE)
     def url_rewrite(self, task, entry):
         url = entry['url']
         topic_id = KinozalParser.parse_topic_id(url)
@@ -409,6 +720,7 @@ class KinozalPlugin(object):
         return True
 
     @plugin.priority(plugin.PRIORITY_LAST)
+    @STATS.phase(FILTER_PHASE)
     def on_task_filter(self, task, config):
         if not config:
             log.debug('Filter disabled, skipping')
@@ -423,7 +735,10 @@ class KinozalPlugin(object):
                 log.debug('Entry {0} has no torrent_info_hash, skipping'.format(entry))
                 continue
             torrent_info_hash = entry['torrent_info_hash'].lower()
-            info_hash = Kinozal.get_info_hash(task.requests, topic_id)
+            if self._search_info_hashes.get(task, dict()).get(topic_id) == torrent_info_hash:
+                log.debug('Entry {0} has the info hash of the search, skipping'.format(entry))
+                continue
+            info_hash = self._get_info_hash(task, topic_id)
             log.debug('Equals hash info {0} with {1}...'.format(torrent_info_hash, info_hash))
             if torrent_info_hash == info_hash:
                 entry.reject('Already up-to-date torrent with this infohash')
@@ -432,12 +747,13 @@ class KinozalPlugin(object):
             entry['torrent_info_hash'] = info_hash
             entry.accept()
 
+    @STATS.phase(SEARCH)
     def search(self, task, entry, config=None):
         if not isinstance(config, dict):
             config = {}
 
         category = config.get('category', DEFAULT_CATEGORY)
-        if not isinstance(config, int):
+        if not isinstance(category, int):
             category = CATEGORIES.get(category, DEFAULT_CATEGORY)
 
         quality = config.get('quality', DEFAULT_QUALITY)
@@ -456,18 +772,58 @@ class KinozalPlugin(object):
         if not isinstance(sort_order, int):
             sort_order = SORT_ORDER.get(sort_order, DEFAULT_SORT_ORDER)
 
+        max_pages = config.get('max_pages', 1)
+        max_results = config.get('max_results', 0)
+        cache_lifetime = timedelta(minutes=config.get('cache_lifetime', SEARCH_CACHE_MINUTES_LIFETIME))
+        fetch_info_hash = config.get('fetch_info_hash', 0)
+
         entries = set()
         for search_string in entry.get('search_strings', [entry['title']]):
+            requested_pages = list()
+
+            def search_page(requests: RequestsSession, search_string_: Text, page: int = 0,
+                            **kwargs) -> Set[KinozalSearchEntry]:
+                with Session() as session:
+                    if cache_lifetime:
+                        search_result_ = KinozalDatabase.get_search_result(
+                            session, cache_lifetime, search_string_, page, **kwargs)
+                        STATS.cache_lookup('kinozal_search_results', search_result_ is not None)
+                        if search_result_ is not None:
+                            log.debug('Search result for `{0}` (page {1}) has been found in the cache'.format(
+                                search_string_, page))
+                            return search_result_
+
+                    requested_pages.append(page)
+                    search_result_ = Kinozal.search(requests, search_string_, page=page, **kwargs)
+                    if cache_lifetime:
+                        # The fetched page is still used if it can not be cached
+                        try:
+                            KinozalDatabase.update_search_result(
+                                session, search_result_, search_string_, page, **kwargs)
+                        except SQLAlchemyError as e:
+                            session.rollback()
+                            log.warning('Error while caching search page {0}: {1}'.format(page, e))
+
+                    return search_result_
+
             try:
-                search_result = Kinozal.search(task.requests, search_string,
-                                               category=category, quality=quality,
-                                               filter_=filter, sort_by=sort_by,
-                                               sort_order=sort_order)
+                search_result = Kinozal.search_pages(task.requests, search_string,
+                                                     max_pages=max_pages, max_results=max_results,
+                                                     search=search_page,
+                                                     category=category, quality=quality,
+                                                     filter_=filter, sort_by=sort_by,
+                                                     sort_order=sort_order)
             except RequestException as e:
                 log.error("Error while fetching page: {0}".format(e))
                 sleep(3)
                 continue
-            sleep(3)
+
+            if requested_pages:
+                sleep(3)
+
+            info_hashes = self._get_info_hashes(task, [item.id for item in search_result[:fetch_info_hash]])
+            if info_hashes:
+                self._search_info_hashes.setdefault(task, dict()).update(info_hashes)
 
             for search_entry in search_result:
                 entry = Entry()
@@ -478,9 +834,9 @@ class KinozalPlugin(object):
                 entry['content_size'] = search_entry.size
                 entry['search_sort'] = utils.torrent_availability(search_entry.seeds, search_entry.leeches)
 
-                # info_hash = Kinozal.get_info_hash(task.requests, search_entry.id)
-                # if info_hash:
-                #     entry['torrent_info_hash'] = info_hash
+                info_hash = info_hashes.get(search_entry.id)
+                if info_hash:
+                    entry['torrent_info_hash'] = info_hash
 
                 entries.add(entry)
 
@@ -490,7 +846,18 @@ class KinozalPlugin(object):
 # endregion
 
 
+def do_cli(manager: Manager, options_: Any) -> None:
+    with manager.acquire_lock():
+        if options_.lf_action == 'stats':
+            print_stats(PLUGIN_NAME)
+
+
 @event('plugin.register')
 def register_plugin():
+    # Register CLI commands
+    parser = options.register_command(PLUGIN_NAME, do_cli, help='Utilities to manage the Kinozal plugin')
+    subparsers = parser.add_subparsers(title='Actions', metavar='<action>', dest='lf_action')
+    subparsers.add_parser('stats', help='Show the request, parse, database and sleep statistics')
+
     plugin.register(KinozalAuthPlugin, PLUGIN_NAME + '_auth', api_ver=2)
     plugin.register(KinozalPlugin, PLUGIN_NAME, interfaces=['urlrewriter', 'search', 'task'], api_ver=2)
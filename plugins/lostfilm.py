@@ -3,12 +3,12 @@
 import json
 import logging
 import re
+import threading
 from datetime import datetime, timedelta
-from time import sleep
-from typing import Optional, Text, List, Dict, Any, Set
+from typing import Optional, Text, List, Dict, Any, Set, Tuple, Union
 from urllib.parse import urljoin
+from weakref import WeakKeyDictionary
 
-import bs4
 from flexget import options
 from flexget import plugin
 from flexget.db_schema import versioned_base
@@ -23,22 +23,28 @@ from requests.auth import AuthBase
 from sqlalchemy import Column, Unicode, Integer, DateTime, UniqueConstraint, ForeignKey, func
 from sqlalchemy.orm import Session as OrmSession
 
-from .utils import JSONEncodedDict
+from .utils import JSONEncodedDict, AuthPool, RateLimiter, account_configs, cookie_header, map_concurrently, match_host
+from .utils import TaskCache, lazy_compile, lazy_import, parse_search_string, preload
+from .stats import TrackerStats, AUTH, SEARCH, URL_REWRITE, INPUT, CACHE_REFRESH
+from .stats import print_stats, sleep, timed, track_requests
+
+bs4 = lazy_import('bs4')
 
 PLUGIN_NAME = 'lostfilm'
 SCHEMA_VER = 0
 
 log = logging.getLogger(PLUGIN_NAME)
 Base = versioned_base(PLUGIN_NAME, SCHEMA_VER)
+STATS = TrackerStats(PLUGIN_NAME)
 
 BASE_URL = 'https://www.lostfilm.tv'
 COOKIES_DOMAIN = '.lostfilm.tv'
 
-HOST_REGEXP = re.compile(r'^https?://(?:www\.)?(?:.+\.)?lostfilm\.tv', flags=re.IGNORECASE)
+HOST_REGEXP = lazy_compile(r'^https?://(?:www\.)?(?:.+\.)?lostfilm\.tv', flags=re.IGNORECASE)
 
 
 def validate_host(url: Text) -> bool:
-    return HOST_REGEXP.match(url) is not None
+    return match_host(HOST_REGEXP, url)
 
 
 class LostFilmAjaxik(object):
@@ -59,6 +65,7 @@ class FlareSolverr:
     def __init__(self, endpoint):
         self._endpoint = endpoint
 
+    @STATS.phase(AUTH)
     def challenge(self, url: Text) -> Optional[FlareSolverrChallenge]:
         headers = {
             'User-Agent': self.USER_AGENT,
@@ -72,6 +79,7 @@ class FlareSolverr:
         })
 
         with RequestsSession() as session:
+            track_requests(session)
             response = session.post(self._endpoint, data=payload, headers=headers)
             data = response.json()
             cookies = data['solution']['cookies']
@@ -80,8 +88,10 @@ class FlareSolverr:
                     continue
 
                 cf_clearance = cookie['value']
+                STATS.challenge(True)
                 return FlareSolverrChallenge(cf_clearance, self.USER_AGENT)
 
+        STATS.challenge(False)
         return None
 
 
@@ -106,9 +116,11 @@ class LostFilmAuth(AuthBase):
     and cookies will be just set
     """
 
+    @STATS.phase(AUTH)
     def try_authenticate(self, payload: Dict) -> Dict:
         for _ in range(5):
             with RequestsSession() as session:
+                track_requests(session)
                 if self.__fs_challenge:
                     session.headers.update({'User-Agent': self.__fs_challenge.user_agent})
                     session.cookies.set('cf_clearance', self.__fs_challenge.cf_clearance)
@@ -119,10 +131,12 @@ class LostFilmAuth(AuthBase):
 
                 response_json = response.json()
                 if 'need_captcha' in response_json and response_json['need_captcha']:
+                    STATS.login(False)
                     raise PluginError('Unable to obtain cookies from LostFilm. Captcha is required. '
                                       'Please logout from you account using web browser (Chrome, Firefox, Safari, etc.) '
                                       'and login again with captcha. Then try again.')
                 if 'error' in response_json:
+                    STATS.login(False)
                     raise PluginError('Unable to obtain cookies from LostFilm. The error was caused: {0}'.format(
                         response_json['error']))
 
@@ -130,10 +144,12 @@ class LostFilmAuth(AuthBase):
                     # username = response_json['name']
                     cookies = session.cookies.get_dict(domain=COOKIES_DOMAIN)
                     if cookies and len(cookies) > 0:
+                        STATS.login(True)
                         return cookies
 
             sleep(3)
 
+        STATS.login(False)
         raise PluginError('Unable to obtain cookies from LostFilm. Looks like invalid username or password.')
 
     def __init__(self, username: Text, password: Text, cookies: Dict = None,
@@ -154,7 +170,7 @@ class LostFilmAuth(AuthBase):
                 'rem': 1
             }
 
-            self.__cookies = self.try_authenticate(payload_)
+            self.__set_cookies(self.try_authenticate(payload_))
             if session:
                 session.add(
                     LostFilmAccount(
@@ -167,17 +183,23 @@ class LostFilmAuth(AuthBase):
                 #         'session can not be None if cookies is None')
         else:
             log.debug('Using previously saved cookie.')
-            self.__cookies = cookies
+            self.__set_cookies(cookies)
 
-    def __call__(self, request: PreparedRequest) -> PreparedRequest:
-        if validate_host(request.url):
-            cookie = '; '.join('{0}={1}'.format(key, val) for key, val in self.__cookies.items())
+    def __set_cookies(self, cookies: Dict) -> None:
+        self.__cookies = cookies
+
+        cookie = cookie_header(cookies)
+        headers = dict()
+        if self.__fs_challenge:
+            headers['User-Agent'] = self.__fs_challenge.user_agent
+            cookie = cookie + '; cf_clearance=' + self.__fs_challenge.cf_clearance
+        headers['Cookie'] = cookie
 
-            if self.__fs_challenge:
-                request.headers.update({'User-Agent': self.__fs_challenge.user_agent})
-                cookie = cookie + '; cf_clearance=' + self.__fs_challenge.cf_clearance
+        self.__headers = headers
 
-            request.headers.update({'Cookie': cookie})
+    def __call__(self, request: PreparedRequest) -> PreparedRequest:
+        if validate_host(request.url):
+            request.headers.update(self.__headers)
         return request
 
 
@@ -188,9 +210,17 @@ class LostFilmAuthPlugin(object):
       username: 'username_here'
       password: 'password_here'
       flaresolverr: 'flaresolverr_address'
+
+    Several accounts can be used to spread requests over them:
+
+    lostfilm_auth:
+      - username: 'username_1'
+        password: 'password_1'
+      - username: 'username_2'
+        password: 'password_2'
     """
 
-    schema = {
+    account_schema = {
         'type': 'object',
         'properties': {
             'username': {'type': 'string'},
@@ -200,7 +230,15 @@ class LostFilmAuthPlugin(object):
         'additionalProperties': False
     }
 
+    schema = {
+        'oneOf': [
+            account_schema,
+            {'type': 'array', 'items': account_schema, 'minItems': 1}
+        ]
+    }
+
     auth_cache = {}
+    pool_cache = {}
 
     def try_find_cookie(self, session: OrmSession, username: Text) -> Optional[Dict]:
         account = session.query(LostFilmAccount).filter(LostFilmAccount.username == username).first()
@@ -213,7 +251,7 @@ class LostFilmAuthPlugin(object):
         else:
             return None
 
-    def get_auth_handler(self, config: Dict) -> LostFilmAuth:
+    def get_account_auth_handler(self, config: Dict) -> AuthBase:
         username = config.get('username')
         if not username or len(username) <= 0:
             raise PluginError('Username are not configured.')
@@ -237,6 +275,18 @@ class LostFilmAuthPlugin(object):
 
             return auth_handler
 
+    def get_auth_handler(self, config: Union[Dict, List[Dict]]) -> AuthBase:
+        accounts = account_configs(config)
+        if len(accounts) == 1:
+            return self.get_account_auth_handler(accounts[0])
+
+        usernames = tuple(account.get('username') for account in accounts)
+        if usernames not in self.pool_cache:
+            handlers = [self.get_account_auth_handler(account) for account in accounts]
+            self.pool_cache[usernames] = AuthPool(handlers, validate_host)
+
+        return self.pool_cache[usernames]
+
     @plugin.priority(plugin.PRIORITY_DEFAULT)
     def on_task_start(self, task: Task, config: Dict) -> None:
         task.requests.auth = self.get_auth_handler(config)
@@ -254,8 +304,7 @@ class LostFilmAuthPlugin(object):
                 log.debug('entry %s has invalid host, skipping', entry)
                 continue
 
-            username = config.get('username')
-            log.debug('setting auth with username %s', username)
+            log.debug('setting auth for %s', entry)
             entry['download_auth'] = self.get_auth_handler(config)
 
 
@@ -263,8 +312,8 @@ class LostFilmAuthPlugin(object):
 
 
 # region LostFilmPlugin
-EP_REGEXP = re.compile(r"(\d+)\s+[Сс]езон\s+(\d+)\s+[Сс]ерия", flags=re.IGNORECASE)
-GOTO_REGEXP = re.compile(r'^goTo\([\'"](.*?)[\'"].*\)$', flags=re.IGNORECASE)
+EP_REGEXP = lazy_compile(r"(\d+)\s+[Сс]езон\s+(\d+)\s+[Сс]ерия", flags=re.IGNORECASE)
+GOTO_REGEXP = lazy_compile(r'^goTo\([\'"](.*?)[\'"].*\)$', flags=re.IGNORECASE)
 
 
 # region LostFilmParser
@@ -298,6 +347,17 @@ class LostFilmEpisode(object):
         return 's{0:02d}e{1:02d}'.format(self.season, self.episode)
 
 
+class LostFilmNewEpisode(object):
+    def __init__(self, show_slug: Text, season: int, episode: int, show_title: Text = None) -> None:
+        self.show_slug = show_slug
+        self.season = season
+        self.episode = episode
+        self.show_title = show_title
+
+    def get_episode_id(self) -> Text:
+        return 's{0:02d}e{1:02d}'.format(self.season, self.episode)
+
+
 class LostFilmTorrent(object):
     def __init__(self, url: Text, title: Text, label: Text = None) -> None:
         self.url = url
@@ -307,6 +367,7 @@ class LostFilmTorrent(object):
 
 class LostFilmParser(object):
     @staticmethod
+    @timed('parse_time')
     def parse_shows_json(text: Text) -> List[LostFilmShow]:
         json_data = json.loads(text)
         if 'result' not in json_data or json_data['result'] != 'ok':
@@ -326,7 +387,7 @@ class LostFilmParser(object):
         return shows
 
     @staticmethod
-    def _parse_play_episode_button(node: bs4.Tag) -> LostFilmEpisode:
+    def _parse_play_episode_button(node: 'bs4.Tag') -> LostFilmEpisode:
         button_node = node.find('div', class_='external-btn', onclick=PLAY_EPISODE_REGEXP)
         if not button_node:
             raise ParsingError('Node <div class=`external-btn`> are not found')
@@ -357,6 +418,7 @@ class LostFilmParser(object):
         return separator.join([line for line in lines])
 
     @staticmethod
+    @timed('parse_time')
     def parse_seasons_page(html: Text) -> List[LostFilmEpisode]:
         category_tree = bs4.BeautifulSoup(html, 'html.parser')
         seasons_node = category_tree.find('div', class_='series-block')
@@ -389,6 +451,7 @@ class LostFilmParser(object):
         return episodes
 
     @staticmethod
+    @timed('parse_time')
     def parse_episode_page(html: Text) -> LostFilmEpisode:
         episode_tree = bs4.BeautifulSoup(html, 'html.parser')
         overlay_node = episode_tree.find('div', class_='overlay-pane')
@@ -404,6 +467,41 @@ class LostFilmParser(object):
         return episode
 
     @staticmethod
+    @timed('parse_time')
+    def parse_new_page(html: Text) -> List[LostFilmNewEpisode]:
+        new_tree = bs4.BeautifulSoup(html, 'html.parser')
+        content_node = new_tree.find('div', class_='content')
+        if not content_node:
+            raise ParsingError('Node <div class=`content`> are not found')
+
+        result = list()
+        keys = set()
+        link_nodes = content_node.find_all('a', href=EPISODE_URL_REGEXP)
+        for link_node in link_nodes:
+            match = EPISODE_URL_REGEXP.search(link_node.get('href'))
+            if not match:
+                continue
+
+            show_slug = match.group(1)
+            season = int(match.group(2))
+            episode = int(match.group(3))
+
+            key = (show_slug, season, episode)
+            if key in keys:
+                continue
+            keys.add(key)
+
+            show_title = None
+            title_node = link_node.find('div', class_='name-en') or link_node.find('div', class_='name-ru')
+            if title_node:
+                show_title = LostFilmParser._strip_string(title_node.text)
+
+            result.append(LostFilmNewEpisode(show_slug, season, episode, show_title))
+
+        return result
+
+    @staticmethod
+    @timed('parse_time')
     def parse_torrents_page(html: Text) -> List[LostFilmTorrent]:
         torrents_tree = bs4.BeautifulSoup(html, 'html.parser')
         torrents_list_node = torrents_tree.find('div', class_='inner-box--list')
@@ -477,6 +575,43 @@ class DbLostFilmEpisode(Base):
         self.updated_at = updated_at
 
 
+class DbLostFilmSeason(Base):
+    __tablename__ = 'lostfilm_seasons'
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    show_id = Column(Integer, nullable=False)
+    season = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    __table_args__ = (UniqueConstraint('show_id', 'season', name='_uc_show_season'),)
+
+    def __init__(self, show_id: int, season: int, updated_at: datetime) -> None:
+        self.show_id = show_id
+        self.season = season
+        self.updated_at = updated_at
+
+
+class DbLostFilmTorrent(Base):
+    __tablename__ = 'lostfilm_torrents'
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    show_id = Column(Integer, nullable=False)
+    season = Column(Integer, nullable=False)
+    episode = Column(Integer, nullable=False)
+    label = Column(Unicode, nullable=False)
+    url = Column(Unicode, nullable=False)
+    title = Column(Unicode, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    __table_args__ = (UniqueConstraint('show_id', 'season', 'episode', 'label', name='_uc_episode_torrent'),)
+
+    def __init__(self, show_id: int, season: int, episode: int, label: str, url: str, title: str,
+                 updated_at: datetime) -> None:
+        self.show_id = show_id
+        self.season = season
+        self.episode = episode
+        self.label = label
+        self.url = url
+        self.title = title
+        self.updated_at = updated_at
+
+
 class LostFilmDatabase(object):
     @staticmethod
     def shows_timestamp(session: OrmSession) -> datetime:
@@ -565,16 +700,73 @@ class LostFilmDatabase(object):
         return None
 
     @staticmethod
-    def show_episodes_timestamp(session: OrmSession, show_id: int) -> datetime:
-        timestamp = session.query(func.min(DbLostFilmEpisode.updated_at)).filter(
-            DbLostFilmEpisode.show_id == show_id).scalar() or None
-        return timestamp
+    def find_show_by_slug(session: OrmSession, slug: Text) -> Optional[LostFilmShow]:
+        db_show = session.query(DbLostFilmShow).filter(DbLostFilmShow.slug == slug).first()
+        if db_show:
+            return LostFilmShow(id_=db_show.id, slug=db_show.slug, title=db_show.title)
+
+        return None
+
+    @staticmethod
+    def show_season_timestamp(session: OrmSession, show_id: int, season: int) -> Optional[datetime]:
+        db_season = session.query(DbLostFilmSeason).filter(
+            DbLostFilmSeason.show_id == show_id,
+            DbLostFilmSeason.season == season).first()
+        if db_season:
+            return db_season.updated_at
+
+        return None
 
     @staticmethod
-    def clear_show_episodes(session: OrmSession, show_id: int) -> None:
-        session.query(DbLostFilmEpisode).filter(DbLostFilmEpisode.show_id == show_id).delete()
+    def invalidate_show_season(session: OrmSession, show_id: int, season: int) -> None:
+        session.query(DbLostFilmSeason).filter(
+            DbLostFilmSeason.show_id == show_id,
+            DbLostFilmSeason.season == season).update(
+            {DbLostFilmSeason.updated_at: datetime.min}, synchronize_session=False)
         session.commit()
 
+    @staticmethod
+    def update_show_season_episodes(session: OrmSession, show_id: int, season: int,
+                                    episodes: List[LostFilmEpisode]) -> None:
+        now = datetime.now()
+
+        # Replace the rows of the season only
+        session.query(DbLostFilmEpisode).filter(
+            DbLostFilmEpisode.show_id == show_id,
+            DbLostFilmEpisode.season == season).delete()
+
+        if episodes and len(episodes) > 0:
+            for episode in episodes:
+                if episode.show_id != show_id or episode.season != season:
+                    continue
+
+                db_episode = DbLostFilmEpisode(
+                    show_id=show_id,
+                    season=episode.season,
+                    episode=episode.episode,
+                    title=episode.title,
+                    updated_at=now
+                )
+                session.add(db_episode)
+
+        db_season = session.query(DbLostFilmSeason).filter(
+            DbLostFilmSeason.show_id == show_id,
+            DbLostFilmSeason.season == season).first()
+        if db_season:
+            db_season.updated_at = now
+        else:
+            session.add(DbLostFilmSeason(show_id=show_id, season=season, updated_at=now))
+
+        session.commit()
+
+    @staticmethod
+    def get_show_season_episodes(session: OrmSession, show_id: int, season: int) -> List[LostFilmEpisode]:
+        db_episodes = session.query(DbLostFilmEpisode).filter(
+            DbLostFilmEpisode.show_id == show_id,
+            DbLostFilmEpisode.season == season)
+        return [LostFilmEpisode(db_episode.show_id, db_episode.season, db_episode.episode, db_episode.title)
+                for db_episode in db_episodes]
+
     @staticmethod
     def find_show_episode(session: OrmSession, show_id: int, season: int, episode: int) -> Optional[LostFilmEpisode]:
         db_episode = session.query(DbLostFilmEpisode).filter(
@@ -587,25 +779,55 @@ class LostFilmDatabase(object):
         return None
 
     @staticmethod
-    def update_show_episodes(session: OrmSession, show_id: int, episodes: List[LostFilmEpisode]) -> None:
+    def episode_torrents_timestamp(session: OrmSession, show_id: int, season: int, episode: int) -> datetime:
+        return session.query(func.min(DbLostFilmTorrent.updated_at)).filter(
+            DbLostFilmTorrent.show_id == show_id,
+            DbLostFilmTorrent.season == season,
+            DbLostFilmTorrent.episode == episode).scalar() or None
+
+    @staticmethod
+    def clear_episode_torrents(session: OrmSession, show_id: int, season: int, episode: int) -> None:
+        session.query(DbLostFilmTorrent).filter(
+            DbLostFilmTorrent.show_id == show_id,
+            DbLostFilmTorrent.season == season,
+            DbLostFilmTorrent.episode == episode).delete()
+        session.commit()
+
+    @staticmethod
+    def get_episode_torrents(session: OrmSession, show_id: int, season: int, episode: int) -> List[LostFilmTorrent]:
+        db_torrents = session.query(DbLostFilmTorrent).filter(
+            DbLostFilmTorrent.show_id == show_id,
+            DbLostFilmTorrent.season == season,
+            DbLostFilmTorrent.episode == episode).order_by(DbLostFilmTorrent.id).all()
+
+        return [LostFilmTorrent(db_torrent.url, db_torrent.title, db_torrent.label) for db_torrent in db_torrents]
+
+    @staticmethod
+    def update_episode_torrents(session: OrmSession, show_id: int, season: int, episode: int,
+                                torrents: List[LostFilmTorrent]) -> None:
         # Clear database
-        LostFilmDatabase.clear_show_episodes(session, show_id)
+        LostFilmDatabase.clear_episode_torrents(session, show_id, season, episode)
 
         # Insert new rows
-        if episodes and len(episodes) > 0:
+        if torrents and len(torrents) > 0:
             now = datetime.now()
-            for episode in episodes:
-                if episode.show_id != show_id:
+            labels = set()
+            for torrent in torrents:
+                label = torrent.label or ''
+                if label in labels:
                     continue
+                labels.add(label)
 
-                db_episode = DbLostFilmEpisode(
+                db_torrent = DbLostFilmTorrent(
                     show_id=show_id,
-                    season=episode.season,
-                    episode=episode.episode,
-                    title=episode.title,
+                    season=season,
+                    episode=episode,
+                    label=label,
+                    url=torrent.url,
+                    title=torrent.title,
                     updated_at=now
                 )
-                session.add(db_episode)
+                session.add(db_torrent)
 
             session.commit()
 
@@ -613,26 +835,71 @@ class LostFilmDatabase(object):
 # endregion
 
 
-EPISODE_URL_REGEXP = re.compile(
+EPISODE_URL_REGEXP = lazy_compile(
     r'/series/([^/]+?)/season_(\d+)/episode_(\d+)',
     flags=re.IGNORECASE)
-PLAY_EPISODE_REGEXP = re.compile(
+PLAY_EPISODE_REGEXP = lazy_compile(
     # r'PlayEpisode\(\\?[\'"](.+?)\\?[\'"],\s*\\?[\'"](.+?)\\?[\'"],\s*\\?[\'"](.+?)\\?[\'"]\)',
     r'PlayEpisode\(\\?[\'"](\d+)(\d{3})(\d{3})\\?[\'"]\)',
     flags=re.IGNORECASE)
 
-REPLACE_LOCATION_REGEXP = re.compile(r'location\.replace\([\'"](.+?)[\'"]\);', flags=re.IGNORECASE)
+REPLACE_LOCATION_REGEXP = lazy_compile(r'location\.replace\([\'"](.+?)[\'"]\);', flags=re.IGNORECASE)
+REDIRECT_SNIFF_SIZE = 4096
+
+TORRENTS_CACHE_HOURS_LIFETIME = 12
+
+REDIRECTS_CACHE_HOURS_LIFETIME = 1
+
+URL_REWRITE_WORKERS = 4
+URL_REWRITE_LIMITER = RateLimiter(3)
+
+
+class RedirectsCache(object):
+    """
+    Keeps the `location.replace(...)` targets learned for the requested urls, so later requests
+    go straight to the target without fetching the redirect stub again.
+    """
+
+    def __init__(self, lifetime: timedelta, max_size: int = 1024) -> None:
+        self._lifetime = lifetime
+        self._max_size = max_size
+        self._items = dict()
+        self._lock = threading.Lock()
+
+    def get(self, url: Text) -> Optional[Text]:
+        with self._lock:
+            item = self._items.get(url)
+            if not item:
+                return None
+            redirect_url, expiry_time = item
+            if expiry_time < datetime.now():
+                del self._items[url]
+                return None
+            return redirect_url
+
+    def set(self, url: Text, redirect_url: Text) -> None:
+        with self._lock:
+            if url not in self._items and len(self._items) >= self._max_size:
+                # Evict the oldest item
+                del self._items[next(iter(self._items))]
+            self._items[url] = (redirect_url, datetime.now() + self._lifetime)
+
+    def remove(self, url: Text) -> None:
+        with self._lock:
+            self._items.pop(url, None)
 
-SEARCH_STRING_REGEXPS = [
-    re.compile(r'^(.*?)\s*(\d+?)x(\d+?)$', flags=re.IGNORECASE),
-    re.compile(r'^(.*?)\s*s(\d+?)e(\d+?)$', flags=re.IGNORECASE)
-]
+
+REDIRECTS_CACHE = RedirectsCache(timedelta(hours=REDIRECTS_CACHE_HOURS_LIFETIME))
 
 
 class LostFilm(object):
     @staticmethod
-    def get_seasons_url(show_slug: Text) -> Text:
-        return '{0}/series/{1}/seasons'.format(BASE_URL, show_slug)
+    def get_new_url() -> Text:
+        return '{0}/new/'.format(BASE_URL)
+
+    @staticmethod
+    def get_season_url(show_slug: Text, season: int) -> Text:
+        return '{0}/series/{1}/season_{2}'.format(BASE_URL, show_slug, season)
 
     @staticmethod
     def get_episode_url(show_slug: Text, season: int, episode: int) -> Text:
@@ -654,22 +921,53 @@ class LostFilm(object):
         )
 
     @staticmethod
-    def _get_response(requests: RequestsSession, url: Text) -> Response:
-        response = requests.get(url)
-        content = response.content
+    def _read_sniffing_redirect(response: Response) -> Tuple[Optional[Text], bytes]:
+        """
+        Reads the streamed response, looking for the `location.replace(...)` stub in its first bytes.
+        Returns the redirect url and nothing else if the stub is found (the download is stopped), otherwise the body.
+        """
 
-        html = content.decode(response.encoding)
-        match = REPLACE_LOCATION_REGEXP.search(html)
+        chunks = response.iter_content(chunk_size=1024)
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= REDIRECT_SNIFF_SIZE:
+                break
+
+        match = REPLACE_LOCATION_REGEXP.search(head.decode(response.encoding or 'utf-8', errors='ignore'))
         if match:
-            redirect_url = match.group(1)
-            redirect_url = urljoin(response.url, redirect_url)
+            return urljoin(response.url, match.group(1)), b''
+
+        return None, head + b''.join(chunks)
+
+    @staticmethod
+    def _get_page(requests: RequestsSession, url: Text) -> Text:
+        redirect_url = REDIRECTS_CACHE.get(url)
+        STATS.cache_lookup('redirects', redirect_url is not None)
+        if redirect_url:
+            log.debug("Using the cached redirect from `{0}` to `{1}`...".format(url, redirect_url))
+            response = requests.get(redirect_url)
+            if response.ok:
+                return response.text
+            REDIRECTS_CACHE.remove(url)
+
+        with requests.get(url, stream=True) as response:
+            response.raise_for_status()
+            redirect_url, content = LostFilm._read_sniffing_redirect(response)
+            encoding = response.encoding or 'utf-8'
+
+        if redirect_url:
             log.debug("`location.replace(...)` has been detected! Redirecting from `{0}` to `{1}`...".format(
                 url, redirect_url))
+            REDIRECTS_CACHE.set(url, redirect_url)
             response = requests.get(redirect_url)
+            response.raise_for_status()
+            return response.text
 
-        return response
+        return content.decode(encoding, errors='replace')
 
     @staticmethod
+    @STATS.phase(CACHE_REFRESH)
     def get_shows(requests: RequestsSession) -> List[LostFilmShow]:
         step = 10
         total = 0
@@ -709,19 +1007,24 @@ class LostFilm(object):
         return LostFilmParser.parse_episode_page(response.text)
 
     @staticmethod
-    def get_show_episodes(requests: RequestsSession, show_slug: Text) -> List[LostFilmEpisode]:
-        url = LostFilm.get_seasons_url(show_slug)
+    def get_show_season_episodes(requests: RequestsSession, show_slug: Text, season: int) -> List[LostFilmEpisode]:
+        url = LostFilm.get_season_url(show_slug, season)
         response = requests.get(url)
         response.raise_for_status()
-        return LostFilmParser.parse_seasons_page(response.text)
+        episodes = LostFilmParser.parse_seasons_page(response.text)
+        return [episode for episode in episodes if episode.season == season]
+
+    @staticmethod
+    def get_new_episodes(requests: RequestsSession) -> List[LostFilmNewEpisode]:
+        response = requests.get(LostFilm.get_new_url())
+        response.raise_for_status()
+        return LostFilmParser.parse_new_page(response.text)
 
     @staticmethod
     def get_episode_torrents(requests: RequestsSession,
                              show_id: int, season: int, episode: int) -> List[LostFilmTorrent]:
         torrents_url = LostFilm.get_episode_torrents_url(show_id, season, episode)
-        response = LostFilm._get_response(requests, torrents_url)
-        response.raise_for_status()
-        return LostFilmParser.parse_torrents_page(response.text)
+        return LostFilmParser.parse_torrents_page(LostFilm._get_page(requests, torrents_url))
 
 
 class LostFilmPlugin(object):
@@ -749,6 +1052,12 @@ class LostFilmPlugin(object):
 
     def __init__(self):
         self._config = None
+        # Urls resolved ahead by `on_task_urlrewrite`, by task: a task must not pick up the ones of another task
+        self._torrent_urls = WeakKeyDictionary()
+        # Shows by title and episodes by show season, kept for the lifetime of each task
+        self._shows = TaskCache()
+        self._season_episodes = TaskCache()
+        self._season_updates = TaskCache()
 
     def on_task_start(self, task: Task, config: Dict = None):
         if not isinstance(config, dict):
@@ -764,62 +1073,103 @@ class LostFilmPlugin(object):
 
         return False
 
-    def url_rewrite(self, task: Task, entry: Entry) -> bool:
-        url = entry['url']
-
+    def _get_torrent_url(self, task: Task, url: Text) -> Text:
         match = EPISODE_URL_REGEXP.search(url)
         if not match:
-            reject_reason = "Invalid url format: `{0}`".format(url)
-            log.error(reject_reason)
-            entry.reject(reject_reason)
-            return False
+            raise PluginError("Invalid url format: `{0}`".format(url))
 
         show_slug = match.group(1)
         season_number = int(match.group(2))
         episode_number = int(match.group(3))
 
-        try:
-            episode = LostFilm.get_show_episode(task.requests, show_slug, season_number, episode_number)
-        except Exception as e:
-            reject_reason = "Error while getting episode by `{0}`: {1}".format(url, e)
-            log.error(reject_reason)
-            entry.reject(reject_reason)
-            sleep(3)
-            return False
-        sleep(3)
+        with Session() as session:
+            show = LostFilmDatabase.find_show_by_slug(session, show_slug)
+
+        STATS.cache_lookup('lostfilm_shows', show is not None)
+        if show:
+            # The show id is known from the local catalog, so the episode page is not needed
+            log.debug("Show `{0}` has been found in the cache: id={1}".format(show_slug, show.id))
+            episode = LostFilmEpisode(show.id, season_number, episode_number)
+        else:
+            URL_REWRITE_LIMITER.wait()
+            try:
+                episode = LostFilm.get_show_episode(task.requests, show_slug, season_number, episode_number)
+            except Exception as e:
+                raise PluginError("Error while getting episode by `{0}`: {1}".format(url, e))
 
         try:
-            torrents = LostFilm.get_episode_torrents(
-                task.requests,
-                episode.show_id,
-                episode.season,
-                episode.episode
-            )
+            torrents = self._get_episode_torrents(task, episode)
         except Exception as e:
-            reject_reason = "Error while getting torrents by `{0}`: {1}".format(url, e)
-            log.error(reject_reason)
-            entry.reject(reject_reason)
-            sleep(3)
-            return False
-        sleep(3)
+            raise PluginError("Error while getting torrents by `{0}`: {1}".format(url, e))
 
         label_pattern = self._config.get('label', '*')
-        label_regexp = re.compile(label_pattern, flags=re.IGNORECASE)
+        label_regexp = re.compile(label_pattern, flags=re.IGNORECASE) if label_pattern != '*' else None
         for torrent in torrents:
-            if label_regexp.search(torrent.label):
+            if not label_regexp or label_regexp.search(torrent.label or ''):
                 log.debug("Torrent link was accepted! [ regexp: `{0}`, label: `{1}` ]".format(
                     label_pattern, torrent.label))
-                entry['url'] = torrent.url
-                return True
+                return torrent.url
             else:
                 log.debug("Torrent link was rejected: [ regexp: `{0}`, label: `{1}` ]".format(
                     label_pattern, torrent.label))
 
-        reject_reason = "Torrent link was not detected by `{0}` with regexp `{1}`: {2}".format(
-            url.url, label_pattern, torrents)
-        log.error(reject_reason)
-        entry.reject(reject_reason)
-        return False
+        raise PluginError("Torrent link was not detected by `{0}` with regexp `{1}`: {2}".format(
+            url, label_pattern, torrents))
+
+    def _get_episode_torrents(self, task: Task, episode: LostFilmEpisode) -> List[LostFilmTorrent]:
+        with Session() as session:
+            db_timestamp = LostFilmDatabase.episode_torrents_timestamp(
+                session, episode.show_id, episode.season, episode.episode)
+            cached = db_timestamp and datetime.now() - db_timestamp < timedelta(hours=TORRENTS_CACHE_HOURS_LIFETIME)
+            STATS.cache_lookup('lostfilm_torrents', bool(cached))
+            if cached:
+                log.debug("Torrents of `{0}` s{1:02d}e{2:02d} have been found in the cache".format(
+                    episode.show_id, episode.season, episode.episode))
+                return LostFilmDatabase.get_episode_torrents(
+                    session, episode.show_id, episode.season, episode.episode)
+
+            URL_REWRITE_LIMITER.wait()
+            torrents = LostFilm.get_episode_torrents(task.requests, episode.show_id, episode.season, episode.episode)
+            if torrents:
+                LostFilmDatabase.update_episode_torrents(
+                    session, episode.show_id, episode.season, episode.episode, torrents)
+
+            return torrents
+
+    # Resolve all accepted entries at once, so `url_rewrite` just picks up the results
+    @plugin.priority(plugin.PRIORITY_FIRST)
+    @STATS.phase(URL_REWRITE)
+    def on_task_urlrewrite(self, task: Task, config: Dict = None) -> None:
+        self._torrent_urls.pop(task, None)
+        urls = set(entry['url'] for entry in task.accepted if self.url_rewritable(task, entry))
+        if not urls:
+            return
+
+        log.debug('Resolving {0} torrent url(s)...'.format(len(urls)))
+        preload(bs4)
+        self._torrent_urls[task] = map_concurrently(
+            lambda url: self._get_torrent_url(task, url), urls, URL_REWRITE_WORKERS)
+
+    @STATS.phase(URL_REWRITE)
+    def url_rewrite(self, task: Task, entry: Entry) -> bool:
+        url = entry['url']
+
+        try:
+            resolved_urls = self._torrent_urls.get(task, dict())
+            if url in resolved_urls:
+                torrent_url = resolved_urls.pop(url)
+                if isinstance(torrent_url, Exception):
+                    raise torrent_url
+            else:
+                torrent_url = self._get_torrent_url(task, url)
+        except PluginError as e:
+            reject_reason = str(e)
+            log.error(reject_reason)
+            entry.reject(reject_reason)
+            return False
+
+        entry['url'] = torrent_url
+        return True
 
     def _search_show(self, task: Task, session: OrmSession, title: Text) -> LostFilmShow:
         update_required = True
@@ -827,6 +1177,7 @@ class LostFilmPlugin(object):
         if db_timestamp:
             difference = datetime.now() - db_timestamp
             update_required = difference.days > 3
+        STATS.cache_lookup('lostfilm_shows', not update_required)
         if update_required:
             log.debug('Update shows...')
             shows = LostFilm.get_shows(task.requests)
@@ -836,48 +1187,68 @@ class LostFilmPlugin(object):
 
         return LostFilmDatabase.find_show_by_title(session, title)
 
-    def _search_show_episode(self, task: Task, session:OrmSession,
-                             show: LostFilmShow, season: int, episode: int) -> Optional[LostFilmEpisode]:
+    def _get_season_episodes(self, session: OrmSession, show_id: int, season: int) -> Dict[int, LostFilmEpisode]:
+        episodes = LostFilmDatabase.get_show_season_episodes(session, show_id, season)
+        return {episode.episode: episode for episode in episodes}
+
+    def _update_show_season(self, task: Task, session: OrmSession, show: LostFilmShow, season: int,
+                            episodes: Dict[int, LostFilmEpisode]) -> bool:
         update_required = True
-        db_timestamp = LostFilmDatabase.show_episodes_timestamp(session, show.id)
+        db_timestamp = LostFilmDatabase.show_season_timestamp(session, show.id, season)
         if db_timestamp:
             difference = datetime.now() - db_timestamp
             update_required = difference.days > 1
+        STATS.cache_lookup('lostfilm_seasons', not update_required)
         if update_required:
-            episodes = LostFilm.get_show_episodes(task.requests, show.slug)
-            if episodes:
-                LostFilmDatabase.update_show_episodes(session, show.id, episodes)
+            log.debug('Update episodes of `{0}` season {1}...'.format(show.slug, season))
+            season_episodes = LostFilm.get_show_season_episodes(task.requests, show.slug, season)
+            LostFilmDatabase.update_show_season_episodes(session, show.id, season, season_episodes)
+            episodes.clear()
+            episodes.update(self._get_season_episodes(session, show.id, season))
 
-        return LostFilmDatabase.find_show_episode(session, show.id, season, episode)
+        return update_required
 
+    def _search_show_episode(self, task: Task, session:OrmSession,
+                             show: LostFilmShow, season: int, episode: int) -> Optional[LostFilmEpisode]:
+        # The episodes of a season are loaded once per task
+        episodes = self._season_episodes.get(
+            task, (show.id, season), lambda: self._get_season_episodes(session, show.id, season))
+
+        # Known episodes never change; new ones are signalled by the `lostfilm_new` input
+        cached_episode = episodes.get(episode)
+        STATS.cache_lookup('lostfilm_episodes', cached_episode is not None)
+        if cached_episode:
+            return cached_episode
+
+        # A stale season is updated at most once per task
+        self._season_updates.get(
+            task, (show.id, season), lambda: self._update_show_season(task, session, show, season, episodes))
+        return episodes.get(episode)
+
+    @STATS.phase(SEARCH)
     def search(self, task: Task, entry: Entry, config: Dict = None) -> Set[Entry]:
         with Session() as session:
             entries = set()
             for search_string in entry.get('search_strings', [entry['title']]):
-                search_match = None
-                for search_string_regexp in SEARCH_STRING_REGEXPS:
-                    search_match = search_string_regexp.search(search_string)
-                    if search_match:
-                        break
-
-                if not search_match:
+                search = parse_search_string(search_string)
+                if not search:
                     log.warning("Invalid search string: {0}".format(search_string))
                     continue
+                if search.episode is None:
+                    log.debug("Only episodes can be searched: {0}".format(search_string))
+                    continue
 
-                search_title = search_match.group(1)
-                search_season = int(search_match.group(2))
-                search_episode = int(search_match.group(3))
-
-                log.debug("{0} s{1:02d}e{2:02d}".format(search_title, search_season, search_episode))
+                search_title = search.title
+                log.debug("{0} {1}".format(search_title, search.get_episode_id()))
 
-                show = self._search_show(task, session, search_title)
+                show = self._shows.get(task, search_title, lambda: self._search_show(task, session, search_title))
                 if not show:
                     log.warning("Unknown show: {0}".format(search_title))
                     continue
 
-                episode = self._search_show_episode(task, session, show, search_season, search_episode)
+                episode = self._search_show_episode(task, session, show, search.season, search.episode)
                 if not episode:
-                    log.debug("Unknown episode: {0} s{1:02d}e{2:02d}".format(search_title, search_season, search_episode))
+                    log.debug("Unknown episode: {0} {1}".format(search_title, search.get_episode_id()))
                     continue
 
                 episode_id = episode.get_episode_id()
@@ -907,9 +1278,64 @@ class LostFilmPlugin(object):
 # endregion
 
 
+class LostFilmNewPlugin(object):
+    """
+        LostFilm new releases input plugin.
+
+        Produces the entries of the recently released episodes and marks the cached seasons
+        of the affected shows as stale.
+
+        Example::
+
+          lostfilm_new: yes
+        """
+
+    schema = {'type': 'boolean'}
+
+    @STATS.phase(INPUT)
+    def on_task_input(self, task: Task, config: bool) -> List[Entry]:
+        entries = list()
+        if not config:
+            return entries
+
+        try:
+            new_episodes = LostFilm.get_new_episodes(task.requests)
+        except Exception as e:
+            raise PluginError("Error while getting new episodes: {0}".format(e))
+
+        invalidated = set()
+        with Session() as session:
+            for new_episode in new_episodes:
+                show_title = new_episode.show_title or new_episode.show_slug
+
+                show = LostFilmDatabase.find_show_by_slug(session, new_episode.show_slug)
+                if show:
+                    show_title = show.title
+                    season_key = (show.id, new_episode.season)
+                    if season_key not in invalidated and not LostFilmDatabase.find_show_episode(
+                            session, show.id, new_episode.season, new_episode.episode):
+                        log.debug("Season {0} of `{1}` has new episodes, the cache is invalidated".format(
+                            new_episode.season, show.slug))
+                        LostFilmDatabase.invalidate_show_season(session, show.id, new_episode.season)
+                        invalidated.add(season_key)
+
+                episode_id = new_episode.get_episode_id()
+
+                entry = Entry()
+                entry['title'] = "{0} / {1}".format(show_title, episode_id)
+                entry['url'] = LostFilm.get_episode_url(new_episode.show_slug, new_episode.season, new_episode.episode)
+                entry['series_id'] = episode_id
+
+                entries.append(entry)
+
+        return entries
+
+
 def reset_cache(manager: Manager) -> None:
     with Session() as session:
+        session.query(DbLostFilmTorrent).delete()
         session.query(DbLostFilmEpisode).delete()
+        session.query(DbLostFilmSeason).delete()
         session.query(DbLostFilmShowAlternateName).delete()
         session.query(DbLostFilmShow).delete()
         # session.query(LostFilmAccount).delete()
@@ -922,6 +1348,8 @@ def do_cli(manager: Manager, options_: Any) -> None:
     with manager.acquire_lock():
         if options_.lf_action == 'reset_cache':
             reset_cache(manager)
+        elif options_.lf_action == 'stats':
+            print_stats(PLUGIN_NAME)
 
 
 @event('plugin.register')
@@ -930,6 +1358,8 @@ def register_plugin() -> None:
     parser = options.register_command(PLUGIN_NAME, do_cli, help='Utilities to manage the LostFilm plugin')
     subparsers = parser.add_subparsers(title='Actions', metavar='<action>', dest='lf_action')
     subparsers.add_parser('reset_cache', help='Reset the LostFilm cache')
+    subparsers.add_parser('stats', help='Show the request, parse, database and sleep statistics')
 
     plugin.register(LostFilmAuthPlugin, PLUGIN_NAME + '_auth', api_ver=2)
     plugin.register(LostFilmPlugin, PLUGIN_NAME, interfaces=['urlrewriter', 'search', 'task'], api_ver=2)
+    plugin.register(LostFilmNewPlugin, PLUGIN_NAME + '_new', api_ver=2)
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+import abc
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Sequence, Text, Tuple
+
+from flexget.config_schema import register_config_key
+from flexget.event import event
+from flexget.manager import Manager
+from flexget.task import Task
+
+PLUGIN_NAME = 'tracker_metrics'
+
+log = logging.getLogger(PLUGIN_NAME)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PARSE_DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+LabelValues = Tuple[Text, ...]
+
+
+def _escape_label_value(value: Text) -> Text:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> Text:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: Sequence[Text], values: Sequence[Text]) -> Text:
+    if not names:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape_label_value(value))
+                          for name, value in zip(names, values)) + '}'
+
+
+class Metric(abc.ABC):
+    TYPE = None  # type: Text
+
+    def __init__(self, name: Text, documentation: Text, label_names: Sequence[Text] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[Text, Text]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError('{0} expects the labels {1}, got {2}'.format(
+                self.name, ', '.join(self.label_names), ', '.join(sorted(labels))))
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[Tuple[Text, Sequence[Text], Sequence[Text], float]]:
+        """Returns the samples as (name, label names, label values, value)."""
+
+    def render(self) -> List[Text]:
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation), '# TYPE {0} {1}'.format(self.name, self.TYPE)]
+        for name, label_names, label_values, value in self.samples():
+            lines.append('{0}{1} {2}'.format(name, _format_labels(label_names, label_values), _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name: Text, documentation: Text, label_names: Sequence[Text] = ()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values = dict()  # type: Dict[LabelValues, float]
+
+    def inc(self, amount: float = 1, **labels: Text) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Tuple[Text, Sequence[Text], Sequence[Text], float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name, self.label_names, label_values, value
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: Text, documentation: Text, label_names: Sequence[Text] = (),
+                 buckets: Sequence[float] = REQUEST_DURATION_BUCKETS) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = dict()  # type: Dict[LabelValues, Tuple[List[int], List[float]]]
+
+    def observe(self, value: float, **labels: Text) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            total[0] += value
+
+    def samples(self) -> Iterable[Tuple[Text, Sequence[Text], Sequence[Text], float]]:
+        with self._lock:
+            values = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        bucket_label_names = self.label_names + ('le',)
+        for label_values, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (self.name + '_bucket', bucket_label_names, label_values + (_format_value(bound),),
+                       cumulative)
+            yield self.name + '_sum', self.label_names, label_values, total
+            yield self.name + '_count', self.label_names, label_values, cumulative
+
+
+class MetricsRegistry(object):
+    def __init__(self) -> None:
+        self._metrics = list()  # type: List[Metric]
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> Text:
+        lines = list()
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'flexget_tracker_request_duration_seconds', 'Time in flight of the tracker requests.',
+    ('plugin', 'endpoint'), REQUEST_DURATION_BUCKETS))
+RESPONSES = REGISTRY.register(Counter(
+    'flexget_tracker_responses_total', 'Tracker responses by status code.', ('plugin', 'endpoint', 'code')))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'flexget_tracker_cache_lookups_total', 'Lookups of the cached tracker data.', ('plugin', 'table', 'result')))
+LOGINS = REGISTRY.register(Counter(
+    'flexget_tracker_logins_total', 'Logins to the trackers.', ('plugin', 'result')))
+CHALLENGE_SOLVES = REGISTRY.register(Counter(
+    'flexget_tracker_challenge_solves_total', 'Anti-bot challenges solved for the trackers.', ('plugin', 'result')))
+PARSE_DURATION = REGISTRY.register(Histogram(
+    'flexget_tracker_parse_duration_seconds', 'Time spent parsing the tracker pages.',
+    ('plugin', 'parser'), PARSE_DURATION_BUCKETS))
+
+
+def write_metrics(path: Text) -> None:
+    """Writes the metrics atomically, so that a collector never reads a partially written file."""
+
+    path = os.path.expanduser(path)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(REGISTRY.render())
+    os.replace(temp_path, path)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format_: Text, *args) -> None:
+        log.debug(format_ % args)
+
+
+class MetricsServer(object):
+    def __init__(self, host: Text, port: int) -> None:
+        self._server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=PLUGIN_NAME, daemon=True)
+
+    @property
+    def address(self) -> Tuple[Text, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+_server = None  # type: Optional[MetricsServer]
+_server_config = None  # type: Optional[Tuple[Text, int]]
+
+schema = {
+    'type': 'object',
+    'properties': {
+        'file': {'type': 'string'},
+        'host': {'type': 'string', 'default': '127.0.0.1'},
+        'port': {'type': 'integer', 'minimum': 1, 'maximum': 65535},
+    },
+    'additionalProperties': False,
+}
+
+
+def stop_server() -> None:
+    global _server, _server_config
+
+    if _server is not None:
+        _server.stop()
+        _server = None
+        _server_config = None
+
+
+@event('manager.daemon.started')
+@event('manager.config_updated')
+def on_config_updated(manager: Manager) -> None:
+    global _server, _server_config
+
+    if not manager.is_daemon:
+        return
+
+    config = manager.config.get(PLUGIN_NAME) or dict()
+    server_config = (config.get('host', '127.0.0.1'), config['port']) if config.get('port') else None
+    if server_config == _server_config:
+        return
+
+    stop_server()
+    if server_config:
+        try:
+            _server = MetricsServer(*server_config)
+        except OSError as e:
+            log.error('Unable to serve the tracker metrics on {0}:{1}: {2}'.format(*server_config, e))
+            return
+
+        _server.start()
+        _server_config = server_config
+        log.info('Serving the tracker metrics on http://{0}:{1}/metrics'.format(*_server.address))
+
+
+@event('manager.shutdown')
+def on_shutdown(manager: Manager) -> None:
+    stop_server()
+
+
+@event('task.execute.completed')
+def on_task_completed(task: Task) -> None:
+    config = task.manager.config.get(PLUGIN_NAME) or dict()
+    if config.get('file'):
+        try:
+            write_metrics(config['file'])
+        except OSError as e:
+            log.error('Unable to write the tracker metrics to `{0}`: {1}'.format(config['file'], e))
+
+
+@event('config.register')
+def register_plugin() -> None:
+    register_config_key(PLUGIN_NAME, schema)
@@ -3,16 +3,17 @@
 import logging
 import re
 from datetime import datetime, timedelta
-from time import sleep, time
-from typing import Optional, Text, Dict, Set
+from time import time
+from typing import Any, Optional, Text, Dict, Set, List, Tuple, Union
 from urllib.parse import urlparse, urlunparse, urlencode, parse_qsl
+from weakref import WeakKeyDictionary
 
-from bs4 import BeautifulSoup
+from flexget import options
 from flexget import plugin
 from flexget.db_schema import versioned_base
 from flexget.entry import Entry
 from flexget.event import event
-from flexget.manager import Session
+from flexget.manager import Session, Manager
 from flexget.plugin import PluginError
 from flexget.task import Task
 from requests import Session as RequestsSession, PreparedRequest, RequestException
@@ -20,22 +21,28 @@ from requests.auth import AuthBase
 from sqlalchemy import Column, Unicode, Integer, DateTime, ForeignKey, func
 from sqlalchemy.orm import Session as OrmSession
 
-from .utils import JSONEncodedDict
+from .utils import JSONEncodedDict, AuthPool, RateLimiter, account_configs, cookie_header, map_concurrently, match_host
+from .utils import TaskCache, lazy_compile, lazy_import, parse_search_string, preload
+from .stats import TrackerStats, AUTH, SEARCH, URL_REWRITE, CACHE_REFRESH
+from .stats import measure, print_stats, sleep, timed, track_requests
+
+bs4 = lazy_import('bs4')
 
 PLUGIN_NAME = 'newstudio'
 SCHEMA_VER = 0
 
 log = logging.getLogger(PLUGIN_NAME)
 Base = versioned_base(PLUGIN_NAME, SCHEMA_VER)
+STATS = TrackerStats(PLUGIN_NAME)
 
 BASE_URL = 'http://newstudio.tv'
 COOKIES_DOMAIN = '.newstudio.tv'
 
-HOST_REGEXP = re.compile(r'^https?://(?:www\.)?(?:.+\.)?newstudio\.tv', flags=re.IGNORECASE)
+HOST_REGEXP = lazy_compile(r'^https?://(?:www\.)?(?:.+\.)?newstudio\.tv', flags=re.IGNORECASE)
 
 
 def validate_host(url: Text) -> bool:
-    return HOST_REGEXP.match(url) is not None
+    return match_host(HOST_REGEXP, url)
 
 
 # region NewStudioAuthPlugin
@@ -59,18 +66,22 @@ class NewStudioAuth(AuthBase):
     and cookies will be just set
     """
 
+    @STATS.phase(AUTH)
     def try_authenticate(self, payload: Dict) -> Dict:
         for _ in range(5):
             with RequestsSession() as session:
+                track_requests(session)
                 response = session.post('{0}/login.php'.format(BASE_URL), data=payload)
                 response.raise_for_status()
 
                 cookies = session.cookies.get_dict(domain=COOKIES_DOMAIN)
                 if cookies and len(cookies) > 0:
+                    STATS.login(True)
                     return cookies
 
             sleep(3)
 
+        STATS.login(False)
         raise PluginError('Unable to obtain cookies from NewStudio. Looks like invalid username or password.')
 
     def __init__(self, username: Text, password: Text, cookies: Dict = None, session: OrmSession = None) -> None:
@@ -84,7 +95,7 @@ class NewStudioAuth(AuthBase):
                 'login': 1
             }
 
-            self.__cookies = self.try_authenticate(payload_)
+            self.__set_cookies(self.try_authenticate(payload_))
             if session:
                 session.add(
                     NewStudioAccount(
@@ -97,12 +108,16 @@ class NewStudioAuth(AuthBase):
                 #         'session can not be None if cookies is None')
         else:
             log.debug('Using previously saved cookie.')
-            self.__cookies = cookies
+            self.__set_cookies(cookies)
+
+    def __set_cookies(self, cookies: Dict) -> None:
+        self.__cookies = cookies
+        self.__cookie_header = cookie_header(cookies)
 
     def __call__(self, request: PreparedRequest) -> PreparedRequest:
         # request.prepare_cookies(self.__cookies)
         if validate_host(request.url):
-            request.headers['Cookie'] = '; '.join('{0}={1}'.format(key, val) for key, val in self.__cookies.items())
+            request.headers['Cookie'] = self.__cookie_header
         return request
 
 
@@ -112,9 +127,17 @@ class NewStudioAuthPlugin(object):
     newstudio_auth:
       username: 'username_here'
       password: 'password_here'
+
+    Several accounts can be used to spread requests over them:
+
+    newstudio_auth:
+      - username: 'username_1'
+        password: 'password_1'
+      - username: 'username_2'
+        password: 'password_2'
     """
 
-    schema = {
+    account_schema = {
         'type': 'object',
         'properties': {
             'username': {'type': 'string'},
@@ -123,7 +146,15 @@ class NewStudioAuthPlugin(object):
         'additionalProperties': False
     }
 
+    schema = {
+        'oneOf': [
+            account_schema,
+            {'type': 'array', 'items': account_schema, 'minItems': 1}
+        ]
+    }
+
     auth_cache = {}
+    pool_cache = {}
 
     def try_find_cookie(self, session: OrmSession, username: Text) -> Optional[Dict]:
         account = session.query(NewStudioAccount).filter(NewStudioAccount.username == username).first()
@@ -136,7 +167,7 @@ class NewStudioAuthPlugin(object):
         else:
             return None
 
-    def get_auth_handler(self, config: Dict) -> Dict:
+    def get_account_auth_handler(self, config: Dict) -> AuthBase:
         username = config.get('username')
         if not username or len(username) <= 0:
             raise PluginError('Username are not configured.')
@@ -154,6 +185,18 @@ class NewStudioAuthPlugin(object):
 
             return auth_handler
 
+    def get_auth_handler(self, config: Union[Dict, List[Dict]]) -> AuthBase:
+        accounts = account_configs(config)
+        if len(accounts) == 1:
+            return self.get_account_auth_handler(accounts[0])
+
+        usernames = tuple(account.get('username') for account in accounts)
+        if usernames not in self.pool_cache:
+            handlers = [self.get_account_auth_handler(account) for account in accounts]
+            self.pool_cache[usernames] = AuthPool(handlers, validate_host)
+
+        return self.pool_cache[usernames]
+
     @plugin.priority(plugin.PRIORITY_DEFAULT)
     def on_task_start(self, task: Task, config: Dict) -> None:
         task.requests.auth = self.get_auth_handler(config)
@@ -171,8 +214,7 @@ class NewStudioAuthPlugin(object):
                 log.debug('entry %s has invalid host, skipping', entry)
                 continue
 
-            username = config.get('username')
-            log.debug('setting auth with username %s', username)
+            log.debug('setting auth for %s', entry)
             entry['download_auth'] = self.get_auth_handler(config)
 
 
@@ -180,13 +222,14 @@ class NewStudioAuthPlugin(object):
 
 
 # region NewStudioPlugin
-TOPIC_ID_REGEXP = re.compile(r'viewtopic\.php\?t=(\d+)', flags=re.IGNORECASE)
-DOWNLOAD_ID_REGEXP = re.compile(r'download\.php\?id=(\d+)', flags=re.IGNORECASE)
+TOPIC_ID_REGEXP = lazy_compile(r'viewtopic\.php\?t=(\d+)', flags=re.IGNORECASE)
+DOWNLOAD_ID_REGEXP = lazy_compile(r'download\.php\?id=(\d+)', flags=re.IGNORECASE)
 
-PAGINATION_CLASS_REGEXP = re.compile(r'pagination.*', flags=re.IGNORECASE)
+PAGINATION_CLASS_REGEXP = lazy_compile(r'pagination.*', flags=re.IGNORECASE)
 
-TOPIC_TITLE_EPISODE_REGEXP = re.compile(r"\([Сс]езон\s+(\d+)(?:\W+[Сс]ерия\s+(\d+)(?:-(\d+))?)?\)", flags=re.IGNORECASE)
-TOPIC_TITLE_QUALITY_REGEXP = re.compile(r'^.*\)\s*(.*?)(?:\s*\|.*)?$', flags=re.IGNORECASE)
+TOPIC_TITLE_EPISODE_REGEXP = lazy_compile(r"\([Сс]езон\s+(\d+)(?:\W+[Сс]ерия\s+(\d+)(?:-(\d+))?)?\)",
+                                          flags=re.IGNORECASE)
+TOPIC_TITLE_QUALITY_REGEXP = lazy_compile(r'^.*\)\s*(.*?)(?:\s*\|.*)?$', flags=re.IGNORECASE)
 
 
 class NewStudioForum(object):
@@ -234,8 +277,9 @@ class ParsingError(Exception):
 
 class NewStudioParser(object):
     @staticmethod
+    @timed('parse_time')
     def parse_forums(html: Text) -> Set[NewStudioForum]:
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = bs4.BeautifulSoup(html, 'html.parser')
         accordion_node = soup.find('div', class_='accordion', id='serialist')
         if not accordion_node:
             raise ParsingError(
@@ -263,10 +307,11 @@ class NewStudioParser(object):
         return forums
 
     @staticmethod
+    @timed('parse_time')
     def parse_forum_pages_count(html: Text) -> int:
         pages_count = 0
 
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = bs4.BeautifulSoup(html, 'html.parser')
         pagination_node = soup.find('div', class_=PAGINATION_CLASS_REGEXP)
         if pagination_node:
             pagination_nodes = pagination_node.find_all('li')
@@ -283,10 +328,11 @@ class NewStudioParser(object):
         return pages_count
 
     @staticmethod
+    @timed('parse_time')
     def parse_topics(html: Text) -> Set[NewStudioTopic]:
         topics = set()
 
-        forum_soup = BeautifulSoup(html, 'html.parser')
+        forum_soup = bs4.BeautifulSoup(html, 'html.parser')
         leftside_node = forum_soup.find('div', id='sideLeft')
         if not leftside_node:
             raise ParsingError("Error while parsing serials page: node <div id=`sideLeft`> are not found")
@@ -505,6 +551,7 @@ class NewStudio(object):
         return '{0}/download.php?id={1}'.format(BASE_URL, download_id)
 
     @staticmethod
+    @STATS.phase(CACHE_REFRESH)
     def get_forums(requests: RequestsSession) -> Set[NewStudioForum]:
         response = requests.get(BASE_URL)
         response.raise_for_status()
@@ -543,13 +590,29 @@ class NewStudio(object):
 
 FORUMS_CACHE_DAYS_LIFETIME = 3
 FORUM_TOPICS_CACHE_DAYS_LIFETIME = 1
-SEARCH_STRING_REGEXPS = [
-    re.compile(r'^(.*?)\s*(\d+?)x(\d+?)$', flags=re.IGNORECASE),
-    re.compile(r'^(.*?)\s*s(\d+?)e(\d+?)$', flags=re.IGNORECASE)
-]
+
+URL_REWRITE_WORKERS = 4
+URL_REWRITE_LIMITER = RateLimiter(3)
 
 
 class NewStudioPlugin(object):
+    """
+    NewStudio urlrewrite/search plugin.
+
+    Usage:
+
+        newstudio: yes
+    """
+
+    schema = {'type': 'boolean'}
+
+    def __init__(self):
+        # Urls resolved ahead by `on_task_urlrewrite`, by task: a task must not pick up the ones of another task
+        self._download_urls = WeakKeyDictionary()
+        # Forums by title and topic indexes by forum, kept for the lifetime of each task
+        self._forums = TaskCache()
+        self._topic_indexes = TaskCache()
+
     def url_rewritable(self, task: Task, entry: Entry) -> bool:
         topic_url = entry['url']
         match = TOPIC_ID_REGEXP.search(topic_url)
@@ -558,36 +621,63 @@ class NewStudioPlugin(object):
 
         return False
 
-    def url_rewrite(self, task: Task, entry: Entry) -> bool:
-        topic_url = entry['url']
+    def _get_download_url(self, task: Task, topic_url: Text) -> Text:
         topic_url = NewStudio.add_timestamp(topic_url)
 
+        URL_REWRITE_LIMITER.wait()
         try:
             topic_response = task.requests.get(topic_url)
             topic_response.raise_for_status()
         except RequestException as e:
-            reject_reason = "Error while fetching page: {0}".format(e)
-            log.error(reject_reason)
-            entry.reject(reject_reason)
-            sleep(3)
-            return False
+            raise PluginError("Error while fetching page: {0}".format(e))
         topic_html = topic_response.content
-        sleep(3)
 
-        topic_soup = BeautifulSoup(topic_html, 'html.parser')
-        download_node = topic_soup.find('a', href=DOWNLOAD_ID_REGEXP)
+        with measure('parse_time', 'parse_topic_page'):
+            topic_soup = bs4.BeautifulSoup(topic_html, 'html.parser')
+            download_node = topic_soup.find('a', href=DOWNLOAD_ID_REGEXP)
         if download_node:
             download_url = download_node.get('href')
             match = DOWNLOAD_ID_REGEXP.search(download_url)
             if match:
                 download_id = int(match.group(1))
-                entry['url'] = NewStudio.get_download_url(download_id)
-                return True
+                return NewStudio.get_download_url(download_id)
 
-        reject_reason = "Torrent link was not detected for `{0}`".format(topic_url)
-        log.error(reject_reason)
-        entry.reject(reject_reason)
-        return False
+        raise PluginError("Torrent link was not detected for `{0}`".format(topic_url))
+
+    # Resolve all accepted entries at once, so `url_rewrite` just picks up the results
+    @plugin.priority(plugin.PRIORITY_FIRST)
+    @STATS.phase(URL_REWRITE)
+    def on_task_urlrewrite(self, task: Task, config: Dict = None) -> None:
+        self._download_urls.pop(task, None)
+        urls = set(entry['url'] for entry in task.accepted if self.url_rewritable(task, entry))
+        if not urls:
+            return
+
+        log.debug('Resolving {0} download url(s)...'.format(len(urls)))
+        preload(bs4)
+        self._download_urls[task] = map_concurrently(
+            lambda url: self._get_download_url(task, url), urls, URL_REWRITE_WORKERS)
+
+    @STATS.phase(URL_REWRITE)
+    def url_rewrite(self, task: Task, entry: Entry) -> bool:
+        topic_url = entry['url']
+
+        try:
+            resolved_urls = self._download_urls.get(task, dict())
+            if topic_url in resolved_urls:
+                download_url = resolved_urls.pop(topic_url)
+                if isinstance(download_url, Exception):
+                    raise download_url
+            else:
+                download_url = self._get_download_url(task, topic_url)
+        except PluginError as e:
+            reject_reason = str(e)
+            log.error(reject_reason)
+            entry.reject(reject_reason)
+            return False
+
+        entry['url'] = download_url
+        return True
 
     def _search_forum(self, task: Task, title: Text, session: OrmSession) -> NewStudioForum:
         update_required = True
@@ -595,6 +685,7 @@ class NewStudioPlugin(object):
         if db_timestamp:
             difference = datetime.now() - db_timestamp
             update_required = difference.days > FORUMS_CACHE_DAYS_LIFETIME
+        STATS.cache_lookup('newstudio_forums', not update_required)
         if update_required:
             log.debug('Update forums...')
             forums = NewStudio.get_forums(task.requests)
@@ -610,6 +701,7 @@ class NewStudioPlugin(object):
         if db_timestamp:
             difference = datetime.now() - db_timestamp
             update_required = difference.days > FORUM_TOPICS_CACHE_DAYS_LIFETIME
+        STATS.cache_lookup('newstudio_topics', not update_required)
         if update_required:
             log.debug('Update topics for forum `{0}`...'.format(forum_id))
             topics = NewStudio.get_forum_topics(forum_id, task.requests)
@@ -620,58 +712,67 @@ class NewStudioPlugin(object):
 
         return NewStudioDatabase.get_forum_topics(forum_id, session)
 
+    def _get_topic_index(self, task: Task, forum_id: int,
+                         session: OrmSession) -> Dict[int, List[Tuple[NewStudioTopic, NewStudioTopicInfo]]]:
+        """Parsed topics of the forum by season; loaded (and refreshed if needed) once per task."""
+
+        def load_index() -> Dict[int, List[Tuple[NewStudioTopic, NewStudioTopicInfo]]]:
+            index = dict()
+            for topic in self._search_forum_topics(task, forum_id, session):
+                try:
+                    topic_info = NewStudioParser.parse_topic_title(topic.title)
+                except ParsingError as e:
+                    log.warning(e)
+                else:
+                    index.setdefault(topic_info.season, list()).append((topic, topic_info))
+            return index
+
+        return self._topic_indexes.get(task, forum_id, load_index)
+
+    @STATS.phase(SEARCH)
     def search(self, task: Task, entry: Entry, config: Dict = None) -> Set[Entry]:
         with Session() as session:
             entries = set()
             for search_string in entry.get('search_strings', [entry['title']]):
-                search_match = None
-                for search_string_regexp in SEARCH_STRING_REGEXPS:
-                    search_match = search_string_regexp.search(search_string)
-                    if search_match:
-                        break
-
-                if not search_match:
+                search = parse_search_string(search_string)
+                if not search:
                     log.warning("Invalid search string: {0}".format(search_string))
                     continue
+                if search.season is None:
+                    log.debug("Absolute episode numbers are not supported: {0}".format(search_string))
+                    continue
 
-                search_title = search_match.group(1)
-                search_season = int(search_match.group(2))
-                search_episode = int(search_match.group(3))
-
-                log.debug("{0} s{1:02d}e{2:02d}".format(search_title, search_season, search_episode))
+                search_title = search.title
+                log.debug("{0} {1}".format(search_title, search.get_episode_id()))
 
-                forum = self._search_forum(task, search_title, session)
+                forum = self._forums.get(
+                    task, search_title, lambda: self._search_forum(task, search_title, session))
                 if not forum:
-                    log.debug("Unknown forum: {0} s{1:02d}e{2:02d}".format(search_title, search_season, search_episode))
+                    log.debug("Unknown forum: {0} {1}".format(search_title, search.get_episode_id()))
                     continue
 
                 try:
-                    topics = self._search_forum_topics(task, forum.id, session)
+                    topic_index = self._get_topic_index(task, forum.id, session)
                 except Exception as error:
                     log.error("Error while getting topics of forum `Id={0}`:\n{1}".format(forum.id, error))
                     continue
 
-                for topic in topics:
-                    try:
-                        topic_info = NewStudioParser.parse_topic_title(topic.title)
-                    except ParsingError as e:
-                        log.warning(e)
-                    else:
-                        if topic_info.season != search_season or not topic_info.contains_episode(search_episode):
-                            continue
+                for topic, topic_info in topic_index.get(search.season, ()):
+                    if not search.matches(topic_info.season, topic_info.begin_episode, topic_info.end_episode):
+                        continue
 
-                        episode_id = topic_info.get_episode_id()
+                    episode_id = topic_info.get_episode_id()
 
-                        entry = Entry()
-                        entry['title'] = "{0} / {1} / {2}".format(search_title, episode_id, topic_info.quality)
-                        entry['url'] = NewStudio.get_download_url(topic.download_id)
-                        # entry['series_season'] = topic_info.season
-                        # entry['series_episode'] = topic_info.begin_episode
-                        entry['series_id'] = episode_id
-                        # entry['series_name'] = topic_info.title
-                        # entry['quality'] = topic_info.quality
+                    entry = Entry()
+                    entry['title'] = "{0} / {1} / {2}".format(search_title, episode_id, topic_info.quality)
+                    entry['url'] = NewStudio.get_download_url(topic.download_id)
+                    # entry['series_season'] = topic_info.season
+                    # entry['series_episode'] = topic_info.begin_episode
+                    entry['series_id'] = episode_id
+                    # entry['series_name'] = topic_info.title
+                    # entry['quality'] = topic_info.quality
 
-                        entries.add(entry)
+                    entries.add(entry)
 
             return entries
 
@@ -679,7 +780,18 @@ class NewStudioPlugin(object):
 # endregion
 
 
+def do_cli(manager: Manager, options_: Any) -> None:
+    with manager.acquire_lock():
+        if options_.lf_action == 'stats':
+            print_stats(PLUGIN_NAME)
+
+
 @event('plugin.register')
 def register_plugin() -> None:
+    # Register CLI commands
+    parser = options.register_command(PLUGIN_NAME, do_cli, help='Utilities to manage the NewStudio plugin')
+    subparsers = parser.add_subparsers(title='Actions', metavar='<action>', dest='lf_action')
+    subparsers.add_parser('stats', help='Show the request, parse, database and sleep statistics')
+
     plugin.register(NewStudioAuthPlugin, PLUGIN_NAME + '_auth', api_ver=2)
-    plugin.register(NewStudioPlugin, PLUGIN_NAME, interfaces=['urlrewriter', 'search'], api_ver=2)
+    plugin.register(NewStudioPlugin, PLUGIN_NAME, interfaces=['urlrewriter', 'search', 'task'], api_ver=2)
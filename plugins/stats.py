@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, Iterator, Text
+from urllib.parse import urlsplit
+
+from flexget.db_schema import versioned_base
+from flexget.event import event
+from flexget.manager import Session
+from flexget.task import Task
+from flexget.terminal import console
+from requests import Response, Session as RequestsSession
+from sqlalchemy import Column, Unicode, Integer, Float, DateTime, UniqueConstraint
+from sqlalchemy import event as sqlalchemy_event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as OrmSession
+
+from .metrics import CACHE_LOOKUPS, CHALLENGE_SOLVES, LOGINS, PARSE_DURATION, REQUEST_DURATION, RESPONSES
+
+PLUGIN_NAME = 'tracker_stats'
+SCHEMA_VER = 0
+
+log = logging.getLogger(PLUGIN_NAME)
+Base = versioned_base(PLUGIN_NAME, SCHEMA_VER)
+
+# Phases of a tracker plugin
+AUTH = 'auth'
+SEARCH = 'search'
+URL_REWRITE = 'url_rewrite'
+FILTER = 'filter'
+INPUT = 'input'
+CACHE_REFRESH = 'cache_refresh'
+
+METRICS = ('requests', 'bytes', 'request_time', 'parse_time', 'db_time', 'sleep_time')
+
+Counters = Dict[Text, float]
+
+# The tracker and the phase the current code runs in (propagated to the worker threads by `map_concurrently`)
+_current_phase = ContextVar('tracker_stats_phase', default=None)  # type: ContextVar[Optional[Tuple[Any, Text]]]
+_active_timers = ContextVar('tracker_stats_timers', default=frozenset())
+_query_started = ContextVar('tracker_stats_query', default=None)  # type: ContextVar[Optional[float]]
+
+_trackers = dict()  # type: Dict[Text, TrackerStats]
+
+
+class TrackerStats(object):
+    """
+    Collects the HTTP requests, transferred bytes, time in flight, parse time, database time and sleep time
+    of a tracker plugin, by phase.
+
+    The counters are kept for the current task run; when the task completes they are logged
+    and added to the totals in the database (see `flexget <tracker> stats`).
+    """
+
+    def __init__(self, plugin_name: Text) -> None:
+        self.plugin_name = plugin_name
+        self._phases = dict()  # type: Dict[Text, Counters]
+        self._lock = threading.Lock()
+        _trackers[plugin_name] = self
+
+    def add(self, phase: Text, **values: float) -> None:
+        with self._lock:
+            counters = self._phases.get(phase)
+            if counters is None:
+                counters = dict.fromkeys(METRICS, 0)
+                self._phases[phase] = counters
+            for metric, value in values.items():
+                counters[metric] += value
+
+    def snapshot(self) -> Dict[Text, Counters]:
+        with self._lock:
+            return {phase: dict(counters) for phase, counters in self._phases.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._phases.clear()
+
+    def cache_lookup(self, table: Text, hit: bool) -> None:
+        CACHE_LOOKUPS.inc(plugin=self.plugin_name, table=table, result='hit' if hit else 'miss')
+
+    def login(self, success: bool) -> None:
+        LOGINS.inc(plugin=self.plugin_name, result='success' if success else 'failure')
+
+    def challenge(self, success: bool) -> None:
+        CHALLENGE_SOLVES.inc(plugin=self.plugin_name, result='success' if success else 'failure')
+
+    @contextmanager
+    def phase(self, name: Text) -> Iterator[None]:
+        """Attributes everything recorded inside to the phase. Can be used as a decorator as well."""
+
+        token = _current_phase.set((self, name))
+        try:
+            yield
+        finally:
+            _current_phase.reset(token)
+
+
+def record(**values: float) -> None:
+    current = _current_phase.get()
+    if current is not None:
+        tracker, phase = current
+        tracker.add(phase, **values)
+
+
+@contextmanager
+def measure(metric: Text, name: Text = None) -> Iterator[None]:
+    """
+    Adds the time spent inside to the metric of the current phase; nested measures of a metric count once.
+    The parse time of a named parser is observed by the parse duration histogram as well.
+    """
+
+    current = _current_phase.get()
+    active_timers = _active_timers.get()
+    if current is None or metric in active_timers:
+        yield
+        return
+
+    token = _active_timers.set(active_timers | {metric})
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        _active_timers.reset(token)
+        elapsed = time.monotonic() - started
+        tracker, phase = current
+        tracker.add(phase, **{metric: elapsed})
+        if name and metric == 'parse_time':
+            PARSE_DURATION.observe(elapsed, plugin=tracker.plugin_name, parser=name)
+
+
+def timed(metric: Text) -> Callable:
+    """Decorator version of `measure`."""
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(metric, func.__name__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def sleep(seconds: float) -> None:
+    started = time.monotonic()
+    time.sleep(seconds)
+    record(sleep_time=time.monotonic() - started)
+
+
+def endpoint_name(url: Text) -> Text:
+    """Names the endpoint of the url by its script (`browse.php`) or, for the pretty urls, by its first segment."""
+
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+    if not segments:
+        return '/'
+    if '.' in segments[-1]:
+        return segments[-1]
+    return segments[0]
+
+
+def _response_hook(response: Response, **kwargs) -> Response:
+    current = _current_phase.get()
+    if current is None:
+        return response
+
+    elapsed = response.elapsed.total_seconds()
+    if kwargs.get('stream'):
+        content_length = response.headers.get('Content-Length', '')
+        size = int(content_length) if content_length.isdigit() else 0
+    else:
+        # The body is read right after the hooks anyway; read it here to count the download time too
+        started = time.monotonic()
+        size = len(response.content)
+        elapsed += time.monotonic() - started
+
+    tracker, phase = current
+    tracker.add(phase, requests=1, bytes=size, request_time=elapsed)
+
+    endpoint = endpoint_name(response.request.url if response.request else response.url)
+    REQUEST_DURATION.observe(elapsed, plugin=tracker.plugin_name, endpoint=endpoint)
+    RESPONSES.inc(plugin=tracker.plugin_name, endpoint=endpoint, code=str(response.status_code))
+    return response
+
+
+def track_requests(requests: RequestsSession) -> None:
+    """Makes the requests of the session counted in the phase they are sent from."""
+
+    hooks = requests.hooks['response']
+    if _response_hook not in hooks:
+        hooks.append(_response_hook)
+
+
+@sqlalchemy_event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if _current_phase.get() is not None:
+        _query_started.set(time.monotonic())
+
+
+@sqlalchemy_event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = _query_started.get()
+    if started is not None:
+        _query_started.set(None)
+        record(db_time=time.monotonic() - started)
+
+
+class DbTrackerStats(Base):
+    __tablename__ = 'tracker_stats'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    plugin = Column(Unicode, nullable=False)
+    phase = Column(Unicode, nullable=False)
+    runs = Column(Integer, nullable=False)
+    requests = Column(Integer, nullable=False)
+    bytes = Column(Integer, nullable=False)
+    request_time = Column(Float, nullable=False)
+    parse_time = Column(Float, nullable=False)
+    db_time = Column(Float, nullable=False)
+    sleep_time = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    __table_args__ = (UniqueConstraint('plugin', 'phase', name='_uc_plugin_phase'),)
+
+    def __init__(self, plugin: str, phase: str, updated_at: datetime) -> None:
+        self.plugin = plugin
+        self.phase = phase
+        self.runs = 0
+        for metric in METRICS:
+            setattr(self, metric, 0)
+        self.created_at = updated_at
+        self.updated_at = updated_at
+
+    def counters(self) -> Counters:
+        return {metric: getattr(self, metric) for metric in METRICS}
+
+
+class TrackerStatsDatabase(object):
+    @staticmethod
+    def add_stats(plugin_name: Text, phases: Dict[Text, Counters], session: OrmSession) -> None:
+        now = datetime.now()
+        for phase, counters in phases.items():
+            db_stats = session.query(DbTrackerStats).filter(
+                DbTrackerStats.plugin == plugin_name, DbTrackerStats.phase == phase).first()
+            if not db_stats:
+                db_stats = DbTrackerStats(plugin_name, phase, now)
+                session.add(db_stats)
+            db_stats.runs += 1
+            for metric in METRICS:
+                setattr(db_stats, metric, getattr(db_stats, metric) + counters[metric])
+            db_stats.updated_at = now
+
+        session.commit()
+
+    @staticmethod
+    def get_stats(plugin_name: Text, session: OrmSession) -> Dict[Text, DbTrackerStats]:
+        query = session.query(DbTrackerStats).filter(DbTrackerStats.plugin == plugin_name)
+        return {db_stats.phase: db_stats for db_stats in query.all()}
+
+
+def format_counters(counters: Counters) -> Text:
+    return ('{0} request(s), {1:.1f} KiB, {2:.2f}s in flight, '
+            '{3:.2f}s parsing, {4:.2f}s in db, {5:.2f}s sleeping').format(
+        int(counters['requests']), counters['bytes'] / 1024.0, counters['request_time'],
+        counters['parse_time'], counters['db_time'], counters['sleep_time'])
+
+
+def print_stats(plugin_name: Text) -> None:
+    with Session() as session:
+        phases = TrackerStatsDatabase.get_stats(plugin_name, session)
+        if not phases:
+            console('No statistics have been collected for the `{0}` plugin yet'.format(plugin_name))
+            return
+
+        since = min(db_stats.created_at for db_stats in phases.values())
+        console('Statistics of the `{0}` plugin since {1:%Y-%m-%d %H:%M}:'.format(plugin_name, since))
+        for phase in sorted(phases):
+            db_stats = phases[phase]
+            console('  {0} ({1} run(s)): {2}'.format(phase, db_stats.runs, format_counters(db_stats.counters())))
+
+
+@event('task.execute.started')
+def on_task_started(task: Task) -> None:
+    track_requests(task.requests)
+    for tracker in _trackers.values():
+        tracker.reset()
+
+
+@event('task.execute.completed')
+def on_task_completed(task: Task) -> None:
+    collected = dict()
+    for plugin_name, tracker in _trackers.items():
+        phases = tracker.snapshot()
+        tracker.reset()
+        if not phases:
+            continue
+
+        collected[plugin_name] = phases
+        for phase in sorted(phases):
+            log.debug('{0}: {1} {2}: {3}'.format(task.name, plugin_name, phase, format_counters(phases[phase])))
+
+    if collected:
+        with Session() as session:
+            for plugin_name, phases in collected.items():
+                TrackerStatsDatabase.add_stats(plugin_name, phases, session)
@@ -1,11 +1,197 @@
 # -*- coding: utf-8 -*-
 
-import cgi
+import importlib.util
 import json
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from email.message import Message
+from functools import lru_cache
+from time import monotonic
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, List, Optional, Pattern, Text, Tuple, Union
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
 
-from requests import Response
+from requests import PreparedRequest, Response, Session as RequestsSession
+from requests.auth import AuthBase
 from sqlalchemy.types import TypeDecorator, VARCHAR
 
+from .stats import sleep
+
+
+def lazy_import(name: Text) -> ModuleType:
+    """
+    Returns the module, executing it only on the first access to its attributes (see `importlib.util.LazyLoader`).
+    Keeps heavy dependencies out of the startup of FlexGet, which imports every plugin module.
+    """
+
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError('No module named {0!r}'.format(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def preload(module: ModuleType) -> None:
+    """
+    Executes a module returned by `lazy_import`, if it is not yet.
+    `LazyLoader` is not thread-safe before Python 3.12, so call it on the calling thread before starting workers
+    which use the module.
+    """
+
+    getattr(module, '__name__')
+
+
+class LazyPattern(object):
+    """
+    A stand-in for a compiled regular expression which compiles it on first use.
+    The first call replaces the methods with the ones of the compiled pattern, so later calls cost nothing extra.
+    """
+
+    METHODS = ('search', 'match', 'fullmatch', 'split', 'findall', 'finditer', 'sub', 'subn')
+
+    def __init__(self, pattern: Union[Text, bytes], flags: int = 0) -> None:
+        self._args = (pattern, flags)
+        self._compiled = None  # type: Optional[Pattern]
+
+    def compiled(self) -> Pattern:
+        if self._compiled is None:
+            compiled = re.compile(*self._args)
+            for name in self.METHODS:
+                setattr(self, name, getattr(compiled, name))
+            self._compiled = compiled
+        return self._compiled
+
+    def search(self, *args, **kwargs):
+        return self.compiled().search(*args, **kwargs)
+
+    def match(self, *args, **kwargs):
+        return self.compiled().match(*args, **kwargs)
+
+    def fullmatch(self, *args, **kwargs):
+        return self.compiled().fullmatch(*args, **kwargs)
+
+    def split(self, *args, **kwargs):
+        return self.compiled().split(*args, **kwargs)
+
+    def findall(self, *args, **kwargs):
+        return self.compiled().findall(*args, **kwargs)
+
+    def finditer(self, *args, **kwargs):
+        return self.compiled().finditer(*args, **kwargs)
+
+    def sub(self, *args, **kwargs):
+        return self.compiled().sub(*args, **kwargs)
+
+    def subn(self, *args, **kwargs):
+        return self.compiled().subn(*args, **kwargs)
+
+    @property
+    def pattern(self) -> Union[Text, bytes]:
+        return self._args[0]
+
+    @property
+    def flags(self) -> int:
+        return self.compiled().flags
+
+    @property
+    def groups(self) -> int:
+        return self.compiled().groups
+
+    @property
+    def groupindex(self) -> Dict[Text, int]:
+        return self.compiled().groupindex
+
+    def __repr__(self) -> Text:
+        return 'LazyPattern({0!r}, {1!r})'.format(*self._args)
+
+
+def lazy_compile(pattern: Union[Text, bytes], flags: int = 0) -> LazyPattern:
+    """`re.compile` counterpart for module-level patterns; see `LazyPattern`."""
+
+    return LazyPattern(pattern, flags)
+
+
+class SearchString(object):
+    """
+    A parsed search string: the title and an episode (`S01E02`, `1x02`), a season pack (`S01`, `Season 1`)
+    or an absolute episode number (`#123`, `E123`, `Ep 123`). A bare trailing number is not taken for one:
+    it is a part of the title as often as not (`Fargo 2014`, `24`).
+    Instances are shared by the memo of `parse_search_string`, so they must not be modified.
+    """
+
+    def __init__(self, title: Text, season: Optional[int] = None, episode: Optional[int] = None,
+                 absolute: Optional[int] = None) -> None:
+        self.title = title
+        self.season = season
+        self.episode = episode
+        self.absolute = absolute
+
+    @property
+    def is_season_pack(self) -> bool:
+        return self.season is not None and self.episode is None
+
+    def matches(self, season: int, first_episode: int, last_episode: int) -> bool:
+        """
+        Whether a release of the episodes of the season answers the search.
+        A season pack is answered by the whole-season (no episode number) and multi-episode releases.
+        """
+
+        if self.season is None or self.season != season:
+            return False
+        if self.episode is None:
+            return first_episode <= 0 or first_episode < last_episode
+        return first_episode <= self.episode <= last_episode
+
+    def get_episode_id(self) -> Text:
+        if self.season is None:
+            return "#{0}".format(self.absolute)
+        if self.episode is None:
+            return "s{0:02d}".format(self.season)
+        return "s{0:02d}e{1:02d}".format(self.season, self.episode)
+
+    def __repr__(self) -> Text:
+        return 'SearchString({0!r}, {1})'.format(self.title, self.get_episode_id())
+
+
+SEARCH_STRING_REGEXP = lazy_compile(r"""
+    ^(?P<title>.*?)\s*(?=[\d\#se])(?:                                # the lookahead rules out most positions at once
+        s(?P<season>\d+)\s*e(?P<episode>\d+)                       # S01E02
+        | (?P<x_season>\d+)x(?P<x_episode>\d+)                      # 1x02
+        | (?<=\s)(?:s|season\s*)(?P<pack_season>\d+)               # S01, Season 1
+        | (?<=\s)(?:\#|e|ep\.?\s*|episode\s*)(?P<absolute>\d+)     # #123, E123, Ep 123
+    )$
+""", flags=re.IGNORECASE | re.VERBOSE)
+
+
+@lru_cache(maxsize=1024)
+def parse_search_string(search_string: Text) -> Optional[SearchString]:
+    """Parses the search string of an episode by the single pattern of all supported formats; memoized."""
+
+    match = SEARCH_STRING_REGEXP.match(search_string.strip())
+    if not match:
+        return None
+
+    title, season, episode, x_season, x_episode, pack_season, absolute = match.groups()
+    if season:
+        return SearchString(title, season=int(season), episode=int(episode))
+    if x_season:
+        return SearchString(title, season=int(x_season), episode=int(x_episode))
+    if pack_season:
+        return SearchString(title, season=int(pack_season))
+    return SearchString(title, absolute=int(absolute))
+
 
 class JSONEncodedDict(TypeDecorator):
     """
@@ -28,19 +214,265 @@ class JSONEncodedDict(TypeDecorator):
         return value
 
 
+def parse_header(value: Text) -> Tuple[Text, Dict[Text, Text]]:
+    """Splits a `Content-Type`-like header into the lowercased value and its parameters (like `cgi.parse_header`)."""
+
+    message = Message()
+    message['Content-Type'] = value
+    params = message.get_params() or [('', '')]
+    return params[0][0].strip().lower(), {key.lower(): val for key, val in params[1:]}
+
+
 class ContentType(object):
     TORRENT_CONTENT_TYPE = 'application/x-bittorrent'
+    # Sent by some trackers for torrent files too, so the body decides
+    GENERIC_CONTENT_TYPES = ('application/octet-stream', 'application/force-download', 'application/download')
+    # A torrent file is a bencoded dictionary, which starts with its first key: `d8:announce`, `d4:info`...
+    TORRENT_MAGIC_REGEXP = lazy_compile(rb'^d[1-9]\d*:')
+    MAGIC_LENGTH = 16
 
     @staticmethod
     def is_torrent(content_type: str) -> bool:
-        mimetype, options = cgi.parse_header(content_type)
-        return mimetype.lower() == ContentType.TORRENT_CONTENT_TYPE
+        mimetype, options = parse_header(content_type)
+        return mimetype == ContentType.TORRENT_CONTENT_TYPE
+
+    @staticmethod
+    def may_be_torrent(content_type: str) -> bool:
+        """Whether the body of a response with the content type has to be sniffed (or, without the type, at all)."""
+
+        if not content_type:
+            return True
+        mimetype, options = parse_header(content_type)
+        return mimetype == ContentType.TORRENT_CONTENT_TYPE or mimetype in ContentType.GENERIC_CONTENT_TYPES
+
+    @staticmethod
+    def is_torrent_data(data: bytes) -> bool:
+        return ContentType.TORRENT_MAGIC_REGEXP.match(data[:ContentType.MAGIC_LENGTH]) is not None
 
     @staticmethod
     def raise_not_torrent(response: Response) -> None:
-        content_type = response.headers['Content-Type']
+        content_type = response.headers.get('Content-Type', '')
         if ContentType.is_torrent(content_type):
             return
 
         raise ValueError('Invalid content type: "{0}". Expected: "{1}"'.format(
             content_type, ContentType.TORRENT_CONTENT_TYPE))
+
+    @staticmethod
+    def raise_not_torrent_data(data: bytes, content_type: Text = '') -> None:
+        if ContentType.is_torrent_data(data):
+            return
+
+        raise ValueError('Not a torrent file: {0!r}... (content type: "{1}")'.format(
+            bytes(data[:ContentType.MAGIC_LENGTH]), content_type))
+
+
+MAX_TORRENT_SIZE = 10 * 1024 * 1024
+TORRENT_CHUNK_SIZE = 16 * 1024
+
+
+def download_torrent(requests: RequestsSession, url: Text, max_size: int = MAX_TORRENT_SIZE) -> bytes:
+    """
+    Downloads the torrent file, streaming the response so that a non-torrent body is not read in full:
+    the download is aborted by the content type (e.g. an HTML login page) or by the first bytes of the body,
+    which must be a bencoded dictionary.
+    """
+
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if not ContentType.may_be_torrent(content_type):
+            raise ValueError('Invalid content type: "{0}". Expected: "{1}"'.format(
+                content_type, ContentType.TORRENT_CONTENT_TYPE))
+
+        content_length = response.headers.get('Content-Length', '')
+        if content_length.isdigit() and int(content_length) > max_size:
+            raise ValueError('The torrent is too large: {0} bytes'.format(content_length))
+
+        data = bytearray()
+        sniffed = False
+        for chunk in response.iter_content(chunk_size=TORRENT_CHUNK_SIZE):
+            data += chunk
+            if not sniffed and len(data) >= ContentType.MAGIC_LENGTH:
+                ContentType.raise_not_torrent_data(data, content_type)
+                sniffed = True
+            if len(data) > max_size:
+                raise ValueError('The torrent is too large: more than {0} bytes'.format(max_size))
+
+        if not sniffed:
+            ContentType.raise_not_torrent_data(data, content_type)
+        return bytes(data)
+
+
+@lru_cache(maxsize=256)
+def _match_origin(regexp: Pattern, scheme: Text, netloc: Text) -> bool:
+    return regexp.match('{0}://{1}'.format(scheme, netloc)) is not None
+
+
+def match_host(regexp: Pattern, url: Text) -> bool:
+    """
+    Checks the scheme and the network location of the url against the host regexp.
+    The result is cached per netloc, so repeated checks do not re-run the regexp.
+    """
+
+    parts = urlsplit(url)
+    return _match_origin(regexp, parts.scheme, parts.netloc)
+
+
+def cookie_header(cookies: Dict) -> Text:
+    return '; '.join('{0}={1}'.format(key, val) for key, val in cookies.items())
+
+
+class _PoolAccount(object):
+    def __init__(self, handler: AuthBase) -> None:
+        self.handler = handler
+        self.last_used = 0.0
+        self.throttled_until = 0.0
+        self.failures = 0
+
+
+class AuthPool(AuthBase):
+    """
+    Spreads the tracker requests over several accounts.
+
+    Every request is signed by the least recently used account which is not throttled.
+    Each account has its own request interval (rate-limit bucket) and health state:
+    an account answered with `429` or `503` is put aside until its cooldown expires.
+    """
+
+    THROTTLE_STATUS_CODES = (429, 503)
+    MAX_THROTTLE_TIMEOUT = 3600.0
+
+    def __init__(self, handlers: List[AuthBase], validate_host: Callable[[Text], bool],
+                 request_interval: float = 1.0, throttle_timeout: float = 60.0) -> None:
+        if not handlers:
+            raise ValueError('handlers can not be empty')
+
+        self._accounts = [_PoolAccount(handler) for handler in handlers]
+        self._validate_host = validate_host
+        self._request_interval = request_interval
+        self._throttle_timeout = throttle_timeout
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> _PoolAccount:
+        with self._lock:
+            now = monotonic()
+            healthy = [account for account in self._accounts if account.throttled_until <= now]
+            if healthy:
+                account = min(healthy, key=lambda item: item.last_used)
+                delay = account.last_used + self._request_interval - now
+            else:
+                account = min(self._accounts, key=lambda item: item.throttled_until)
+                delay = max(account.throttled_until, account.last_used + self._request_interval) - now
+            account.last_used = now + max(delay, 0.0)
+
+        if delay > 0:
+            sleep(delay)
+
+        return account
+
+    def _throttle(self, account: _PoolAccount, response: Response) -> None:
+        timeout = None
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            timeout = float(retry_after)
+
+        with self._lock:
+            account.failures += 1
+            if timeout is None:
+                timeout = self._throttle_timeout * (2 ** (account.failures - 1))
+            timeout = min(timeout, self.MAX_THROTTLE_TIMEOUT)
+            account.throttled_until = monotonic() + timeout
+
+    def _response_hook(self, account: _PoolAccount) -> Callable:
+        def hook(response: Response, **kwargs) -> Response:
+            if response.status_code in self.THROTTLE_STATUS_CODES:
+                self._throttle(account, response)
+            elif account.failures > 0:
+                with self._lock:
+                    account.failures = 0
+            return response
+
+        return hook
+
+    def __call__(self, request: PreparedRequest) -> PreparedRequest:
+        if not self._validate_host(request.url):
+            return request
+
+        account = self._acquire()
+        request = account.handler(request)
+        request.register_hook('response', self._response_hook(account))
+        return request
+
+
+def account_configs(config: Union[Dict, List[Dict]]) -> List[Dict]:
+    """Returns the list of accounts of the `*_auth` config (a single account or a list of them)."""
+
+    if isinstance(config, list):
+        return config
+    return [config]
+
+
+class RateLimiter(object):
+    """Enforces a minimum interval between the starts of requests. Can be shared between threads."""
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = monotonic()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + self._interval
+
+        delay = start_time - now
+        if delay > 0:
+            sleep(delay)
+
+
+class TaskCache(object):
+    """
+    Values computed at most once per task: e.g. the shows resolved by title and their topic indexes,
+    so that the searches of a task answer all its episodes from memory. Forgotten with the task object.
+    """
+
+    def __init__(self) -> None:
+        self._tasks = WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, task: Any, key: Any, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            values = self._tasks.get(task)
+            if values is None:
+                values = dict()
+                self._tasks[task] = values
+
+        if key not in values:
+            values[key] = factory()
+        return values[key]
+
+
+def map_concurrently(func: Callable[[Any], Any], items: Iterable, max_workers: int) -> Dict[Any, Any]:
+    """
+    Calls `func` for every item through a bounded thread pool.
+    Returns the results keyed by item; an exception raised by `func` is returned in place of the result.
+    The calls run in a copy of the caller's context, so they are attributed to the caller's stats phase.
+    """
+
+    items = list(items)
+    if not items:
+        return dict()
+
+    results = dict()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        futures = {executor.submit(copy_context().run, func, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                results[item] = future.result()
+            except Exception as e:
+                results[item] = e
+
+    return results
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import tempfile
 import unittest
 
 import requests
 import yaml
+from flexget.entry import Entry
 
+from benchmarks.load import LoadTask, setup_database
+from benchmarks.stub_tracker import StubTracker
+from plugins.utils import RateLimiter
 from . import alexfilm, ContentType
 
 class TestAlexFilm(unittest.TestCase):
@@ -39,5 +44,56 @@ class TestAlexFilm(unittest.TestCase):
         print(content_type)
 
 
+class TestAlexFilmDownloadUrls(unittest.TestCase):
+    TOPIC_ID = 10010101
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        setup_database(self._directory.name)
+        self._limiter = alexfilm.URL_REWRITE_LIMITER
+        alexfilm.URL_REWRITE_LIMITER = RateLimiter(0)
+
+        self._stub = StubTracker().start()
+        self._task = LoadTask('test', self._stub.mount(requests.Session()))
+        self._plugin = alexfilm.AlexFilmPlugin()
+        self._topic_url = '{0}/viewtopic.php?t={1}'.format(alexfilm.BASE_URL, self.TOPIC_ID)
+
+    def tearDown(self):
+        self._task.requests.close()
+        self._stub.stop()
+        alexfilm.URL_REWRITE_LIMITER = self._limiter
+        self._directory.cleanup()
+
+    def test_magnet_is_cached(self):
+        download_url = self._plugin._get_download_urls(self._task, {self._topic_url}, True)[self._topic_url]
+        self.assertTrue(download_url.startswith('magnet:'))
+        self.assertEqual(self._stub.stats.total, 1)
+
+        cached_url = self._plugin._get_download_urls(self._task, {self._topic_url}, True)[self._topic_url]
+        self.assertEqual(cached_url, download_url)
+        self.assertEqual(self._stub.stats.total, 1)
+
+    def test_no_magnet_falls_back_to_cached_download_id(self):
+        with alexfilm.Session() as session:
+            alexfilm.AlexFilmDatabase.update_download_id(self.TOPIC_ID, 70001, session)
+            alexfilm.AlexFilmDatabase.update_magnet(self.TOPIC_ID, '', session)
+
+        download_url = self._plugin._get_download_urls(self._task, {self._topic_url}, True)[self._topic_url]
+        self.assertEqual(download_url, alexfilm.AlexFilm.get_download_url_by_id(70001))
+        self.assertEqual(self._stub.stats.total, 0, 'The topic page is fetched again')
+
+    def test_resolved_urls_are_kept_per_task(self):
+        accepted_entry = Entry(title='Topic', url=self._topic_url)
+        accepted_entry.accept()
+        self._task.entries.append(accepted_entry)
+        self._plugin.on_task_urlrewrite(self._task, {'prefer_magnet': True})
+
+        other_task = LoadTask('other', self._task.requests)
+        entry = Entry(title='Topic', url=self._topic_url)
+        self._plugin.on_task_urlrewrite(other_task, True)
+        self._plugin.url_rewrite(other_task, entry)
+        self.assertFalse(entry['url'].startswith('magnet:'), 'The magnet of another task is used')
+
+
 if __name__ == '__main__':
     unittest.main()
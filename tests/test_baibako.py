@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import tempfile
 import unittest
 
 import requests
 import yaml
 
-from . import baibako
+from benchmarks.load import LoadTask, setup_database
+from benchmarks.stub_tracker import Catalog, StubTracker
+from . import baibako, download_torrent
 
 
 class TestBaibako(unittest.TestCase):
@@ -52,5 +55,54 @@ class TestBaibako(unittest.TestCase):
         self.assertEqual(len(info_hash), 40, "The hash has invalid length: {0}".format(info_hash))
 
 
+class TestBaibakoDownload(unittest.TestCase):
+    def setUp(self):
+        self._stub = StubTracker(Catalog(shows=3)).start()
+        self._requests = self._stub.mount(requests.Session())
+
+    def tearDown(self):
+        self._requests.close()
+        self._stub.stop()
+
+    def test_info_hash(self):
+        info_hash = baibako.Baibako.get_info_hash(self._requests, 1)
+        self.assertEqual(info_hash, Catalog.torrent_info_hash('baibako-1'))
+
+    def test_not_torrent(self):
+        url = '{0}/serial.php?id={1}'.format(baibako.BASE_URL, Catalog.show_id(0))
+        with self.assertRaises(ValueError):
+            download_torrent(self._requests, url)
+
+
+class TestBaibakoForumTopics(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        setup_database(self._directory.name)
+        self._stub = StubTracker(Catalog(shows=3)).start()
+        self._task = LoadTask('test', self._stub.mount(requests.Session()))
+        self._forum_id = Catalog.show_id(0)
+
+    def tearDown(self):
+        self._task.requests.close()
+        self._stub.stop()
+        self._directory.cleanup()
+
+    def test_quality_tab_from_all_tab(self):
+        all_topics = baibako.Baibako.get_forum_topics(self._forum_id, 'all', self._task.requests)
+        hd720_topics = baibako.Baibako.get_forum_topics(self._forum_id, 'hd720', self._task.requests)
+        self.assertLess(len(hd720_topics), len(all_topics))
+
+        with baibako.Session() as session:
+            baibako.BaibakoDatabase.update_forum_topics(self._forum_id, 'all', all_topics, session)
+            requests_count = self._stub.stats.total
+
+            topics = baibako.BaibakoPlugin()._search_forum_topics(self._task, self._forum_id, 'hd720', session)
+
+        self.assertEqual(self._stub.stats.total, requests_count, 'The hd720 tab is fetched')
+        # The stub numbers the topics by tab, so they are compared by title
+        self.assertEqual(sorted(topic.title for topic in topics), sorted(topic.title for topic in hd720_topics))
+        self.assertTrue(all('720p' in topic.title for topic in topics))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import os
+import tempfile
 import unittest
+from datetime import datetime, timedelta
+from unittest import mock
 
 import requests
 import yaml
+from flexget.entry import Entry
+from sqlalchemy.exc import OperationalError
 
+from benchmarks.load import LoadTask, setup_database
+from benchmarks.stub_tracker import Catalog, StubTracker
+from plugins import stats
+from plugins.utils import RateLimiter
 from . import kinozal, ContentType
 
 
@@ -44,5 +54,165 @@ class TestKinozal(unittest.TestCase):
                          "The response has invalid content type: {0}".format(content_type))
 
 
+class TestKinozalParser(unittest.TestCase):
+    def test_parse_search_result(self):
+        path = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'fixtures', 'kinozal_browse.html')
+        with open(path, 'r', encoding='utf-8') as stream:
+            html = stream.read()
+
+        search_result = kinozal.KinozalParser.parse_search_result(html, 'http://kinozal.tv/browse.php')
+        self.assertEqual(len(search_result), 50)
+        for entry in search_result:
+            self.assertGreater(entry.size, 0, "The size is not parsed: {0}".format(entry.url))
+            self.assertTrue(entry.date, "The date is not parsed: {0}".format(entry.url))
+
+
+class TestKinozalSearchCache(unittest.TestCase):
+    LIFETIME = timedelta(minutes=30)
+    KWARGS = dict(category=kinozal.DEFAULT_CATEGORY, quality=kinozal.DEFAULT_QUALITY, filter_=kinozal.DEFAULT_FILTER,
+                  sort_by=kinozal.DEFAULT_SORT, sort_order=kinozal.DEFAULT_SORT_ORDER)
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        setup_database(self._directory.name)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    @staticmethod
+    def result(page):
+        entry = kinozal.KinozalSearchEntry(page, 'Topic {0}'.format(page), '{0}/details.php?id={1}'.format(
+            kinozal.BASE_URL, page))
+        entry.position = 0
+        return {entry}
+
+    def test_lifetime(self):
+        with kinozal.Session() as session:
+            kinozal.KinozalDatabase.update_search_result(session, self.result(0), 'Fargo', 0, **self.KWARGS)
+            result = kinozal.KinozalDatabase.get_search_result(session, self.LIFETIME, 'fargo ', 0, **self.KWARGS)
+            self.assertEqual([entry.id for entry in result], [0])
+
+            session.query(kinozal.DbKinozalSearchResult).update(
+                {kinozal.DbKinozalSearchResult.updated_at: datetime.now() - self.LIFETIME - timedelta(minutes=1)})
+            session.commit()
+            self.assertIsNone(
+                kinozal.KinozalDatabase.get_search_result(session, self.LIFETIME, 'Fargo', 0, **self.KWARGS))
+
+    @mock.patch.object(kinozal, 'SEARCH_CACHE_MAX_SIZE', 10)
+    def test_eviction(self):
+        with kinozal.Session() as session:
+            for page in range(10):
+                kinozal.KinozalDatabase.update_search_result(session, self.result(page), 'Fargo', page, **self.KWARGS)
+            # The oldest result is used again, so the next one is the least recently used
+            self.assertIsNotNone(
+                kinozal.KinozalDatabase.get_search_result(session, self.LIFETIME, 'Fargo', 0, **self.KWARGS))
+
+            for page in range(10, 15):
+                kinozal.KinozalDatabase.update_search_result(session, self.result(page), 'Fargo', page, **self.KWARGS)
+
+            pages = sorted(page for page, in session.query(kinozal.DbKinozalSearchResult.page))
+            self.assertEqual(pages, [0] + list(range(6, 15)))
+
+
+class CountingLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__(0)
+        self.waits = list()
+
+    def wait(self):
+        self.waits.append(None)
+        super().wait()
+
+
+class TestKinozalSearch(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        setup_database(self._directory.name)
+        self._limiter = kinozal.SEARCH_LIMITER
+        kinozal.SEARCH_LIMITER = CountingLimiter()
+        self._stub = StubTracker(Catalog(pages=4)).start()
+        self._task = LoadTask('test', self._stub.mount(requests.Session()))
+
+    def tearDown(self):
+        self._task.requests.close()
+        self._stub.stop()
+        kinozal.SEARCH_LIMITER = self._limiter
+        self._directory.cleanup()
+
+    def test_pages_are_paced(self):
+        result = kinozal.Kinozal.search_pages(self._task.requests, 'Fargo', max_pages=4)
+
+        self.assertEqual(len(result), 4 * self._stub.catalog.page_size)
+        self.assertEqual(self._stub.stats.total, 4)
+        self.assertEqual(len(kinozal.SEARCH_LIMITER.waits), 4)
+
+    def test_cache_error_is_logged(self):
+        update_search_result = kinozal.KinozalDatabase.update_search_result
+
+        def fail_first_page(session, entries, search_string, page, **kwargs):
+            if page == 0:
+                raise OperationalError('INSERT', {}, Exception('database is locked'))
+            update_search_result(session, entries, search_string, page, **kwargs)
+
+        entry = Entry(title='Fargo', url='', search_strings=['Fargo'])
+        config = {'max_pages': 2, 'cache_lifetime': 30}
+        with mock.patch.object(kinozal, 'sleep', lambda seconds: None), \
+                mock.patch.object(kinozal.KinozalDatabase, 'update_search_result', staticmethod(fail_first_page)), \
+                self.assertLogs(kinozal.log, 'WARNING') as logs:
+            entries = kinozal.KinozalPlugin().search(self._task, entry, config)
+
+        # Both pages are fetched and used
+        self.assertEqual(self._stub.stats.total, 2)
+        self.assertEqual(len(entries), 2 * self._stub.catalog.page_size)
+        self.assertIn('Error while caching search page 0', '\n'.join(logs.output))
+        with kinozal.Session() as session:
+            pages = [page for page, in session.query(kinozal.DbKinozalSearchResult.page)]
+        self.assertEqual(pages, [1])
+
+
+class TestKinozalFilter(unittest.TestCase):
+    def setUp(self):
+        self._stub = StubTracker().start()
+        self._task = LoadTask('test', self._stub.mount(requests.Session()))
+        stats.track_requests(self._task.requests)
+        kinozal.STATS.reset()
+
+    def tearDown(self):
+        self._task.requests.close()
+        self._stub.stop()
+        kinozal.STATS.reset()
+
+    @staticmethod
+    def entry(topic_id, info_hash):
+        url = '{0}/details.php?id={1}'.format(kinozal.BASE_URL, topic_id)
+        return Entry(title='Topic {0}'.format(topic_id), url=url, torrent_info_hash=info_hash)
+
+    def test_filter(self):
+        known = self.entry(1, Catalog.info_hash('kinozal-1'))
+        updated = self.entry(2, '0' * 40)
+        self._task.entries = [known, updated]
+        kinozal.KinozalPlugin().on_task_filter(self._task, True)
+
+        self.assertTrue(known.rejected)
+        self.assertTrue(updated.accepted)
+        self.assertEqual(updated['torrent_info_hash'], Catalog.info_hash('kinozal-2'))
+        # The requests are counted in the filter phase
+        self.assertEqual(kinozal.STATS.snapshot()['filter']['requests'], 2)
+
+    def test_search_and_filter(self):
+        plugin = kinozal.KinozalPlugin()
+        entry = Entry(title='Fargo', url='', search_strings=['Fargo'])
+        with mock.patch.object(kinozal, 'sleep', lambda seconds: None):
+            entries = plugin.search(self._task, entry, {'fetch_info_hash': 5, 'cache_lifetime': 0})
+        self.assertEqual(len([item for item in entries if item.get('torrent_info_hash')]), 5)
+
+        # The hashes of the task's own search results are current: they must not be taken for known ones
+        known = self.entry(1, Catalog.info_hash('kinozal-1'))
+        self._task.entries = list(entries) + [known]
+        plugin.on_task_filter(self._task, True)
+
+        self.assertEqual([item for item in self._task.entries if item.rejected], [known])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,8 +2,12 @@
 
 import requests
 import unittest
+from datetime import timedelta
+from unittest import mock
+
 import yaml
 
+from benchmarks.stub_tracker import StubTracker
 from . import lostfilm, ContentType
 
 
@@ -49,7 +53,7 @@ class TestLostFilm(unittest.TestCase):
         self.assertRaises(Exception)
 
     def test_episodes(self):
-        episodes = lostfilm.LostFilm.get_show_episodes(self._requests, 'Godless')
+        episodes = lostfilm.LostFilm.get_show_season_episodes(self._requests, 'Godless', 1)
         for episode in episodes:
             print(u"[{0} - s{1:02d}e{2:02d}] {3}".format(
                 episode.show_id, episode.season, episode.episode, episode.title))
@@ -71,5 +75,34 @@ class TestLostFilm(unittest.TestCase):
         self.assertRaises(Exception)
 
 
+class TestLostFilmRedirect(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(lostfilm, 'REDIRECTS_CACHE', lostfilm.RedirectsCache(timedelta(hours=1)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self._stub = StubTracker().start()
+        self._requests = self._stub.mount(requests.Session())
+
+    def tearDown(self):
+        self._requests.close()
+        self._stub.stop()
+
+    def test_redirect(self):
+        torrents = lostfilm.LostFilm.get_episode_torrents(self._requests, 412, 1, 5)
+        self.assertEqual([torrent.label for torrent in torrents], ['SD', '1080', 'MP4'])
+        self.assertEqual(self._stub.stats.total, 2)
+
+        # The redirect is cached: the stub is not fetched again
+        torrents = lostfilm.LostFilm.get_episode_torrents(self._requests, 412, 1, 5)
+        self.assertEqual(len(torrents), 3)
+        self.assertEqual(self._stub.stats.total, 3)
+
+    def test_no_redirect(self):
+        page = lostfilm.LostFilm._get_page(self._requests, '{0}/new/'.format(lostfilm.BASE_URL))
+        self.assertEqual(lostfilm.LostFilmParser.parse_new_page(page)[0].show_title, 'Show 0')
+        self.assertEqual(self._stub.stats.total, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
 
-import cgi
 import unittest
 
 import requests
 import urllib3
 import yaml
 
-from . import newstudio, ContentType
+from . import newstudio, ContentType, parse_header
 
 
 class TestNewStudio(unittest.TestCase):
@@ -84,7 +83,7 @@ class TestNewStudio(unittest.TestCase):
         url = "http://releases.ubuntu.com/18.04/ubuntu-18.04.3-desktop-amd64.iso.torrent?_ga=2.196584104.506460685.1574018110-1051848907.1572256016"
         response = http.request('GET', url)
         content_disposition = response.headers.get('Content-Disposition', '')
-        _, params = cgi.parse_header(content_disposition)
+        _, params = parse_header(content_disposition)
         filename = params.get('filename')
         print(filename)
         # print(response.info().get_filename())
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+from flexget.entry import Entry
+from requests.auth import AuthBase
+
+from benchmarks.load import LoadTask, setup_database
+from plugins.utils import AuthPool, RateLimiter, account_configs, parse_search_string
+from . import newstudio
+
+
+class FakeClock(object):
+    """Stands for `monotonic` and `sleep` of the utils module: sleeping just moves the time on."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = list()
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def patch(self):
+        return mock.patch.multiple('plugins.utils', monotonic=self.monotonic, sleep=self.sleep)
+
+
+class FakeAuth(AuthBase):
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, request):
+        request.headers['X-Account'] = self.name
+        return request
+
+
+def fake_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or dict())
+    return response
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self._clock = FakeClock()
+        patcher = self._clock.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_interval(self):
+        limiter = RateLimiter(2.0)
+        limiter.wait()
+        self.assertEqual(self._clock.sleeps, [])
+
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual(self._clock.sleeps, [2.0, 2.0])
+
+        self._clock.now += 5.0
+        limiter.wait()
+        self.assertEqual(self._clock.sleeps, [2.0, 2.0])
+
+    def test_no_interval(self):
+        limiter = RateLimiter(0)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(self._clock.sleeps, [])
+
+
+class TestAuthPool(unittest.TestCase):
+    URL = 'https://tracker.test/browse.php'
+
+    def setUp(self):
+        self._clock = FakeClock()
+        patcher = self._clock.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self._pool = AuthPool([FakeAuth('a'), FakeAuth('b'), FakeAuth('c')],
+                              lambda url: url.startswith('https://tracker.test/'),
+                              request_interval=1.0, throttle_timeout=60.0)
+
+    def sign(self, url=URL, status_code=200, headers=None):
+        """Signs a request by the pool and answers it; returns the account."""
+
+        request = self._pool(requests.Request('GET', url).prepare())
+        for hook in request.hooks['response']:
+            hook(fake_response(status_code, headers))
+        return request.headers.get('X-Account')
+
+    def test_rotation(self):
+        self.assertEqual([self.sign() for _ in range(6)], ['a', 'b', 'c', 'a', 'b', 'c'])
+        # Every account waits out its own interval only
+        self.assertEqual(self._clock.sleeps, [1.0])
+
+    def test_foreign_host(self):
+        self.assertIsNone(self.sign('https://other.test/'))
+        self.assertEqual(self.sign(), 'a')
+
+    def test_throttled_account_is_skipped(self):
+        self.assertEqual(self.sign(status_code=429), 'a')
+        self.assertEqual([self.sign() for _ in range(4)], ['b', 'c', 'b', 'c'])
+
+        self._clock.now += 60.0
+        self.assertEqual([self.sign() for _ in range(3)], ['a', 'b', 'c'])
+
+    def test_retry_after(self):
+        self.assertEqual(self.sign(status_code=503, headers={'Retry-After': '5'}), 'a')
+        self.assertEqual(self.sign(), 'b')
+
+        self._clock.now += 5.0
+        self.assertEqual([self.sign() for _ in range(3)], ['c', 'a', 'b'])
+
+    def test_backoff(self):
+        pool = AuthPool([FakeAuth('a')], lambda url: True, request_interval=0.0, throttle_timeout=60.0)
+
+        def sign(status_code):
+            request = pool(requests.Request('GET', self.URL).prepare())
+            request.hooks['response'][0](fake_response(status_code))
+
+        # A single account is waited for when throttled; the timeout doubles with every failure in a row
+        sign(429)
+        sign(429)
+        sign(429)
+        self.assertEqual(self._clock.sleeps, [60.0, 120.0])
+
+        sign(200)
+        sign(429)
+        sign(200)
+        self.assertEqual(self._clock.sleeps, [60.0, 120.0, 240.0, 60.0])
+
+    def test_all_throttled(self):
+        self.sign(status_code=429, headers={'Retry-After': '30'})
+        self.sign(status_code=429, headers={'Retry-After': '10'})
+        self.sign(status_code=429, headers={'Retry-After': '20'})
+
+        self.assertEqual(self.sign(), 'b')
+        self.assertEqual(self._clock.sleeps, [10.0])
+
+    def test_empty(self):
+        self.assertRaises(ValueError, AuthPool, [], lambda url: True)
+
+
+class TestAccountConfigs(unittest.TestCase):
+    class AuthPlugin(newstudio.NewStudioAuthPlugin):
+        def __init__(self):
+            self.auth_cache = dict()
+            self.pool_cache = dict()
+
+        def get_account_auth_handler(self, config):
+            return FakeAuth(config['username'])
+
+    def test_account_configs(self):
+        account = {'username': 'a', 'password': 'x'}
+        self.assertEqual(account_configs(account), [account])
+        self.assertEqual(account_configs([account, account]), [account, account])
+
+    def test_single_account(self):
+        plugin = self.AuthPlugin()
+        handler = plugin.get_auth_handler({'username': 'a', 'password': 'x'})
+        self.assertIsInstance(handler, FakeAuth)
+
+        handler = plugin.get_auth_handler([{'username': 'a', 'password': 'x'}])
+        self.assertIsInstance(handler, FakeAuth)
+
+    def test_several_accounts(self):
+        plugin = self.AuthPlugin()
+        accounts = [{'username': 'a', 'password': 'x'}, {'username': 'b', 'password': 'y'}]
+        pool = plugin.get_auth_handler(accounts)
+        self.assertIsInstance(pool, AuthPool)
+        self.assertIs(plugin.get_auth_handler(accounts), pool)
+
+
+class TestParseSearchString(unittest.TestCase):
+    def assertParsed(self, search_string, title, season=None, episode=None, absolute=None):
+        search = parse_search_string(search_string)
+        self.assertIsNotNone(search, "The search string is not parsed: {0}".format(search_string))
+        self.assertEqual((search.title, search.season, search.episode, search.absolute),
+                         (title, season, episode, absolute))
+
+    def test_episode(self):
+        self.assertParsed('Fargo S01E02', 'Fargo', season=1, episode=2)
+        self.assertParsed('The Expanse s3e10', 'The Expanse', season=3, episode=10)
+        self.assertParsed('Fargo S01 E02', 'Fargo', season=1, episode=2)
+        self.assertParsed('  Fargo S01E02  ', 'Fargo', season=1, episode=2)
+        self.assertFalse(parse_search_string('Fargo S01E02').is_season_pack)
+
+    def test_x_episode(self):
+        self.assertParsed('Fargo 1x02', 'Fargo', season=1, episode=2)
+        self.assertEqual(parse_search_string('Fargo 1x02').get_episode_id(), 's01e02')
+
+    def test_season_pack(self):
+        self.assertParsed('Fargo S02', 'Fargo', season=2)
+        self.assertParsed('Fargo Season 2', 'Fargo', season=2)
+
+        search = parse_search_string('Fargo S02')
+        self.assertTrue(search.is_season_pack)
+        self.assertEqual(search.get_episode_id(), 's02')
+        self.assertTrue(search.matches(2, 1, 10))
+        self.assertFalse(search.matches(2, 3, 3))
+        self.assertFalse(search.matches(1, 1, 10))
+
+    def test_trailing_number(self):
+        # A number at the end of the title is a part of it, not an absolute episode number
+        self.assertIsNone(parse_search_string('Fargo 2014'))
+        self.assertIsNone(parse_search_string('24'))
+        self.assertParsed('Fargo 2014 S01E02', 'Fargo 2014', season=1, episode=2)
+        self.assertParsed('24 S08E01', '24', season=8, episode=1)
+
+    def test_absolute(self):
+        self.assertParsed('One Piece #123', 'One Piece', absolute=123)
+        self.assertParsed('One Piece Ep 123', 'One Piece', absolute=123)
+        self.assertParsed('One Piece E123', 'One Piece', absolute=123)
+        self.assertEqual(parse_search_string('One Piece #123').get_episode_id(), '#123')
+
+    def test_not_matching(self):
+        self.assertIsNone(parse_search_string('Fargo'))
+        self.assertIsNone(parse_search_string('Fargo2014'))
+        self.assertIsNone(parse_search_string(''))
+
+    def test_memoized(self):
+        self.assertIs(parse_search_string('Fargo S01E02'), parse_search_string('Fargo S01E02'))
+
+
+class TestSearchStringSupport(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        setup_database(self._directory.name)
+        self._task = LoadTask('test', requests.Session())
+
+    def tearDown(self):
+        self._task.requests.close()
+        self._directory.cleanup()
+
+    def test_absolute_is_not_supported(self):
+        entry = Entry(title='One Piece #123', url='', search_strings=['One Piece #123'])
+        with self.assertLogs(newstudio.log, 'DEBUG') as logs:
+            entries = newstudio.NewStudioPlugin().search(self._task, entry)
+
+        self.assertEqual(len(entries), 0)
+        self.assertIn('Absolute episode numbers are not supported: One Piece #123', '\n'.join(logs.output))
+
+    def test_invalid_is_skipped(self):
+        for search_string in ('Fargo', 'Fargo 2014', '24'):
+            entry = Entry(title=search_string, url='', search_strings=[search_string])
+            with self.assertLogs(newstudio.log, 'WARNING') as logs:
+                entries = newstudio.NewStudioPlugin().search(self._task, entry)
+
+            self.assertEqual(len(entries), 0)
+            self.assertIn('Invalid search string: {0}'.format(search_string), '\n'.join(logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main()